@@ -1,8 +1,9 @@
 import streamlit as st
 import pandas as pd
 import re
-import json
 import random
+import time
+from data_layer import pipeline_summary, list_tickets, paged_tickets, page_controls, ADMIN_TICKET_COLUMNS, finalize_project, get_ledger_totals, list_ledger, archive_billed_tickets, ARCHIVE_AFTER_DAYS, list_profiles, set_profile_roles
 
 # ==========================================
 # MATH & PARSING HELPER FUNCTIONS
@@ -42,6 +43,24 @@ def parse_time_to_days(time_str):
     else:
         return int(avg_val * 5) # Default assumption is weeks
 
+def ticket_budget_average(ticket):
+    """Midpoint of the typed budget columns; rows not yet backfilled fall back to parsing raw_cost."""
+    if ticket.get('budget_low') is None:
+        return extract_average_cost(ticket.get('raw_cost', '0'))
+    return (float(ticket['budget_low']) + float(ticket['budget_high'])) / 2
+
+def ticket_working_days(ticket):
+    """Midpoint of the typed timeline columns, with the same 30-day default as parse_time_to_days."""
+    if ticket.get('days_low') is None:
+        return parse_time_to_days(ticket.get('time', 'TBD'))
+    return int((ticket['days_low'] + ticket['days_high']) / 2)
+
+def changed_roles(original_df, edited_df):
+    """`[{"id", "role"}]` for every row whose role differs between the two directory frames."""
+    # Users who never picked a role have None on both sides, which `ne` alone would count as a change
+    changed = edited_df.loc[original_df["role"].fillna("").ne(edited_df["role"].fillna("")), ["id", "role"]]
+    return changed.to_dict("records")
+
 # ==========================================
 # THE MONTE CARLO BURN-RATE ENGINE
 # ==========================================
@@ -125,26 +144,25 @@ def render_admin_dashboard(supabase):
     tab1, tab2, tab3, tab4 = st.tabs(["Global Analytics", "Team Management", "Profitability Engine", "Monte Carlo Risk Engine"])
 
     try:
-        all_tickets_response = supabase.table("tickets").select("*").execute()
-        all_tickets = all_tickets_response.data
+        pipeline = pipeline_summary(supabase)
     except Exception as e:
         st.error(f"Failed to connect to database: {str(e)}")
-        all_tickets = []
+        pipeline = None
 
     # ==========================================
     # TAB 1: THE "GOD VIEW" ANALYTICS
     # ==========================================
     with tab1:
-        if not all_tickets:
+        if not pipeline or not pipeline["total_projects"]:
             st.info("No projects generated in the company yet.")
         else:
-            total_projects = len(all_tickets)
-            total_pipeline_value = sum([extract_average_cost(t.get('raw_cost', '0-0')) for t in all_tickets if t.get('status') != 'Completed & Billed'])
+            total_projects = pipeline["total_projects"]
+            total_pipeline_value = pipeline["pipeline_value"]
             
-            pm_queue = len([t for t in all_tickets if t.get('target_department') == 'PM'])
-            design_queue = len([t for t in all_tickets if t.get('target_department') == 'Design'])
-            eng_queue = len([t for t in all_tickets if t.get('target_department') == 'Engineering'])
-            completed = len([t for t in all_tickets if t.get('status') == 'Ready for Dev'])
+            pm_queue = pipeline["queues"]["PM"]
+            design_queue = pipeline["queues"]["Design"]
+            eng_queue = pipeline["queues"]["Engineering"]
+            completed = pipeline["ready_for_dev"]
 
             st.markdown("#### Organization Pipeline Overview")
             
@@ -180,8 +198,9 @@ def render_admin_dashboard(supabase):
             st.divider()
             st.markdown("#### Live Project Radar")
             
+            radar_tickets, radar_older = paged_tickets(supabase, "admin_radar", exclude_statuses=("Completed & Billed",), columns=ADMIN_TICKET_COLUMNS)
             radar_data = []
-            for t in all_tickets:
+            for t in radar_tickets:
                 if t.get("status") != "Completed & Billed":
                     radar_data.append({
                         "Creation Date": t.get("created_at", "").split("T")[0],
@@ -208,6 +227,7 @@ def render_admin_dashboard(supabase):
                 )
             else:
                 st.info("No active projects in the pipeline.")
+            page_controls("admin_radar", radar_tickets, radar_older)
 
     # ==========================================
     # TAB 2: TEAM MANAGEMENT 
@@ -218,8 +238,7 @@ def render_admin_dashboard(supabase):
         st.info("Assign department dashboards to users by clicking their 'Role' cell below, selecting a new department, and hitting Save.")
 
         try:
-            response = supabase.table("profiles").select("*").execute()
-            profiles_data = response.data
+            profiles_data = list_profiles(supabase)
             
             if not profiles_data:
                 st.warning("No user profiles found.")
@@ -250,14 +269,12 @@ def render_admin_dashboard(supabase):
                 
                 if st.button("Save Changes to Database", type="primary"):
                     with st.spinner("Pushing updates to enterprise servers..."):
-                        updates_made = False
-                        for index, row in edited_df.iterrows():
-                            if df.loc[index, 'role'] != row['role']:
-                                supabase.table("profiles").update({"role": row['role']}).eq("id", row['id']).execute()
-                                updates_made = True
+                        changes = changed_roles(df, edited_df)
                         
-                        if updates_made:
-                            st.success("User roles updated successfully!")
+                        if changes:
+                            started = time.perf_counter()
+                            updated_count = set_profile_roles(supabase, changes)
+                            st.toast(f"Updated {updated_count} user role(s) in {time.perf_counter() - started:.2f}s.")
                             st.rerun() 
                         else:
                             st.info("No changes detected.")
@@ -272,7 +289,11 @@ def render_admin_dashboard(supabase):
         st.markdown("#### Project Financial Close-Out")
         st.info("Log actual costs for completed projects to calibrate AI estimations and track agency profitability.")
 
-        ready_tickets = [t for t in all_tickets if t.get('status') == 'Ready for Dev']
+        try:
+            ready_tickets = list_tickets(supabase, status="Ready for Dev", columns=ADMIN_TICKET_COLUMNS)
+        except Exception as e:
+            st.error(f"Failed to load projects: {str(e)}")
+            ready_tickets = []
         
         with st.expander("Log a Completed Project", expanded=False):
             if not ready_tickets:
@@ -283,7 +304,7 @@ def render_admin_dashboard(supabase):
                 
                 if selected_ticket_name:
                     active_t = ticket_options[selected_ticket_name]
-                    est_cost = extract_average_cost(active_t.get('raw_cost', '0'))
+                    est_cost = ticket_budget_average(active_t)
                     
                     st.caption(f"**AI Estimated Budget:** ${est_cost:,.2f}")
                     
@@ -295,15 +316,8 @@ def render_admin_dashboard(supabase):
                         
                     if st.button("Finalize & Log Financials", type="primary", use_container_width=True):
                         try:
-                            full_data = json.loads(active_t['full_data']) if active_t.get('full_data') else {}
-                            full_data['actual_cost'] = actual_cost
-                            full_data['actual_time'] = actual_time
-                            
-                            supabase.table("tickets").update({
-                                "status": "Completed & Billed",
-                                "target_department": "None",
-                                "full_data": json.dumps(full_data)
-                            }).eq("id", active_t['id']).execute()
+                            # Closes the ticket, logs the actuals and updates the ledger totals in one transaction
+                            finalize_project(supabase, active_t['id'], actual_cost, actual_time)
                             
                             st.success("Project finalized! Financials logged.")
                             st.rerun()
@@ -313,26 +327,26 @@ def render_admin_dashboard(supabase):
         st.divider()
         st.markdown("#### Margin & Variance Analytics")
         
-        completed_tickets = [t for t in all_tickets if t.get('status') == 'Completed & Billed']
+        try:
+            ledger_totals = get_ledger_totals(supabase)
+            ledger_rows, ledger_older = paged_tickets(supabase, "admin_ledger", fetch=list_ledger)
+        except Exception as e:
+            st.error(f"Failed to load the project ledger: {str(e)}")
+            ledger_totals, ledger_rows, ledger_older = None, [], False
         
-        if not completed_tickets:
+        if not ledger_totals or not ledger_totals["project_count"]:
             st.info("Complete your first project above to generate financial analytics.")
         else:
             analytics_data = []
             chart_data = [] 
-            total_est = 0
-            total_actual = 0
+            total_est = float(ledger_totals["total_estimate"])
+            total_actual = float(ledger_totals["total_actual"])
             
-            for t in completed_tickets:
+            for t in ledger_rows:
                 try:
-                    data = json.loads(t['full_data'])
-                    est = extract_average_cost(t.get('raw_cost', '0'))
-                    act = float(data.get('actual_cost', est))
-                    
-                    total_est += est
-                    total_actual += act
-                    
-                    variance = est - act
+                    est = float(t["estimate"])
+                    act = float(t["actual"])
+                    variance = float(t["variance"])
                     margin_status = "✅ Profitable" if variance >= 0 else "🔴 Loss / Over-budget"
                     
                     proj_name = t.get("summary", "Unknown")[:30] + "..."
@@ -373,6 +387,17 @@ def render_admin_dashboard(supabase):
             st.markdown("##### Completed Project Ledger")
             analytics_df = pd.DataFrame(analytics_data)
             st.dataframe(analytics_df, use_container_width=True, hide_index=True)
+            page_controls("admin_ledger", ledger_rows, ledger_older)
+
+        with st.expander("Cold Storage", expanded=False):
+            st.caption(f"Compresses the generated specs of billed projects older than {ARCHIVE_AFTER_DAYS} days into the archive. Ledger numbers stay as they are and archived specs still open normally.")
+            if st.button("Archive Billed Projects", use_container_width=True):
+                try:
+                    with st.spinner("Archiving billed projects..."):
+                        archived_count = archive_billed_tickets(supabase)
+                    st.success(f"Archived {archived_count} project(s).")
+                except Exception as e:
+                    st.error(f"Failed to archive projects: {str(e)}")
 
     # ==========================================
     # TAB 4: THE MONTE CARLO RISK ENGINE (NEW)
@@ -382,7 +407,11 @@ def render_admin_dashboard(supabase):
         st.markdown("#### Quantitative Margin Predictor")
         st.info("Run 1,000 probabilistic simulations against an active project to predict exactly when the agency will start burning cash.")
 
-        active_projects = [t for t in all_tickets if t.get('status') != 'Completed & Billed' and t.get('status') != 'Draft']
+        try:
+            active_projects = list_tickets(supabase, exclude_statuses=("Completed & Billed", "Draft"), columns=ADMIN_TICKET_COLUMNS)
+        except Exception as e:
+            st.error(f"Failed to load projects: {str(e)}")
+            active_projects = []
         
         if not active_projects:
             st.warning("No active projects found in the pipeline. Please generate an Agile Ticket first.")
@@ -394,9 +423,9 @@ def render_admin_dashboard(supabase):
                 mc_ticket = mc_options[selected_mc_proj]
                 
                 # Extract Base Metrics
-                mc_budget = extract_average_cost(mc_ticket.get('raw_cost', '0'))
+                mc_budget = ticket_budget_average(mc_ticket)
                 mc_time_str = mc_ticket.get('time', 'TBD')
-                mc_days = parse_time_to_days(mc_time_str)
+                mc_days = ticket_working_days(mc_ticket)
                 mc_complexity = mc_ticket.get('complexity', 'Unknown')
                 
                 with st.container(border=True):
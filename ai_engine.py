@@ -0,0 +1,359 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from google import genai
+from google.genai import types
+
+# ==========================================
+# GLOBAL GEMINI SCHEDULER
+# ==========================================
+# Every LLM call in the process goes through one scheduler: a token bucket sized
+# for our Gemini quota, per-user fairness queues, and interactive work ahead of
+# background jobs. When the quota is exhausted requests wait in line instead of
+# failing independently in every session.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get("BRIDGEBUILD_GEMINI_RPM", "60"))
+GEMINI_BURST = int(os.environ.get("BRIDGEBUILD_GEMINI_BURST", "5"))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("BRIDGEBUILD_GEMINI_CONCURRENCY", "8"))
+
+# Provider 429s are put back at the head of the user's queue instead of failing.
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_COOLDOWN_SECONDS = 20
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Takes a token if one is available; otherwise returns the seconds until one will be."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def drain(self, seconds):
+        """Pushes the bucket into debt, e.g. after the provider answered 429."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+class _Job:
+    def __init__(self, user_id, fn, priority):
+        self.user_id = user_id
+        self.fn = fn
+        self.priority = priority
+        self.future = Future()
+        self.attempts = 0
+
+def _is_rate_limited(exc):
+    return getattr(exc, "code", None) == 429
+
+class FairScheduler:
+    """Round-robins queued LLM calls across users, interactive before background."""
+
+    def __init__(self, bucket, max_concurrency):
+        self._bucket = bucket
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bridgebuild-llm")
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._queues = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+        self._cond = threading.Condition()
+        threading.Thread(target=self._dispatch_loop, name="bridgebuild-llm-dispatch", daemon=True).start()
+
+    def submit(self, user_id, fn, priority=INTERACTIVE):
+        job = _Job(user_id, fn, priority)
+        with self._cond:
+            self._queues[priority].setdefault(user_id, deque()).append(job)
+            self._cond.notify()
+        return job.future
+
+    def position(self, future):
+        """1-based place in line for a queued call, or 0 once it has been dispatched."""
+        with self._cond:
+            ahead = 0
+            for priority in (INTERACTIVE, BACKGROUND):
+                users = list(self._queues[priority].values())
+                for user_index, queue in enumerate(users):
+                    for depth, job in enumerate(queue):
+                        if job.future is future:
+                            # Round-robin order: everyone's first job, then everyone's second...
+                            ahead += sum(min(len(q), depth) for q in users)
+                            ahead += sum(1 for q in users[:user_index] if len(q) > depth)
+                            return ahead + 1
+                ahead += sum(len(q) for q in users)
+            return 0
+
+    def _pop_next(self):
+        for priority in (INTERACTIVE, BACKGROUND):
+            queues = self._queues[priority]
+            if queues:
+                user_id, queue = next(iter(queues.items()))
+                job = queue.popleft()
+                del queues[user_id]
+                if queue:
+                    queues[user_id] = queue  # back of the line for this user's next job
+                return job
+        return None
+
+    def _requeue_front(self, job):
+        with self._cond:
+            queues = self._queues[job.priority]
+            queues.setdefault(job.user_id, deque()).appendleft(job)
+            queues.move_to_end(job.user_id, last=False)
+            self._cond.notify()
+
+    def _dispatch_loop(self):
+        while True:
+            self._slots.acquire()
+            with self._cond:
+                while not any(self._queues.values()):
+                    self._cond.wait()
+            wait = self._bucket.try_acquire()
+            while wait > 0:
+                time.sleep(min(wait, 1.0))
+                wait = self._bucket.try_acquire()
+            with self._cond:
+                job = self._pop_next()
+            if job is None or job.future.cancelled():
+                self._slots.release()
+                continue
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            result = job.fn()
+        except Exception as exc:
+            if _is_rate_limited(exc) and job.attempts < RATE_LIMIT_RETRIES:
+                job.attempts += 1
+                self._bucket.drain(RATE_LIMIT_COOLDOWN_SECONDS)
+                self._requeue_front(job)
+            elif not job.future.cancelled():
+                job.future.set_exception(exc)
+        else:
+            if not job.future.cancelled():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+SCHEDULER = FairScheduler(TokenBucket(GEMINI_REQUESTS_PER_MINUTE / 60.0, GEMINI_BURST), GEMINI_MAX_CONCURRENCY)
+
+_KEYED_CALLS = {}
+_KEYED_CALLS_LOCK = threading.Lock()
+
+def _failed(future):
+    return future.done() and (future.cancelled() or future.exception() is not None)
+
+def _mark_done(key, future):
+    with _KEYED_CALLS_LOCK:
+        entry = _KEYED_CALLS.get(key)
+        if not entry or entry[0] is not future:
+            return
+        if _failed(future):
+            # Failed calls are dropped straight away so the user can retry
+            del _KEYED_CALLS[key]
+        else:
+            entry[1] = time.monotonic()
+
+def schedule(user_id, fn, priority=INTERACTIVE, key=None):
+    """Queues an LLM call behind the global rate limiter and returns its future.
+
+    With a `key` (see `request_key`), a call with the same key that is still
+    in flight, or that succeeded within RESULT_GRACE_SECONDS, is returned
+    instead of queueing a second identical call.
+    """
+    if key is None:
+        return SCHEDULER.submit(user_id, fn, priority)
+    with _KEYED_CALLS_LOCK:
+        now = time.monotonic()
+        for stale in [k for k, (_, done_at) in _KEYED_CALLS.items() if done_at is not None and now - done_at > RESULT_GRACE_SECONDS]:
+            del _KEYED_CALLS[stale]
+        entry = _KEYED_CALLS.get(key)
+        if entry and not _failed(entry[0]):
+            return entry[0]
+        future = SCHEDULER.submit(user_id, fn, priority)
+        _KEYED_CALLS[key] = [future, None]
+    future.add_done_callback(lambda f: _mark_done(key, f))
+    return future
+
+def wait_for_result(future, on_position=None, poll_seconds=0.5):
+    """Blocks until the call finishes, reporting queue position changes as it waits."""
+    last_position = None
+    while True:
+        try:
+            return future.result(timeout=poll_seconds)
+        except FuturesTimeout:
+            position = SCHEDULER.position(future)
+            if on_position and position != last_position:
+                on_position(position)
+            last_position = position
+
+def queue_notice(slot):
+    """Builds an `on_position` callback that renders the queue position into a Streamlit slot."""
+    def _render(position):
+        if position:
+            slot.caption(f"⏳ The AI Engine is at capacity. You are #{position} in the queue...")
+        else:
+            slot.empty()
+    return _render
+
+# ==========================================
+# REQUEST KEYS
+# ==========================================
+# Streamlit reruns and impatient double-clicks re-enter the same button handler.
+# Every generation is keyed by its session and inputs. The job queue
+# (job_queue.enqueue) and `schedule(..., key=...)` for calls a button waits on
+# inline both hand an identical request the one already in flight instead of
+# firing a second Gemini call.
+
+# How long a finished result stays attachable, so the rerun that fires right
+# after a generation completes picks it up instead of starting over.
+RESULT_GRACE_SECONDS = 30
+
+def request_key(session_id, *parts):
+    """Hashes the session plus every input that shapes a generation into a registry key."""
+    digest = hashlib.sha256(str(session_id).encode("utf-8"))
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(hashlib.sha256(part).digest())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+# ==========================================
+# GEMINI FILE REGISTRY
+# ==========================================
+# Uploads are keyed by content hash and kept alive for their remote lifetime,
+# so the same client recording is uploaded once and then reused by every call
+# and every department, instead of being uploaded and deleted per generation.
+# Spooled uploads are streamed from disk in the SDK's resumable chunks; small
+# in-memory clips are streamed from their buffer.
+FILE_REUSE_MARGIN_SECONDS = 3600
+DEFAULT_FILE_TTL_SECONDS = 47 * 3600  # Gemini keeps uploads for 48 hours
+
+MIME_TYPES = {
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "m4a": "audio/mp4",
+    "ogg": "audio/ogg",
+    "txt": "text/plain",
+    "pdf": "application/pdf",
+}
+
+_FILE_REGISTRY = {}
+_FILE_LOCKS = {}
+_FILE_REGISTRY_LOCK = threading.Lock()
+
+class _ProgressFile(io.FileIO):
+    """Read-only file that reports how far the SDK has read through it."""
+
+    def __init__(self, path, on_progress):
+        super().__init__(path, "rb")
+        self._on_progress = on_progress
+        self._total = os.fstat(self.fileno()).st_size
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        if self._on_progress and self._total:
+            self._on_progress(self.tell(), self._total)
+        return chunk
+
+def _file_expiry(gemini_file):
+    expiration = getattr(gemini_file, "expiration_time", None)
+    if expiration is not None:
+        return expiration.timestamp() - FILE_REUSE_MARGIN_SECONDS
+    return time.time() + DEFAULT_FILE_TTL_SECONDS
+
+def _evict_expired_files(now):
+    """Drops expired handles, and the locks of hashes that are no longer registered and nobody holds."""
+    with _FILE_REGISTRY_LOCK:
+        for digest, (_, expires_at) in list(_FILE_REGISTRY.items()):
+            if expires_at <= now:
+                _FILE_REGISTRY.pop(digest, None)
+        for digest, lock in list(_FILE_LOCKS.items()):
+            if digest not in _FILE_REGISTRY and not lock.locked():
+                del _FILE_LOCKS[digest]
+
+def get_remote_file(client, file_bytes, file_name=None, upload=None, on_progress=None):
+    """Returns a live Gemini file handle, uploading only on a registry miss.
+
+    The content comes from `file_bytes`, or from a spooled `upload` record
+    (`path`, `file_name`, `sha256`) when `file_bytes` is None.
+    """
+    if upload is not None:
+        digest, file_name = upload["sha256"], upload["file_name"]
+    else:
+        digest = hashlib.sha256(file_bytes).hexdigest()
+    with _FILE_REGISTRY_LOCK:
+        lock = _FILE_LOCKS.setdefault(digest, threading.Lock())
+    # Per-hash lock: concurrent callers with the same recording wait for one upload
+    with lock:
+        entry = _FILE_REGISTRY.get(digest)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        # A miss is rare enough to sweep on; the registry would otherwise grow forever
+        _evict_expired_files(time.time())
+        ext = file_name.split('.')[-1].lower() if file_name and "." in file_name else ""
+        config = {"mime_type": MIME_TYPES.get(ext, "application/octet-stream")}
+        if file_name:
+            config["display_name"] = file_name
+        if upload is not None:
+            with _ProgressFile(upload["path"], on_progress) as source:
+                gemini_file = client.files.upload(file=source, config=config)
+        else:
+            gemini_file = client.files.upload(file=io.BytesIO(file_bytes), config=config)
+        _FILE_REGISTRY[digest] = (gemini_file, _file_expiry(gemini_file))
+        return gemini_file
+
+def forget_remote_file(file_bytes=None, upload=None):
+    """Drops a cached handle, e.g. after the provider no longer recognises it."""
+    digest = upload["sha256"] if upload is not None else hashlib.sha256(file_bytes).hexdigest()
+    _FILE_REGISTRY.pop(digest, None)
+
+# ==========================================
+# GEMINI GENERATION CALL
+# ==========================================
+def generate_content(api_key, model_id, system_instruction, temperature, text_instruction, file_bytes=None, file_name=None, upload=None, on_progress=None):
+    """Runs one multimodal generation and returns the raw response text.
+
+    The optional attachment is either in-memory `file_bytes` or a spooled
+    `upload` record. Safe to run off the script thread: it never touches Streamlit.
+    """
+    client = genai.Client(api_key=api_key)
+    config = types.GenerateContentConfig(system_instruction=system_instruction, temperature=temperature, response_mime_type="application/json")
+
+    if file_bytes is None and upload is None:
+        response = client.models.generate_content(model=model_id, config=config, contents=[text_instruction])
+        return response.text
+
+    try:
+        gemini_file = get_remote_file(client, file_bytes, file_name, upload, on_progress)
+        response = client.models.generate_content(model=model_id, config=config, contents=[gemini_file, text_instruction])
+    except Exception as exc:
+        if getattr(exc, "code", None) not in (403, 404):
+            raise
+        # The cached handle expired or was removed remotely: upload once more
+        forget_remote_file(file_bytes, upload)
+        gemini_file = get_remote_file(client, file_bytes, file_name, upload, on_progress)
+        response = client.models.generate_content(model=model_id, config=config, contents=[gemini_file, text_instruction])
+    return response.text
@@ -13,6 +13,9 @@ from engineering_dashboard import render_engineering_dashboard
 from marketing_dashboard import render_marketing_dashboard 
 from freelancer_dashboard import render_freelancer_dashboard
 from supabase import create_client
+from data_layer import get_profile, update_profile, start_inbox_subscriber
+from job_queue import start_workers
+from generation_jobs import register_generation_handlers
 
 # 1. PAGE CONFIG (Must absolute be first)
 st.set_page_config(
@@ -31,6 +34,16 @@ def init_supabase():
 
 supabase = init_supabase()
 
+# 3. START BACKGROUND GENERATION WORKERS AND THE INBOX SUBSCRIBER (once per server process)
+@st.cache_resource
+def init_job_workers(_supabase):
+    register_generation_handlers()
+    start_workers(_supabase, st.secrets.get("GOOGLE_API_KEY"))
+    start_inbox_subscriber(_supabase)
+    return True
+
+init_job_workers(supabase)
+
 class MockUser:
     def __init__(self, uid):
         self.id = uid
@@ -41,8 +54,8 @@ if "logged_in" not in st.session_state: st.session_state.logged_in = False
 
 def get_user_role(user_id):
     try:
-        response = supabase.table("profiles").select("role").eq("id", user_id).execute()
-        if response.data and len(response.data) > 0: return response.data[0]["role"]
+        profile = get_profile(supabase, user_id)
+        if profile: return profile["role"]
         return "pm"
     except: return "pm"
 
@@ -260,8 +273,7 @@ else:
     # Grab the user's settings so we know if they want Dark Mode!
     if "user_prefs" not in st.session_state:
         try:
-            res = supabase.table("profiles").select("*").eq("id", st.session_state.user.id).execute()
-            st.session_state.user_prefs = res.data[0] if res.data else {"currency": "USD ($)", "rate_standard": "US Agency ($150/hr)", "ai_model": "Gemini 1.5 Flash (Fast)", "dark_mode": False}
+            st.session_state.user_prefs = get_profile(supabase, st.session_state.user.id) or {"currency": "USD ($)", "rate_standard": "US Agency ($150/hr)", "ai_model": "Gemini 1.5 Flash (Fast)", "dark_mode": False}
         except:
             st.session_state.user_prefs = {"currency": "USD ($)", "rate_standard": "US Agency ($150/hr)", "ai_model": "Gemini 1.5 Flash (Fast)", "dark_mode": False}
 
@@ -305,7 +317,7 @@ else:
                 "dark_mode": new_dark # Save the theme state to DB!
             }
             try:
-                supabase.table("profiles").update(new_prefs).eq("id", st.session_state.user.id).execute()
+                update_profile(supabase, st.session_state.user.id, new_prefs)
                 st.session_state.user_prefs.update(new_prefs)
                 st.success("Global Settings Saved!")
                 st.rerun() # Instantly repaints the screen with the new theme!
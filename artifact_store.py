@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# ==========================================
+# CONTENT-ADDRESSED ARTIFACT STORE
+# ==========================================
+# Large generated artifacts (the Design Hub's React components and live sandbox
+# HTML) are kept out of the ticket's `full_data`. Each one is stored once under
+# the SHA-256 of its bytes, in a Supabase Storage bucket with a local directory
+# in front of it, and the ticket only keeps `{"artifact_ref": "<sha256>"}`.
+# Identical code generated twice is stored once, and ticket rows stay small.
+# Setting BRIDGEBUILD_ARTIFACT_BUCKET to an empty string keeps artifacts local.
+ARTIFACT_BUCKET = os.environ.get("BRIDGEBUILD_ARTIFACT_BUCKET", "artifacts")
+ARTIFACT_DIR = os.environ.get("BRIDGEBUILD_ARTIFACT_DIR", os.path.join(".bridgebuild", "artifacts"))
+ARTIFACT_INLINE_MAX_BYTES = 4096
+
+def _artifact_path(digest):
+    return os.path.join(ARTIFACT_DIR, digest[:2], digest)
+
+def _object_name(digest):
+    return f"{digest[:2]}/{digest}"
+
+def _write_local(digest, content):
+    path = _artifact_path(digest)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    with os.fdopen(fd, "wb") as dst:
+        dst.write(content)
+    os.replace(tmp_path, path)
+
+def put_artifact(supabase, content):
+    """Stores `content` (bytes) and returns its SHA-256. Storing the same bytes again is a no-op."""
+    digest = hashlib.sha256(content).hexdigest()
+    # The local copy is only written once the bucket has the bytes, so its
+    # presence means the upload succeeded and a failed upload is retried next time
+    if os.path.exists(_artifact_path(digest)):
+        return digest
+    if ARTIFACT_BUCKET:
+        try:
+            supabase.storage.from_(ARTIFACT_BUCKET).upload(_object_name(digest), content, {"content-type": "application/octet-stream"})
+        except Exception as e:
+            # Another instance already uploaded the same content
+            if "Duplicate" not in str(e) and "already exists" not in str(e):
+                raise
+    _write_local(digest, content)
+    return digest
+
+def get_artifact(supabase, digest):
+    """Bytes stored under `digest`, read from the local directory or pulled down from the bucket."""
+    path = _artifact_path(digest)
+    if os.path.exists(path):
+        with open(path, "rb") as src:
+            return src.read()
+    if not ARTIFACT_BUCKET:
+        raise FileNotFoundError(f"Artifact {digest} is not in {ARTIFACT_DIR}.")
+    content = supabase.storage.from_(ARTIFACT_BUCKET).download(_object_name(digest))
+    _write_local(digest, content)
+    return content
+
+def externalize(supabase, value, inline_max_bytes=ARTIFACT_INLINE_MAX_BYTES):
+    """Replaces a JSON-serializable value with an artifact reference when it is too big to keep inline."""
+    content = json.dumps(value, sort_keys=True).encode("utf-8")
+    if len(content) <= inline_max_bytes:
+        return value
+    return {"artifact_ref": put_artifact(supabase, content)}
+
+def resolve(supabase, value):
+    """Inverse of `externalize`. Values stored inline (including rows written before the store existed) pass through."""
+    if isinstance(value, dict) and set(value) == {"artifact_ref"}:
+        return json.loads(get_artifact(supabase, value["artifact_ref"]))
+    return value
@@ -0,0 +1,617 @@
+import base64
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import streamlit as st
+from artifact_store import resolve
+from utils import apply_json_diff, json_diff, parse_budget_range, parse_timeline_days, parse_timestamp
+
+# ==========================================
+# SUPABASE DATA-ACCESS HELPERS
+# ==========================================
+# ------------------------------------------
+# Write-invalidated read cache
+# ------------------------------------------
+# Streamlit reruns the whole script on every widget interaction, so toggling an
+# expander or moving a slider would re-run the same inbox, history and profile
+# queries. Reads are cached per table and query shape (which includes the user
+# filter) for a short TTL. Every write helper below drops its table's entries,
+# so the writer's own changes show up at once; writes made by other server
+# processes show up within the TTL.
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get("BRIDGEBUILD_QUERY_CACHE_TTL", "30"))
+QUERY_CACHE_MAX_ENTRIES = 2000
+
+_QUERY_CACHE = {}
+_TABLE_VERSIONS = {}
+_QUERY_CACHE_LOCK = threading.Lock()
+
+def _cached(table, shape, fetch):
+    """Returns `fetch()` for this query shape, reusing a fresh cached result."""
+    key = (table, shape)
+    now = time.monotonic()
+    with _QUERY_CACHE_LOCK:
+        hit = _QUERY_CACHE.get(key)
+        if hit and hit[1] > now:
+            return hit[0]
+        version = _TABLE_VERSIONS.get(table, 0)
+
+    result = fetch()
+    with _QUERY_CACHE_LOCK:
+        # A write landed while we were reading: the result may predate it, so don't keep it
+        if _TABLE_VERSIONS.get(table, 0) == version:
+            if len(_QUERY_CACHE) >= QUERY_CACHE_MAX_ENTRIES:
+                for stale in [k for k, (_, expires) in _QUERY_CACHE.items() if expires <= now] or list(_QUERY_CACHE):
+                    del _QUERY_CACHE[stale]
+            _QUERY_CACHE[key] = (result, now + QUERY_CACHE_TTL_SECONDS)
+    return result
+
+def invalidate(table):
+    """Drops every cached read of `table`. Called by the write helpers."""
+    with _QUERY_CACHE_LOCK:
+        _TABLE_VERSIONS[table] = _TABLE_VERSIONS.get(table, 0) + 1
+        for key in [k for k in _QUERY_CACHE if k[0] == table]:
+            del _QUERY_CACHE[key]
+
+# ------------------------------------------
+# Ticket writes
+# ------------------------------------------
+# Budgets and timelines are also stored as numbers (budget_low/high in USD,
+# days_low/high in working days), so SQL can filter, sort and sum them without
+# re-parsing the display strings. Every write that touches `raw_cost` or
+# `time` keeps the typed columns in step.
+BUDGET_CURRENCY = "USD"
+
+def _with_typed_estimate(fields):
+    fields = dict(fields)
+    if "raw_cost" in fields:
+        fields["budget_low"], fields["budget_high"] = parse_budget_range(fields["raw_cost"])
+        fields["currency"] = BUDGET_CURRENCY
+    if "time" in fields:
+        fields["days_low"], fields["days_high"] = parse_timeline_days(fields["time"])
+    return fields
+
+def insert_ticket(supabase, ticket, idempotency_key=None):
+    """Inserts a ticket and returns the stored row.
+
+    With an idempotency key the row is written at most once: a retried or
+    duplicated insert returns the row the first attempt created.
+    """
+    ticket = _with_typed_estimate(ticket)
+    if not idempotency_key:
+        row = supabase.table("tickets").insert(ticket).execute().data[0]
+        # After the write, so a read racing it can't cache a list without the new row
+        invalidate("tickets")
+        _publish([row])
+        return row
+
+    row = dict(ticket, idempotency_key=idempotency_key)
+    res = supabase.table("tickets").upsert(row, on_conflict="idempotency_key", ignore_duplicates=True).execute()
+    invalidate("tickets")
+    if res.data:
+        _publish(res.data)
+        return res.data[0]
+    return supabase.table("tickets").select("*").eq("idempotency_key", idempotency_key).execute().data[0]
+
+def update_ticket(supabase, ticket_id, fields):
+    """Updates one ticket and returns the stored row, or None if it no longer exists."""
+    res = supabase.table("tickets").update(_with_typed_estimate(fields)).eq("id", ticket_id).execute()
+    invalidate("tickets")
+    _publish(res.data)
+    return res.data[0] if res.data else None
+
+def delete_ticket(supabase, ticket_id):
+    supabase.table("tickets").delete().eq("id", ticket_id).execute()
+    invalidate("tickets")
+    _publish([], [ticket_id])
+    # A billed ticket's ledger row goes with it (on delete cascade)
+    invalidate("project_ledger")
+
+# ==========================================
+# TICKET ROUTING & STATUS HOOKS
+# ==========================================
+_STATUS_HOOKS = {}
+
+def on_status_change(status, fn):
+    """Registers `fn(ticket_row)` to run whenever a ticket is routed into `status`."""
+    _STATUS_HOOKS.setdefault(status, []).append(fn)
+
+def route_ticket(supabase, ticket_id, status, department):
+    """Moves a ticket into a department's inbox and fires the hooks for its new status."""
+    # The receiving team claims it afresh
+    row = update_ticket(supabase, ticket_id, {"status": status, "target_department": department, "claimed_by": None, "claimed_at": None})
+    if row:
+        for hook in _STATUS_HOOKS.get(status, []):
+            try:
+                hook(row)
+            except Exception:
+                # Hooks are best-effort extras; they must never fail the handoff itself.
+                logging.exception("Status hook %r failed for ticket %s", hook, ticket_id)
+    return row
+
+def claim_ticket(supabase, ticket_id, from_status, to_status, user_id):
+    """Accepts an inbox ticket for `user_id` unless a teammate got there first.
+
+    The status check and the write are one conditional UPDATE, so of two
+    concurrent claims exactly one matches a row. Returns the claimed row, or
+    None if the claim was lost.
+    """
+    res = (supabase.table("tickets")
+           .update({"status": to_status, "claimed_by": user_id, "claimed_at": datetime.now(timezone.utc).isoformat()})
+           .eq("id", ticket_id).eq("status", from_status).is_("claimed_by", "null")
+           .execute())
+    invalidate("tickets")
+    if res.data:
+        _publish(res.data)
+        return res.data[0]
+    # Lost the race: take the stale row out of the shared inboxes now rather than on the next poll
+    current = supabase.table("tickets").select(INBOX_COLUMNS).eq("id", ticket_id).execute().data
+    _publish(current, [] if current else [ticket_id])
+    return None
+
+# ==========================================
+# TICKET REVISIONS
+# ==========================================
+# Edits to a ticket's JSON are sent as a `json_diff` patch and applied by
+# `apply_ticket_revision` (supabase/migrations/0010), which logs each patch as
+# a revision and keeps a full snapshot every SNAPSHOT_EVERY revisions. Any
+# version is rebuilt from its nearest snapshot; undo restores the version
+# before the one currently shown, as a new revision.
+SNAPSHOT_EVERY = 10
+
+def save_ticket_data(supabase, ticket_id, old_data, new_data, fields=None, restored_from=None):
+    """Stores `new_data` as the ticket's next revision, shipping only what changed since `old_data`."""
+    revision = supabase.rpc("apply_ticket_revision", {
+        "p_ticket_id": ticket_id,
+        "p_ops": json_diff(old_data, new_data),
+        "p_fields": _with_typed_estimate(fields or {}),
+        "p_restored_from": restored_from,
+        "p_snapshot_every": SNAPSHOT_EVERY,
+    }).execute().data
+    invalidate("tickets")
+    return revision
+
+def get_ticket_version(supabase, ticket_id, revision):
+    """The ticket's JSON as of `revision`, or None if that revision was never recorded."""
+    def fetch():
+        chain = supabase.rpc("ticket_revision_chain", {"p_ticket_id": ticket_id, "p_revision": revision}).execute().data
+        if not chain or chain[-1]["revision"] != revision:
+            return None
+        doc = chain[0]["snapshot"]
+        for row in chain[1:]:
+            doc = apply_json_diff(doc, row["ops"])
+        return doc
+    # Recorded revisions never change
+    return _cached("ticket_revisions", (ticket_id, revision), fetch)
+
+def list_ticket_revisions(supabase, ticket_id, limit=20):
+    """Newest-first revision headers (revision, restored_from, created_at) of one ticket."""
+    query = (supabase.table("ticket_revisions").select("revision, restored_from, created_at")
+             .eq("ticket_id", ticket_id).order("revision", desc=True).limit(limit))
+    return _cached("tickets", ("revisions", ticket_id, limit), lambda: query.execute().data)
+
+def undo_target(revisions):
+    """Revision an undo goes back to, given `list_ticket_revisions` rows, or None if there is nothing to undo.
+
+    Undoing a restore steps further back instead of redoing the edit it undid.
+    """
+    if not revisions:
+        return None
+    latest = revisions[0]
+    shown = latest["restored_from"] if latest["restored_from"] is not None else latest["revision"]
+    return shown - 1 if shown > 0 else None
+
+# ==========================================
+# TRANSCRIPTS
+# ==========================================
+def get_transcript(supabase, file_hash):
+    """Returns the stored transcript for a recording hash, or None."""
+    res = supabase.table("transcripts").select("transcript").eq("file_hash", file_hash).execute()
+    return res.data[0]["transcript"] if res.data else None
+
+def save_transcript(supabase, file_hash, file_name, transcript):
+    """Stores a transcript once; a concurrent duplicate keeps the first copy."""
+    row = {"file_hash": file_hash, "file_name": file_name, "transcript": transcript}
+    supabase.table("transcripts").upsert(row, on_conflict="file_hash", ignore_duplicates=True).execute()
+
+# ==========================================
+# TICKET LIST QUERIES
+# ==========================================
+# Lists only render a ticket's headline fields. The `full_data` blob (which can
+# hold a whole generated React app) is fetched per ticket once it is opened.
+TICKET_LIST_COLUMNS = "id, summary, status, complexity, time, cost, created_at"
+ADMIN_TICKET_COLUMNS = TICKET_LIST_COLUMNS + ", raw_cost, target_department, budget_low, budget_high, days_low, days_high"
+
+def list_tickets(supabase, user_id=None, status=None, department=None, ticket_type=None, exclude_statuses=(), columns=TICKET_LIST_COLUMNS, limit=None, before=None):
+    """Newest-first ticket rows matching the filters, with only `columns` selected.
+
+    Inbox filters (`department` + `status`) and history filters (`user_id` +
+    `ticket_type`) each match a composite index ending in (created_at, id).
+    `before` is a `ticket_cursor` from a previous page: only rows older than it
+    are returned, so every page is an index range scan however deep it is.
+    """
+    query = supabase.table("tickets").select(columns)
+    if user_id:
+        query = query.eq("user_id", user_id)
+    if status:
+        query = query.eq("status", status)
+    if department:
+        query = query.eq("target_department", department)
+    if ticket_type:
+        query = query.eq("ticket_type", ticket_type)
+    for excluded in exclude_statuses:
+        query = query.neq("status", excluded)
+    if before:
+        created_at, ticket_id = before
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{ticket_id}")')
+    query = query.order("created_at", desc=True).order("id", desc=True)
+    if limit:
+        query = query.limit(limit)
+    shape = ("list", user_id, status, department, ticket_type, tuple(exclude_statuses), columns, limit, tuple(before) if before else None)
+    return _cached("tickets", shape, lambda: query.execute().data)
+
+def get_project_bundle(supabase, ticket_id):
+    """Every stage (quote, PM ticket, design, architecture) of the project `ticket_id` belongs to, oldest first.
+
+    One indexed query via the `project_bundle` function (supabase/migrations/0007).
+    """
+    return _cached("tickets", ("bundle", ticket_id), lambda: supabase.rpc("project_bundle", {"p_ticket_id": ticket_id}).execute().data)
+
+def get_inherited_frontend(supabase, ticket_id):
+    """Frontend code Design generated for the project `ticket_id` belongs to, or None.
+
+    Cached with the bundle, so reruns skip the artifact download and JSON parse
+    until a ticket write invalidates it.
+    """
+    if not ticket_id:
+        return None
+
+    def fetch():
+        for stage in reversed(get_project_bundle(supabase, ticket_id)):
+            if stage.get("ticket_type") != "design_spec":
+                continue
+            try:
+                frontend_code = resolve(supabase, json.loads(stage["full_data"]).get("generated_frontend_code"))
+            except:
+                continue
+            if frontend_code:
+                return frontend_code
+        return None
+    return _cached("tickets", ("inherited_frontend", ticket_id), fetch)
+
+def ticket_cursor(row):
+    """Keyset position of a listed row; `id` breaks ties between identical timestamps."""
+    return (row["created_at"], row["id"])
+
+# ==========================================
+# ADMIN PIPELINE AGGREGATES
+# ==========================================
+# Counts and pipeline value are grouped in the `ticket_pipeline_stats` view
+# (see supabase/migrations/0003 and 0005), so only a handful of rows ever leave the DB.
+PIPELINE_DEPARTMENTS = ("PM", "Design", "Engineering")
+
+def summarize_pipeline(stats_rows):
+    """Folds the view's (status, department) groups into the admin headline metrics."""
+    summary = {"total_projects": 0, "pipeline_value": 0.0, "ready_for_dev": 0, "queues": {dept: 0 for dept in PIPELINE_DEPARTMENTS}}
+    for row in stats_rows:
+        count = int(row["ticket_count"])
+        summary["total_projects"] += count
+        if row["status"] != "Completed & Billed":
+            summary["pipeline_value"] += float(row["pipeline_value"] or 0)
+        if row["status"] == "Ready for Dev":
+            summary["ready_for_dev"] += count
+        if row["target_department"] in summary["queues"]:
+            summary["queues"][row["target_department"]] += count
+    return summary
+
+def pipeline_summary(supabase):
+    rows = _cached("tickets", ("pipeline_stats",), lambda: supabase.table("ticket_pipeline_stats").select("*").execute().data)
+    return summarize_pipeline(rows)
+
+def get_ticket_full_data(supabase, ticket_id):
+    """The generated JSON payload of one ticket, or None if the ticket is gone. Archived tickets are rehydrated."""
+    def fetch():
+        res = supabase.table("tickets").select("full_data, archived_at").eq("id", ticket_id).execute()
+        if not res.data:
+            return None
+        if res.data[0]["full_data"] is None and res.data[0].get("archived_at"):
+            return _load_archived_full_data(supabase, ticket_id)
+        return res.data[0]["full_data"]
+    return _cached("tickets", ("full_data", ticket_id), fetch)
+
+# ==========================================
+# PROFITABILITY LEDGER
+# ==========================================
+# `finalize_project` (supabase/migrations/0004) closes a ticket out, writes its
+# ledger row and bumps the company totals atomically; readers never touch the
+# tickets themselves.
+def finalize_project(supabase, ticket_id, actual_cost, actual_time):
+    """Marks a project billed and logs its actuals. Safe to call twice."""
+    supabase.rpc("finalize_project", {"p_ticket_id": ticket_id, "p_actual": actual_cost, "p_actual_time": actual_time}).execute()
+    invalidate("tickets")
+    invalidate("project_ledger")
+
+def get_ledger_totals(supabase):
+    """Company-wide project_count, total_estimate, total_actual and total_variance, or None before the first close-out."""
+    def fetch():
+        res = supabase.table("ledger_totals").select("*").eq("id", 1).execute()
+        return res.data[0] if res.data else None
+    return _cached("project_ledger", ("totals",), fetch)
+
+def list_ledger(supabase, limit=None, before=None):
+    """Newest-first ledger rows, aliased to `id`/`created_at` so `ticket_cursor` pages them."""
+    query = supabase.table("project_ledger").select("id:ticket_id, summary, estimate, actual, variance, actual_time, created_at:closed_at")
+    if before:
+        closed_at, ticket_id = before
+        query = query.or_(f'closed_at.lt."{closed_at}",and(closed_at.eq."{closed_at}",ticket_id.lt."{ticket_id}")')
+    query = query.order("closed_at", desc=True).order("ticket_id", desc=True)
+    if limit:
+        query = query.limit(limit)
+    return _cached("project_ledger", ("list", limit, tuple(before) if before else None), lambda: query.execute().data)
+
+# ==========================================
+# COLD STORAGE FOR BILLED PROJECTS
+# ==========================================
+# Once a project is billed only its ledger numbers are read, so its `full_data`
+# is gzipped into `ticket_archive` (supabase/migrations/0009) and cleared from
+# the hot row, which keeps its headline columns. `get_ticket_full_data`
+# rehydrates archived tickets transparently.
+ARCHIVE_AFTER_DAYS = int(os.environ.get("BRIDGEBUILD_ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = 100
+
+def _compress(text):
+    return base64.b64encode(gzip.compress(text.encode("utf-8"), compresslevel=9)).decode("ascii")
+
+def _decompress(payload):
+    return gzip.decompress(base64.b64decode(payload)).decode("utf-8")
+
+def archive_billed_tickets(supabase, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Moves the full_data of billed tickets older than `older_than_days` into the archive. Returns how many moved."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat()
+    archived = 0
+    while True:
+        # Rows without full_data have nothing to archive; selecting them would return them every batch
+        rows = (supabase.table("tickets").select("id, full_data")
+                .eq("status", "Completed & Billed").is_("archived_at", "null").not_.is_("full_data", "null")
+                .lt("created_at", cutoff).limit(batch_size).execute().data)
+        if rows:
+            # The archive copy is written before the hot column is cleared, so a crash in between loses nothing
+            supabase.table("ticket_archive").upsert([
+                {"ticket_id": row["id"], "codec": "gzip", "payload": _compress(row["full_data"]), "original_bytes": len(row["full_data"].encode("utf-8"))}
+                for row in rows
+            ]).execute()
+            ids = [row["id"] for row in rows]
+            supabase.table("tickets").update({"full_data": None, "archived_at": datetime.now(timezone.utc).isoformat()}).in_("id", ids).execute()
+            archived += len(rows)
+        if len(rows) < batch_size:
+            break
+    if archived:
+        invalidate("tickets")
+    return archived
+
+def _load_archived_full_data(supabase, ticket_id):
+    res = supabase.table("ticket_archive").select("payload").eq("ticket_id", ticket_id).execute()
+    return _decompress(res.data[0]["payload"]) if res.data else None
+
+# ==========================================
+# PAGED HISTORY LISTS
+# ==========================================
+# Histories and admin tables show one keyset page at a time. The stack of
+# cursors for the pages already passed lives in session state under `key`.
+TICKET_PAGE_SIZE = int(os.environ.get("BRIDGEBUILD_TICKET_PAGE_SIZE", "20"))
+
+def paged_tickets(supabase, key, page_size=TICKET_PAGE_SIZE, fetch=None, **filters):
+    """Returns `(rows, has_older)` for the page of `fetch(**filters)` the user is on.
+
+    `fetch` defaults to `list_tickets`; any lister taking `limit` and a
+    `ticket_cursor` as `before` (e.g. `list_ledger`) works.
+    """
+    fetch = fetch or list_tickets
+    cursors = st.session_state.setdefault(f"{key}_cursors", [])
+    rows = fetch(supabase, limit=page_size + 1, before=cursors[-1] if cursors else None, **filters)
+    return rows[:page_size], len(rows) > page_size
+
+def page_controls(key, rows, has_older):
+    """Newer / Older buttons for a list fetched with `paged_tickets`."""
+    cursors = st.session_state.setdefault(f"{key}_cursors", [])
+    if not cursors and not has_older:
+        return
+    col_newer, col_page, col_older = st.columns([1, 2, 1])
+    with col_newer:
+        st.button("← Newer", key=f"{key}_newer", disabled=not cursors, on_click=cursors.pop, use_container_width=True)
+    with col_page:
+        st.caption(f"Page {len(cursors) + 1}")
+    with col_older:
+        st.button("Older →", key=f"{key}_older", disabled=not has_older, on_click=cursors.append, args=(ticket_cursor(rows[-1]) if rows else None,), use_container_width=True)
+
+@contextmanager
+def lazy_ticket_expander(supabase, label, item, key):
+    """An expander for a list row that only fetches the ticket's full_data once it is opened.
+
+    Yields the row with `full_data` filled in, or None while the expander is closed.
+    """
+    with st.expander(label, key=key, on_change="rerun") as expander:
+        # Closed expanders never touch full_data; it is fetched when one is opened
+        yield dict(item, full_data=get_ticket_full_data(supabase, item['id'])) if expander.open else None
+
+# ==========================================
+# SHARED INBOX CACHE
+# ==========================================
+# All sessions in the process read department inboxes from one in-memory
+# cache. A single subscriber thread keeps it current from the rows changed
+# since its watermark: `updated_at` is stamped by trigger, and deletions leave
+# a row in `deleted_tickets` (supabase/migrations/0011). Ticket writes made
+# through this module are published to the cache at once. Every change bumps
+# the inbox's version, and `watch_inbox` reruns the sessions showing that
+# inbox, so N open inboxes cost one poll rather than N repeated queries.
+# Each poll re-reads a few seconds before its watermark, so late-committing
+# transactions are still picked up; merging the same row twice is harmless.
+# A full reload every INBOX_FULL_SYNC_SECONDS bounds any drift.
+# A claimed ticket stays listed for INBOX_CLAIMED_SECONDS with a "claimed by"
+# badge instead of vanishing, so teammates can see where it went.
+INBOX_COLUMNS = TICKET_LIST_COLUMNS + ", target_department, updated_at, claimed_by, claimed_at"
+INBOX_POLL_SECONDS = float(os.environ.get("BRIDGEBUILD_INBOX_POLL_SECONDS", "2"))
+INBOX_SYNC_OVERLAP_SECONDS = 5
+INBOX_FULL_SYNC_SECONDS = 300
+INBOX_ERROR_LOG_SECONDS = 60
+INBOX_CLAIMED_SECONDS = 600
+INBOX_CLAIMED_STATUSES = {
+    "Awaiting PM Scoping": "Accepted by PM",
+    "Awaiting UI/UX Scoping": "Accepted by Design",
+    "Awaiting Tech Architecture": "Accepted by Engineering",
+}
+
+_INBOXES = {}
+_INBOX_SYNC = {"watermark": None, "loaded_at": 0.0, "supabase": None, "thread": None, "error_logged_at": float("-inf")}
+_INBOX_LOCK = threading.Lock()
+
+def _recently_claimed(row):
+    if not row.get("claimed_at"):
+        return False
+    return datetime.now(timezone.utc) - parse_timestamp(row["claimed_at"]) < timedelta(seconds=INBOX_CLAIMED_SECONDS)
+
+def _in_inbox(row, department, status):
+    if row["target_department"] != department:
+        return False
+    return row["status"] == status or (row["status"] == INBOX_CLAIMED_STATUSES.get(status) and _recently_claimed(row))
+
+def _publish(rows, deleted_ids=()):
+    """Merges changed ticket rows into every cached inbox, bumping the versions of those that changed."""
+    with _INBOX_LOCK:
+        for (department, status), inbox in _INBOXES.items():
+            changed = False
+            for row in rows:
+                if "status" not in row or "target_department" not in row:
+                    continue
+                if _in_inbox(row, department, status):
+                    # Write helpers hand over whole rows; keep only what the inbox renders
+                    inbox["rows"][row["id"]] = {k: row[k] for k in INBOX_COLUMNS.split(", ") if k in row}
+                    changed = True
+                elif inbox["rows"].pop(row["id"], None):
+                    # Re-routed, sent back, or claimed long enough ago: it has left this inbox
+                    changed = True
+            for ticket_id in deleted_ids:
+                if inbox["rows"].pop(ticket_id, None):
+                    changed = True
+            if changed:
+                inbox["version"] += 1
+
+def _load_inbox(supabase, department, status):
+    rows = list_tickets(supabase, status=status, department=department, columns=INBOX_COLUMNS)
+    if status in INBOX_CLAIMED_STATUSES:
+        since = (datetime.now(timezone.utc) - timedelta(seconds=INBOX_CLAIMED_SECONDS)).isoformat()
+        rows = rows + (supabase.table("tickets").select(INBOX_COLUMNS)
+                       .eq("target_department", department).eq("status", INBOX_CLAIMED_STATUSES[status])
+                       .gte("claimed_at", since).execute().data)
+    with _INBOX_LOCK:
+        inbox = _INBOXES.setdefault((department, status), {"rows": {}, "version": 0})
+        inbox["rows"] = {row["id"]: row for row in rows}
+        inbox["version"] += 1
+
+def _poll_inboxes():
+    supabase = _INBOX_SYNC["supabase"]
+    if time.monotonic() - _INBOX_SYNC["loaded_at"] > INBOX_FULL_SYNC_SECONDS:
+        _INBOX_SYNC["watermark"] = datetime.now(timezone.utc).isoformat()
+        _INBOX_SYNC["loaded_at"] = time.monotonic()
+        for department, status in list(_INBOXES):
+            _load_inbox(supabase, department, status)
+        return
+    since = (parse_timestamp(_INBOX_SYNC["watermark"]) - timedelta(seconds=INBOX_SYNC_OVERLAP_SECONDS)).isoformat()
+    rows = supabase.table("tickets").select(INBOX_COLUMNS).gte("updated_at", since).execute().data
+    deleted = supabase.table("deleted_tickets").select("id").gte("deleted_at", since).execute().data
+    _publish(rows, [row["id"] for row in deleted])
+    for row in rows:
+        if parse_timestamp(row["updated_at"]) > parse_timestamp(_INBOX_SYNC["watermark"]):
+            _INBOX_SYNC["watermark"] = row["updated_at"]
+
+def _poll_safely():
+    try:
+        _poll_inboxes()
+    except Exception:
+        # A failed poll is retried on the next tick; the cache keeps serving the last good state.
+        # A persistent failure is logged once per INBOX_ERROR_LOG_SECONDS rather than every tick.
+        if time.monotonic() - _INBOX_SYNC["error_logged_at"] >= INBOX_ERROR_LOG_SECONDS:
+            _INBOX_SYNC["error_logged_at"] = time.monotonic()
+            logging.exception("Inbox poll failed; inboxes are serving their last good state")
+
+def _inbox_subscriber_loop():
+    while True:
+        time.sleep(INBOX_POLL_SECONDS)
+        _poll_safely()
+
+def start_inbox_subscriber(supabase):
+    """Starts the process-wide inbox subscriber thread once."""
+    with _INBOX_LOCK:
+        _INBOX_SYNC["supabase"] = supabase
+        if _INBOX_SYNC["thread"] is not None:
+            return
+        _INBOX_SYNC["watermark"] = datetime.now(timezone.utc).isoformat()
+        _INBOX_SYNC["loaded_at"] = time.monotonic()
+        _INBOX_SYNC["thread"] = threading.Thread(target=_inbox_subscriber_loop, name="bridgebuild-inbox-subscriber", daemon=True)
+        _INBOX_SYNC["thread"].start()
+
+def get_inbox(supabase, department, status):
+    """Newest-first tickets waiting in a department inbox, from the shared cache.
+
+    The first session to open an inbox loads it; everyone else reads memory.
+    Recently claimed tickets follow the waiting ones, with `claimed_by` set.
+    """
+    with _INBOX_LOCK:
+        loaded = (department, status) in _INBOXES
+    if not loaded:
+        _load_inbox(supabase, department, status)
+    with _INBOX_LOCK:
+        inbox = _INBOXES[(department, status)]
+        # Recorded first: if anything below raises, watch_inbox must not keep rerunning the page
+        st.session_state[f"inbox_version_{department}"] = inbox["version"]
+        for ticket_id, row in list(inbox["rows"].items()):
+            if row["status"] != status and not _recently_claimed(row):
+                del inbox["rows"][ticket_id]
+        return sorted(inbox["rows"].values(), key=lambda row: (row["status"] == status, row["created_at"], row["id"]), reverse=True)
+
+def claim_badge(row, user_id):
+    """One-line label for a claimed inbox ticket: who took it and how long ago."""
+    minutes = int((datetime.now(timezone.utc) - parse_timestamp(row["claimed_at"])).total_seconds() // 60)
+    who = "you" if row["claimed_by"] == user_id else "a teammate"
+    when = "just now" if minutes < 1 else f"{minutes} min ago"
+    return f"🔒 Claimed by {who} {when}"
+
+@st.fragment(run_every=INBOX_POLL_SECONDS)
+def watch_inbox(department, status):
+    """Reruns the page when the shared inbox changes after this session last rendered it. Costs no queries."""
+    with _INBOX_LOCK:
+        inbox = _INBOXES.get((department, status))
+        version = inbox["version"] if inbox else None
+    if version is not None and version != st.session_state.get(f"inbox_version_{department}"):
+        st.rerun()
+
+# ==========================================
+# PROFILES
+# ==========================================
+def get_profile(supabase, user_id):
+    """The user's profile row (role and saved settings), or None."""
+    def fetch():
+        res = supabase.table("profiles").select("*").eq("id", user_id).execute()
+        return res.data[0] if res.data else None
+    profile = _cached("profiles", ("profile", user_id), fetch)
+    # Callers keep and edit this dict in session state; don't hand out the cached one
+    return dict(profile) if profile else None
+
+def list_profiles(supabase):
+    return _cached("profiles", ("list",), lambda: supabase.table("profiles").select("*").execute().data)
+
+def update_profile(supabase, user_id, fields):
+    supabase.table("profiles").update(fields).eq("id", user_id).execute()
+    invalidate("profiles")
+
+def set_profile_roles(supabase, changes):
+    """Applies `[{"id": ..., "role": ...}, ...]` in one round trip (supabase/migrations/0013). Returns the rows updated."""
+    if not changes:
+        return 0
+    updated = supabase.rpc("set_profile_roles", {"p_changes": changes}).execute().data
+    invalidate("profiles")
+    return updated
@@ -2,15 +2,17 @@ import streamlit as st
 import streamlit.components.v1 as components
 import json
 import os
-import tempfile
 import io
 import re
 from urllib.parse import quote
 from datetime import datetime, timezone, timedelta
-from google import genai
-from google.genai import types
-from prompts import get_design_prompt, get_design_to_code_prompt
+from prompts import get_design_to_code_prompt
 from utils import safe_parse_json
+from ai_engine import schedule, wait_for_result, queue_notice, generate_content, request_key
+from job_queue import watch_job
+from artifact_store import externalize
+from data_layer import route_ticket, get_inbox, watch_inbox, claim_ticket, claim_badge, paged_tickets, page_controls, lazy_ticket_expander, delete_ticket, save_ticket_data
+from generation_jobs import design_spec_payload, design_handoff_context, find_handoff_draft, adopt_draft, submit_generation
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
@@ -127,6 +129,14 @@ def generate_local_design_pdf(ticket_data):
 # ==========================================
 # DESIGN DASHBOARD RENDERER
 # ==========================================
+def _load_generated_design(result):
+    """Opens the design spec a finished background generation saved."""
+    st.session_state.active_design_ticket = result["data"]
+    st.session_state.active_design_ticket_id = result["ticket_id"]
+    st.session_state.active_generated_code = None
+    # The handoff is saved; later generations in this session start their own project
+    st.session_state.design_parent_ticket_id = None
+
 def render_design_dashboard(supabase):
 
     st.title("BridgeBuild AI - UX/UI Design Intake")
@@ -141,43 +151,56 @@ def render_design_dashboard(supabase):
         st.session_state.active_design_ticket_id = None
     if "active_generated_code" not in st.session_state:
         st.session_state.active_generated_code = None
+    if "design_generation_job" not in st.session_state:
+        st.session_state.design_generation_job = None
+    if "design_draft_job" not in st.session_state:
+        st.session_state.design_draft_job = None
+    if "design_parent_ticket_id" not in st.session_state:
+        st.session_state.design_parent_ticket_id = None
+
+    model_choice = st.session_state.get("user_prefs", {}).get("ai_model", "Gemini 1.5 Flash (Fast)")
 
     # ==========================================
     # INCOMING PM QUEUE (INBOX)
     # ==========================================
     try:
-        inbox_res = supabase.table("tickets").select("*").eq("status", "Awaiting UI/UX Scoping").eq("target_department", "Design").order("created_at", desc=True).execute()
-        inbox_tickets = inbox_res.data
+        inbox_tickets = get_inbox(supabase, "Design", "Awaiting UI/UX Scoping")
         
         if inbox_tickets:
-            st.info(f"**INCOMING:** You have {len(inbox_tickets)} approved Agile ticket(s) from the PM Hub waiting for Design!")
+            waiting = [item for item in inbox_tickets if not item.get('claimed_by')]
+            st.info(f"**INCOMING:** You have {len(waiting)} approved Agile ticket(s) from the PM Hub waiting for Design!")
             for item in inbox_tickets:
-                with st.expander(f"Incoming Agile Ticket: {item['summary'][:60]}..."):
-                    try:
-                        pm_data = json.loads(item['full_data'])
-                    except:
-                        pm_data = {}
-                        
+                if item.get('claimed_by'):
+                    st.caption(f"{claim_badge(item, st.session_state.user.id)} · Incoming Agile Ticket: {item['summary'][:60]}...")
+                    continue
+                with lazy_ticket_expander(supabase, f"Incoming Agile Ticket: {item['summary'][:60]}...", item, f"design_inbox_{item['id']}") as item:
+                    if item is None:
+                        continue
                     st.write(f"**Dev Time:** {item['time']} | **Complexity:** {item['complexity']}")
                     
-                    if st.button("Accept & Load into Studio", key=f"accept_{item['id']}", type="primary"):
-                        supabase.table("tickets").update({"status": "Accepted by Design"}).eq("id", item['id']).execute()
-                        
-                        injection_text = f"PM HANDOFF CONTEXT:\nProject Summary: {pm_data.get('summary', item['summary'])}\n"
-                        if "mvp_user_stories" in pm_data:
-                            injection_text += "User Stories to Design For:\n"
-                            for story in pm_data.get("mvp_user_stories", []):
-                                injection_text += f"- {story.get('story')}\n"
-                        else:
-                            injection_text += f"Features to Design For: {pm_data.get('mvp_features', [])}\n"
-                            
+                    accepted = st.button("Accept & Load into Studio", key=f"accept_{item['id']}", type="primary")
+                    if accepted and not claim_ticket(supabase, item['id'], "Awaiting UI/UX Scoping", "Accepted by Design", st.session_state.user.id):
+                        st.toast("A teammate already accepted this ticket.")
+                        st.rerun()
+                    elif accepted:
+                        injection_text = design_handoff_context(item)
                         st.session_state.design_input = injection_text
                         st.session_state.active_generated_code = None 
+
+                        # Pick up the draft pre-generated when PM routed the ticket, if it matches our settings
+                        model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
+                        draft = find_handoff_draft("design_spec", item['id'], design_spec_payload(model_id, injection_text))
+                        st.session_state.design_draft_job = draft["id"] if draft else None
+                        # The design generated from this handoff joins the PM ticket's project
+                        st.session_state.design_parent_ticket_id = item['id']
                         st.rerun()
             st.divider()
     except Exception as e:
         st.warning(f"Could not load Inbox: {str(e)}")
 
+    # New handoffs show up without a manual refresh
+    watch_inbox("Design", "Awaiting UI/UX Scoping")
+
     # ==========================================
     # GENERATOR UI
     # ==========================================
@@ -191,7 +214,6 @@ def render_design_dashboard(supabase):
     design_input = st.text_area("Paste Text or Review PM Context:", value=st.session_state.design_input, height=150, placeholder="Example: Client wants a fitness app where users can track workouts and share with friends. Needs to feel modern and energetic.")
 
     api_key = st.secrets.get("GOOGLE_API_KEY")
-    model_choice = st.session_state.get("user_prefs", {}).get("ai_model", "Gemini 1.5 Flash (Fast)")
 
     if st.button("Generate Design Architecture", type="primary"):
         if not api_key:
@@ -199,73 +221,16 @@ def render_design_dashboard(supabase):
         elif not design_input and not uploaded_file:
             st.warning("Please enter text or upload a file to proceed.")
         else:
-            try:
-                client = genai.Client(api_key=api_key)
-                DESIGN_PROMPT = get_design_prompt()
-
-                with st.status("Initializing Design Studio...", expanded=True) as status:
-                    st.write("Empathizing with target audience...")
-                    model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
-                    prompt_contents = []
-                    
-                    if uploaded_file:
-                        st.write("Listening to client vibe and requirements...")
-                        file_ext = f".{uploaded_file.name.split('.')[-1]}"
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-                            tmp.write(uploaded_file.getvalue())
-                            tmp_path = tmp.name
-                        
-                        gemini_file = client.files.upload(file=tmp_path)
-                        prompt_contents.append(gemini_file)
-                        os.remove(tmp_path)
-                    
-                    st.write("Sketching core user flows and wireframe layouts...")
-                    text_instruction = design_input if design_input else "Extract UX/UI design requirements from this request."
-                    prompt_contents.append(text_instruction)
-                    
-                    response = client.models.generate_content(
-                        model=model_id, 
-                        config=types.GenerateContentConfig(
-                            system_instruction=DESIGN_PROMPT,
-                            temperature=0.4,
-                            response_mime_type="application/json"
-                        ),
-                        contents=prompt_contents
-                    )
-                    
-                    if uploaded_file:
-                        st.write("Cleaning up workspace...")
-                        client.files.delete(name=gemini_file.name)
-                    
-                    st.write("Selecting color palettes and accessibility standards...")
-                    data, error_msg = safe_parse_json(response.text)
-                    
-                    if error_msg:
-                        status.update(label="Architecture Failed", state="error", expanded=True)
-                        st.error(error_msg)
-                        st.stop()
-                    else:
-                        status.update(label="Design Architecture Complete!", state="complete", expanded=False)
-                        st.session_state.active_design_ticket = data
-                        st.session_state.active_generated_code = None 
+            model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
+            text_instruction = design_input if design_input else "Extract UX/UI design requirements from this request."
+            payload = design_spec_payload(model_id, text_instruction)
+            submit_generation("design_spec", payload, "design_generation_job", st.session_state.design_parent_ticket_id, uploaded_file)
 
-                new_ticket = {
-                    "user_id": st.session_state.user.id,
-                    "summary": data.get("project_vision", "Design Architecture")[:200],
-                    "cost": "N/A (Design Phase)",
-                    "raw_cost": "0-0",
-                    "complexity": "UI/UX Scoping", 
-                    "time": "TBD",
-                    "full_data": response.text,
-                    "status": "Draft",
-                    "target_department": "None"
-                }
-                db_res = supabase.table("tickets").insert(new_ticket).execute()
-                st.session_state.active_design_ticket_id = db_res.data[0]['id']
-                st.rerun()
+    if st.session_state.design_generation_job:
+        watch_job("design_generation_job", "Sketching core user flows and wireframe layouts...", lambda job: _load_generated_design(job["result"]))
 
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+    if st.session_state.design_draft_job:
+        watch_job("design_draft_job", "Loading the pre-generated draft for this handoff...", lambda job: _load_generated_design(adopt_draft(supabase, job, st.session_state.user.id)))
 
     # ==========================================
     # RENDER THE ACTIVE DESIGN UI 
@@ -344,7 +309,6 @@ def render_design_dashboard(supabase):
 
         if st.button("Generate Code Boilerplate & Live Preview", type="primary", use_container_width=True):
             try:
-                client = genai.Client(api_key=api_key)
                 CODE_PROMPT = get_design_to_code_prompt()
                 model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
 
@@ -352,17 +316,10 @@ def render_design_dashboard(supabase):
                     context = f"DESIGN SPECS:\n{json.dumps(data)}"
                     
                     st.write("Generating React components and Tailwind styling...")
-                    response = client.models.generate_content(
-                        model=model_id,
-                        config=types.GenerateContentConfig(
-                            system_instruction=CODE_PROMPT,
-                            temperature=0.2, 
-                            response_mime_type="application/json"
-                        ),
-                        contents=[context]
-                    )
+                    job = schedule(st.session_state.user.id, lambda: generate_content(api_key, model_id, CODE_PROMPT, 0.2, context), key=request_key(st.session_state.user.id, "design_code", model_id, context))
+                    response_text = wait_for_result(job, queue_notice(st.empty()))
                     
-                    code_data, error_msg = safe_parse_json(response.text)
+                    code_data, error_msg = safe_parse_json(response_text)
                     if error_msg:
                         status.update(label="Code Generation Failed", state="error", expanded=True)
                         st.error(error_msg)
@@ -370,9 +327,11 @@ def render_design_dashboard(supabase):
                         status.update(label="Boilerplate Code Ready!", state="complete", expanded=False)
                         st.session_state.active_generated_code = code_data
                         
-                        st.session_state.active_design_ticket["generated_frontend_code"] = code_data
+                        # The ticket keeps a reference; the code itself goes to the artifact store
+                        previous_design = dict(st.session_state.active_design_ticket)
+                        st.session_state.active_design_ticket["generated_frontend_code"] = externalize(supabase, code_data)
                         if st.session_state.active_design_ticket_id:
-                            supabase.table("tickets").update({"full_data": json.dumps(st.session_state.active_design_ticket)}).eq("id", st.session_state.active_design_ticket_id).execute()
+                            save_ticket_data(supabase, st.session_state.active_design_ticket_id, previous_design, st.session_state.active_design_ticket)
             except Exception as e:
                 st.error(f"Error: {str(e)}")
 
@@ -448,7 +407,7 @@ def render_design_dashboard(supabase):
         if st.session_state.get("active_design_ticket_id"):
             if st.button("Approve & Send to Engineering", type="primary", use_container_width=True):
                 try:
-                    supabase.table("tickets").update({"status": "Awaiting Tech Architecture", "target_department": "Engineering"}).eq("id", st.session_state.active_design_ticket_id).execute()
+                    route_ticket(supabase, st.session_state.active_design_ticket_id, "Awaiting Tech Architecture", "Engineering")
                     st.success("Successfully routed to the Engineering Inbox.")
                 except Exception as e:
                     st.error(f"Failed to handoff ticket: {str(e)}")
@@ -458,8 +417,7 @@ def render_design_dashboard(supabase):
     st.subheader("Saved Design Architectures")
     
     try:
-        db_response = supabase.table("tickets").select("*").eq("user_id", st.session_state.user.id).eq("complexity", "UI/UX Scoping").order("created_at", desc=True).execute()
-        saved_tickets = db_response.data
+        saved_tickets, has_older = paged_tickets(supabase, "design_history", user_id=st.session_state.user.id, ticket_type="design_spec")
         
         if saved_tickets:
             for item in saved_tickets:
@@ -472,7 +430,9 @@ def render_design_dashboard(supabase):
                 else:
                     status_icon = "✅"
 
-                with st.expander(f"{status_icon} Design: {item['summary'][:60]}..."):
+                with lazy_ticket_expander(supabase, f"{status_icon} Design: {item['summary'][:60]}...", item, f"design_hist_{item['id']}") as item:
+                    if item is None:
+                        continue
                     
                     if current_status in ['Draft', 'Accepted by Design']:
                         st.caption(f"Status: **{current_status} (Not Sent)**")
@@ -513,7 +473,7 @@ def render_design_dashboard(supabase):
                             st.warning("Are you sure?")
                             if st.button("Confirm Delete", key=f"confirm_del_design_{item['id']}", type="primary"):
                                 try:
-                                    supabase.table("tickets").delete().eq("id", item['id']).execute()
+                                    delete_ticket(supabase, item['id'])
                                     st.rerun()
                                 except Exception as e:
                                     st.error(f"Failed to delete: {str(e)}")
@@ -531,7 +491,7 @@ def render_design_dashboard(supabase):
                     if current_status in ['Draft', 'Accepted by Design']:
                         st.markdown("##### Route Ticket")
                         if st.button("Send to Engineering", key=f"hist_eng_{item['id']}", use_container_width=True):
-                            supabase.table("tickets").update({"status": "Awaiting Tech Architecture", "target_department": "Engineering"}).eq("id", item['id']).execute()
+                            route_ticket(supabase, item['id'], "Awaiting Tech Architecture", "Engineering")
                             st.rerun()
 
                     st.divider()
@@ -548,6 +508,6 @@ def render_design_dashboard(supabase):
                             
         else:
             st.info("No saved design concepts yet. Start ideating above!")
-            
+        page_controls("design_history", saved_tickets, has_older)
     except Exception as e:
         st.error(f"Could not load history: {str(e)}")
@@ -1,15 +1,14 @@
 import streamlit as st
 import json
 import os
-import tempfile
 import io
 import csv
 from urllib.parse import quote
 from datetime import datetime, timezone, timedelta
-from google import genai
-from google.genai import types
-from prompts import get_engineering_prompt
-from utils import clean_json_output, safe_parse_json
+from utils import clean_json_output
+from job_queue import watch_job
+from data_layer import get_inherited_frontend, get_inbox, watch_inbox, claim_ticket, claim_badge, paged_tickets, page_controls, lazy_ticket_expander, update_ticket, delete_ticket
+from generation_jobs import eng_architecture_payload, eng_handoff_context, find_handoff_draft, adopt_draft, submit_generation
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
@@ -231,6 +230,13 @@ def provision_github_repo(token, repo_name, eng_data, frontend_code):
 # ==========================================
 # ENGINEERING DASHBOARD RENDERER
 # ==========================================
+def _load_generated_architecture(result):
+    """Opens the architecture a finished background generation saved."""
+    st.session_state.active_eng_ticket = result["data"]
+    st.session_state.active_eng_ticket_id = result["ticket_id"]
+    # The handoff is saved; later generations in this session start their own project
+    st.session_state.eng_parent_ticket_id = None
+
 def render_engineering_dashboard(supabase):
 
     with st.sidebar:
@@ -260,55 +266,54 @@ def render_engineering_dashboard(supabase):
         st.session_state.active_eng_ticket = None
     if "active_eng_ticket_id" not in st.session_state: 
         st.session_state.active_eng_ticket_id = None
-    if "inherited_frontend" not in st.session_state:
-        st.session_state.inherited_frontend = None
+    if "eng_parent_ticket_id" not in st.session_state:
+        st.session_state.eng_parent_ticket_id = None
+    if "eng_generation_job" not in st.session_state:
+        st.session_state.eng_generation_job = None
+    if "eng_draft_job" not in st.session_state:
+        st.session_state.eng_draft_job = None
 
     # ==========================================
     # INCOMING QUEUE (INBOX)
     # ==========================================
     try:
-        inbox_res = supabase.table("tickets").select("*").eq("status", "Awaiting Tech Architecture").eq("target_department", "Engineering").order("created_at", desc=True).execute()
-        inbox_tickets = inbox_res.data
+        inbox_tickets = get_inbox(supabase, "Engineering", "Awaiting Tech Architecture")
         
         if inbox_tickets:
-            st.info(f"**INCOMING:** You have {len(inbox_tickets)} approved project(s) waiting for Technical Architecture!")
+            waiting = [item for item in inbox_tickets if not item.get('claimed_by')]
+            st.info(f"**INCOMING:** You have {len(waiting)} approved project(s) waiting for Technical Architecture!")
             for item in inbox_tickets:
-                with st.expander(f"Incoming Ticket: {item['summary'][:60]}..."):
-                    try:
-                        prev_data = json.loads(item['full_data'])
-                    except:
-                        prev_data = {}
-                        
+                if item.get('claimed_by'):
+                    st.caption(f"{claim_badge(item, st.session_state.user.id)} · Incoming Ticket: {item['summary'][:60]}...")
+                    continue
+                with lazy_ticket_expander(supabase, f"Incoming Ticket: {item['summary'][:60]}...", item, f"eng_inbox_{item['id']}") as item:
+                    if item is None:
+                        continue
                     st.write(f"**Budget Info:** {item['cost']} | **Complexity:** {item['complexity']}")
                     
-                    if st.button("Accept & Load into Terminal", key=f"accept_{item['id']}", type="primary"):
-                        supabase.table("tickets").update({"status": "Accepted by Engineering"}).eq("id", item['id']).execute()
-                        
-                        injection_text = f"HANDOFF CONTEXT:\nProject Summary: {prev_data.get('summary', prev_data.get('project_vision', item['summary']))}\n"
-                        
-                        if "mvp_user_stories" in prev_data:
-                            injection_text += "User Stories to Build:\n"
-                            for story in prev_data.get("mvp_user_stories", []):
-                                injection_text += f"- {story.get('story')}\n"
-                                
-                        if "key_screens" in prev_data:
-                            injection_text += "Design Screens to Support:\n"
-                            for screen in prev_data.get("key_screens", []):
-                                injection_text += f"- {screen.get('screen_name')}\n"
-                                
-                        # --- CATCH THE GENERATED FRONTEND CODE ---
-                        if "generated_frontend_code" in prev_data:
-                            st.session_state.inherited_frontend = prev_data["generated_frontend_code"]
-                            injection_text += "\n[NOTE: Frontend React code has already been generated by the Design team. Focus strictly on Backend logic, Database Architecture, and API schemas.]\n"
-                        else:
-                            st.session_state.inherited_frontend = None
-                                
+                    accepted = st.button("Accept & Load into Terminal", key=f"accept_{item['id']}", type="primary")
+                    if accepted and not claim_ticket(supabase, item['id'], "Awaiting Tech Architecture", "Accepted by Engineering", st.session_state.user.id):
+                        st.toast("A teammate already accepted this ticket.")
+                        st.rerun()
+                    elif accepted:
+                        injection_text = eng_handoff_context(item)
                         st.session_state.eng_input = injection_text
+
+                        # The architecture generated from this handoff joins the routed ticket's project
+                        st.session_state.eng_parent_ticket_id = item['id']
+
+                        # Pick up the draft pre-generated when the ticket was routed, if it matches our settings
+                        model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
+                        draft = find_handoff_draft("eng_architecture", item['id'], eng_architecture_payload(model_id, cloud_target, company_guidelines, injection_text))
+                        st.session_state.eng_draft_job = draft["id"] if draft else None
                         st.rerun()
             st.divider()
     except Exception as e:
         st.warning(f"Could not load Inbox: {str(e)}")
 
+    # New handoffs show up without a manual refresh
+    watch_inbox("Engineering", "Awaiting Tech Architecture")
+
     # ==========================================
     # GENERATOR UI
     # ==========================================
@@ -327,79 +332,15 @@ def render_engineering_dashboard(supabase):
         elif not eng_input and not uploaded_file:
             st.warning("Please enter text or upload a file to proceed.")
         else:
-            try:
-                client = genai.Client(api_key=api_key)
-                ENG_PROMPT = get_engineering_prompt()
-
-                with st.status("Booting up Engineering Architecture...", expanded=True) as status:
-                    st.write("Analyzing technical constraints...")
-                    model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
-                    prompt_contents = []
-                    
-                    if uploaded_file:
-                        st.write("Ingesting multi-modal requirements...")
-                        file_ext = f".{uploaded_file.name.split('.')[-1]}"
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-                            tmp.write(uploaded_file.getvalue())
-                            tmp_path = tmp.name
-                        
-                        gemini_file = client.files.upload(file=tmp_path)
-                        prompt_contents.append(gemini_file)
-                        os.remove(tmp_path)
-                    
-                    st.write(f"Designing system for {cloud_target} deployment...")
-                    
-                    text_instruction = ""
-                    if company_guidelines.strip():
-                        text_instruction += f"CRITICAL OVERRIDE - COMPANY GUIDELINES:\nYou must strictly adhere to the following internal coding standards and rules when designing the database, APIs, and tech stack:\n{company_guidelines}\n\n"
-                    
-                    text_instruction += f"PROJECT REQUIREMENTS:\n{eng_input}\nTarget Deployment: {cloud_target}" if eng_input else f"Extract engineering requirements for {cloud_target}."
-                    
-                    prompt_contents.append(text_instruction)
-                    
-                    response = client.models.generate_content(
-                        model=model_id, 
-                        config=types.GenerateContentConfig(
-                            system_instruction=ENG_PROMPT,
-                            temperature=0.1, 
-                            response_mime_type="application/json"
-                        ),
-                        contents=prompt_contents
-                    )
-                    
-                    if uploaded_file:
-                        st.write("Cleaning up workspace...")
-                        client.files.delete(name=gemini_file.name)
-                    
-                    st.write("Mapping database schemas and API endpoints...")
-                    data, error_msg = safe_parse_json(response.text)
-                    
-                    if error_msg:
-                        status.update(label="Architecture Failed", state="error", expanded=True)
-                        st.error(error_msg)
-                        st.stop()
-                    else:
-                        status.update(label="System Architecture Compiled!", state="complete", expanded=False)
-                        st.session_state.active_eng_ticket = data
-
-                # SAVE TO SUPABASE
-                new_ticket = {
-                    "user_id": st.session_state.user.id,
-                    "summary": data.get("system_architecture", "Technical Architecture")[:200],
-                    "cost": "N/A (Engineering Phase)",
-                    "raw_cost": "0-0",
-                    "complexity": "Engineering Architecture", 
-                    "time": "TBD",
-                    "full_data": response.text,
-                    "status": "Draft",
-                    "target_department": "None"
-                }
-                db_res = supabase.table("tickets").insert(new_ticket).execute()
-                st.session_state.active_eng_ticket_id = db_res.data[0]['id']
-                st.rerun()
-
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+            model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
+            payload = eng_architecture_payload(model_id, cloud_target, company_guidelines, eng_input)
+            submit_generation("eng_architecture", payload, "eng_generation_job", st.session_state.eng_parent_ticket_id, uploaded_file)
+
+    if st.session_state.eng_generation_job:
+        watch_job("eng_generation_job", f"Designing system for {cloud_target} deployment...", lambda job: _load_generated_architecture(job["result"]))
+
+    if st.session_state.eng_draft_job:
+        watch_job("eng_draft_job", "Loading the pre-generated draft for this handoff...", lambda job: _load_generated_architecture(adopt_draft(supabase, job, st.session_state.user.id)))
 
     # ==========================================
     # RENDER THE ACTIVE ENGINEERING UI
@@ -444,10 +385,12 @@ def render_engineering_dashboard(supabase):
         # ==========================================
         # NEW: RENDER INHERITED FRONTEND CODE
         # ==========================================
-        if st.session_state.get("inherited_frontend"):
+        # Only the open architecture's own project can have inherited code
+        inherited_frontend = get_inherited_frontend(supabase, st.session_state.active_eng_ticket_id)
+        if inherited_frontend:
             st.divider()
             st.subheader("Inherited Frontend Code (From Design)")
-            code_payload = st.session_state.inherited_frontend
+            code_payload = inherited_frontend
             st.info(f"**Styling Guide:** {code_payload.get('global_styles_summary', 'Tailwind CSS classes applied.')}")
             
             for comp in code_payload.get("generated_components", []):
@@ -562,7 +505,7 @@ def render_engineering_dashboard(supabase):
                         st.write("Committing `schema.sql`...")
                         st.write("Committing React `src/components/`...")
                         
-                        frontend_data = st.session_state.get("inherited_frontend")
+                        frontend_data = inherited_frontend
                         repo_url, gh_err = provision_github_repo(gh_token, repo_input_name, data, frontend_data)
                         
                         if gh_err:
@@ -578,7 +521,7 @@ def render_engineering_dashboard(supabase):
         if st.session_state.active_eng_ticket_id:
             if st.button("Mark as Ready for Dev", type="primary", use_container_width=True):
                 try:
-                    supabase.table("tickets").update({"status": "Ready for Dev", "target_department": "None"}).eq("id", st.session_state.active_eng_ticket_id).execute()
+                    update_ticket(supabase, st.session_state.active_eng_ticket_id, {"status": "Ready for Dev", "target_department": "None"})
                     st.success("Architecture finalized and ready for the build!")
                 except Exception as e:
                     st.error(f"Failed to finalize ticket: {str(e)}")
@@ -588,8 +531,7 @@ def render_engineering_dashboard(supabase):
     st.subheader("Saved Architecture Schemas")
     
     try:
-        db_response = supabase.table("tickets").select("*").eq("user_id", st.session_state.user.id).eq("complexity", "Engineering Architecture").order("created_at", desc=True).execute()
-        saved_tickets = db_response.data
+        saved_tickets, has_older = paged_tickets(supabase, "eng_history", user_id=st.session_state.user.id, ticket_type="eng_architecture")
         
         if saved_tickets:
             for item in saved_tickets:
@@ -600,7 +542,9 @@ def render_engineering_dashboard(supabase):
                 else:
                     status_icon = "✅"
 
-                with st.expander(f"{status_icon} Arch: {item['summary'][:60]}..."):
+                with lazy_ticket_expander(supabase, f"{status_icon} Arch: {item['summary'][:60]}...", item, f"eng_hist_{item['id']}") as item:
+                    if item is None:
+                        continue
                     
                     if current_status in ['Draft', 'Accepted by Engineering']:
                         st.caption(f"Status: **{current_status} (Not Finalized)**")
@@ -649,7 +593,7 @@ def render_engineering_dashboard(supabase):
                             st.warning("Are you sure? This cannot be undone.")
                             if st.button("Yes, Delete Forever", key=f"confirm_del_eng_{item['id']}", type="primary"):
                                 try:
-                                    supabase.table("tickets").delete().eq("id", item['id']).execute()
+                                    delete_ticket(supabase, item['id'])
                                     st.rerun()
                                 except Exception as e:
                                     st.error(f"Failed to delete: {str(e)}")
@@ -667,7 +611,7 @@ def render_engineering_dashboard(supabase):
                     if current_status in ['Draft', 'Accepted by Engineering']:
                         st.markdown("##### Finalize Project")
                         if st.button("Mark as Ready for Dev", key=f"hist_ready_{item['id']}", use_container_width=True):
-                            supabase.table("tickets").update({"status": "Ready for Dev", "target_department": "None"}).eq("id", item['id']).execute()
+                            update_ticket(supabase, item['id'], {"status": "Ready for Dev", "target_department": "None"})
                             st.rerun()
                     
                     st.divider()
@@ -684,6 +628,6 @@ def render_engineering_dashboard(supabase):
                             
         else:
             st.info("No saved architectures yet. Initialize a build above!")
-            
+        page_controls("eng_history", saved_tickets, has_older)
     except Exception as e:
         st.error(f"Could not load history: {str(e)}")
@@ -1,10 +1,8 @@
 import streamlit as st
 import json
-import os
-import tempfile
-from google import genai
-from google.genai import types
 from utils import safe_parse_json
+from ai_engine import schedule, wait_for_result, queue_notice, generate_content, request_key
+from ingestion import prepare_generation_input, stage_upload
 from github import Github
 from github import Auth
 import re
@@ -57,7 +55,6 @@ def render_freelancer_dashboard(supabase):
     st.caption("Bypass department queues. Upload your idea and watch the entire architecture build out in a single flow.")
 
     api_key = st.secrets.get("GOOGLE_API_KEY")
-    client = genai.Client(api_key=api_key) if api_key else None
 
     # --- 1. STATE MANAGEMENT ---
     if "fl_stage" not in st.session_state: st.session_state.fl_stage = 0 
@@ -95,36 +92,29 @@ def render_freelancer_dashboard(supabase):
         if st.button("Generate Feasibility & Budget", type="primary"):
             if not fl_input and not uploaded_file:
                 st.warning("Please provide a prompt or upload a file.")
-            elif not client:
+            elif not api_key:
                 st.error("Google API Key missing in secrets.toml!")
             else:
                 with st.status("Analyzing Market Feasibility...", expanded=True) as status:
                     st.write("Extracting core business logic...")
                     
-                    prompt_contents = []
-                    if uploaded_file:
-                        file_ext = f".{uploaded_file.name.split('.')[-1]}"
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-                            tmp.write(uploaded_file.getvalue())
-                            tmp_path = tmp.name
-                        gemini_file = client.files.upload(file=tmp_path)
-                        prompt_contents.append(gemini_file)
-                        os.remove(tmp_path)
+                    upload = stage_upload(uploaded_file)
+                    if uploaded_file and upload is None:
+                        status.update(label="Upload Refused", state="error", expanded=True)
+                        st.stop()
 
                     instructions = """Analyze this software idea. Output ONLY valid JSON with these exact keys:
                     {"project_summary": "A clear 2-sentence summary", "budget_estimate_usd": "$10,000 - $15,000", "feasibility_score": "Green (Highly Feasible)", "deal_breakers": ["List of potential risks"]}"""
                     
-                    prompt_contents.append(f"{instructions}\n\nClient Input: {fl_input}")
+                    if uploaded_file:
+                        st.write("Reading the attached file...")
+                    # Only the client input is condensed when it runs long; the JSON schema is always sent
+                    text_instruction, upload = prepare_generation_input(supabase, api_key, "gemini-2.5-flash", st.session_state.user.id, f"{instructions}\n\nClient Input:", upload, brief=fl_input)
 
-                    response = client.models.generate_content(
-                        model="gemini-2.5-flash",
-                        config=types.GenerateContentConfig(temperature=0.2, response_mime_type="application/json"),
-                        contents=prompt_contents
-                    )
-                    
-                    if uploaded_file: client.files.delete(name=gemini_file.name)
+                    job = schedule(st.session_state.user.id, lambda: generate_content(api_key, "gemini-2.5-flash", None, 0.2, text_instruction, upload=upload), key=request_key(st.session_state.user.id, "freelancer_feasibility", text_instruction, upload))
+                    response_text = wait_for_result(job, queue_notice(st.empty()))
 
-                    parsed_data, err = safe_parse_json(response.text)
+                    parsed_data, err = safe_parse_json(response_text)
                     if err:
                         status.update(label="Error Parsing AI Output", state="error", expanded=True)
                         st.error(err)
@@ -155,13 +145,10 @@ def render_freelancer_dashboard(supabase):
                         
                         Project Summary: {sales_data.get('project_summary', '')}"""
 
-                        response = client.models.generate_content(
-                            model="gemini-2.5-flash",
-                            config=types.GenerateContentConfig(temperature=0.2, response_mime_type="application/json"),
-                            contents=[pm_prompt]
-                        )
+                        job = schedule(st.session_state.user.id, lambda: generate_content(api_key, "gemini-2.5-flash", None, 0.2, pm_prompt), key=request_key(st.session_state.user.id, "freelancer_tickets", pm_prompt))
+                        response_text = wait_for_result(job, queue_notice(st.empty()))
                         
-                        parsed_data, err = safe_parse_json(response.text)
+                        parsed_data, err = safe_parse_json(response_text)
                         if err:
                             status.update(label="Error", state="error", expanded=True)
                             st.error(err)
@@ -201,13 +188,10 @@ def render_freelancer_dashboard(supabase):
                         
                         Agile Epics: {st.session_state.fl_pm_data.get('epics', [])}"""
 
-                        response = client.models.generate_content(
-                            model="gemini-2.5-flash", 
-                            config=types.GenerateContentConfig(temperature=0.1, response_mime_type="application/json"),
-                            contents=[eng_prompt]
-                        )
+                        job = schedule(st.session_state.user.id, lambda: generate_content(api_key, "gemini-2.5-flash", None, 0.1, eng_prompt), key=request_key(st.session_state.user.id, "freelancer_architecture", eng_prompt))
+                        response_text = wait_for_result(job, queue_notice(st.empty()))
                         
-                        parsed_data, err = safe_parse_json(response.text)
+                        parsed_data, err = safe_parse_json(response_text)
                         if err:
                             status.update(label="Error", state="error", expanded=True)
                             st.error(err)
@@ -0,0 +1,256 @@
+import json
+import streamlit as st
+from ai_engine import BACKGROUND, INTERACTIVE, request_key, schedule, generate_content
+from data_layer import insert_ticket, on_status_change
+from ingestion import prepare_generation_input, stage_upload
+from job_queue import enqueue, find_job, raise_priority, register_handler, set_progress
+from prompts import get_system_prompt, get_sales_prompt, get_design_prompt, get_engineering_prompt
+from utils import convert_currency, safe_parse_json
+
+# ==========================================
+# GENERATION PAYLOADS
+# ==========================================
+# Dashboards and the handoff speculator build payloads through the same helpers,
+# so a draft generated ahead of time matches what the receiving team would ask for.
+# Attachments travel as the spooled upload record from `ingestion.stage_upload`.
+# `text_instruction` holds fixed instructions and `brief` the user's text, the
+# only part that is condensed when it runs long.
+def sales_quote_payload(model_id, rate_type, brief, upload=None, currency="USD ($)"):
+    return {"model_id": model_id, "system_instruction": get_sales_prompt(rate_type), "temperature": 0.0, "text_instruction": "", "brief": brief, "upload": upload, "currency": currency}
+
+def pm_ticket_payload(model_id, rate_type, build_strategy, brief, upload=None, currency="USD ($)"):
+    return {"model_id": model_id, "system_instruction": get_system_prompt(rate_type, build_strategy), "temperature": 0.0, "text_instruction": "", "brief": brief, "upload": upload, "currency": currency}
+
+def design_spec_payload(model_id, brief, upload=None):
+    return {"model_id": model_id, "system_instruction": get_design_prompt(), "temperature": 0.4, "text_instruction": "", "brief": brief, "upload": upload}
+
+def eng_architecture_payload(model_id, cloud_target, company_guidelines, eng_input, upload=None):
+    text_instruction = ""
+    if company_guidelines.strip():
+        text_instruction += f"CRITICAL OVERRIDE - COMPANY GUIDELINES:\nYou must strictly adhere to the following internal coding standards and rules when designing the database, APIs, and tech stack:\n{company_guidelines}\n\n"
+
+    text_instruction += f"Target Deployment: {cloud_target}" if eng_input else f"Extract engineering requirements for {cloud_target}."
+    brief = f"PROJECT REQUIREMENTS:\n{eng_input}" if eng_input else None
+    return {"model_id": model_id, "system_instruction": get_engineering_prompt(), "temperature": 0.1, "text_instruction": text_instruction, "brief": brief, "upload": upload}
+
+def submit_generation(kind, payload, session_key, parent_id=None, uploaded_file=None):
+    """Queues a hub generation and keeps its job id in `st.session_state[session_key]`.
+
+    `uploaded_file` is spooled and attached to the payload first; a refused
+    upload has already explained itself and queues nothing. Double-clicks and
+    reruns attach to the job already queued for the same inputs. Returns the
+    job id, or None when nothing was queued.
+    """
+    if uploaded_file is not None:
+        upload = stage_upload(uploaded_file)
+        if upload is None:
+            return None
+        payload = dict(payload, upload=upload)
+    user_id = st.session_state.user.id
+    try:
+        job_id = enqueue(kind, user_id, payload, ticket_id=parent_id, dedupe_key=request_key(user_id, kind, payload))
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+        return None
+    st.session_state[session_key] = job_id
+    return job_id
+
+# ==========================================
+# GENERATION JOB HANDLERS
+# ==========================================
+# Each handler runs on a job worker thread: it calls Gemini through the global
+# scheduler, parses the response and attaches the result to a new ticket row.
+# The ticket insert is keyed by the job id, so a job re-run after a crash never
+# creates a second row.
+def _generate(job, context):
+    payload = job["payload"]
+
+    def report_upload(sent, total):
+        set_progress(job["id"], f"Uploading {payload['upload']['file_name']}: {100 * sent // max(total, 1)}%")
+
+    # Audio is optimized and becomes its shared transcript; long inputs are condensed segment by segment
+    text_instruction, upload = prepare_generation_input(
+        context["supabase"], context["api_key"], payload["model_id"], job["user_id"], payload["text_instruction"],
+        payload.get("upload"), job["priority"], report_upload, brief=payload.get("brief"),
+        on_status=lambda text: set_progress(job["id"], text)
+    )
+    llm_call = schedule(job["user_id"], lambda: generate_content(
+        context["api_key"], payload["model_id"], payload["system_instruction"], payload["temperature"],
+        text_instruction, upload=upload, on_progress=report_upload
+    ), job["priority"])
+    response_text = llm_call.result()
+
+    data, error_msg = safe_parse_json(response_text)
+    if error_msg:
+        raise ValueError(error_msg)
+    return response_text, data
+
+def _format_cost(raw_cost, currency):
+    low_end = raw_cost.split("-")[0] if "-" in raw_cost else raw_cost
+    high_end = raw_cost.split("-")[1] if "-" in raw_cost else raw_cost
+    return f"{convert_currency(low_end, currency)} - {convert_currency(high_end, currency)}"
+
+def _sales_quote_row(data, response_text, payload):
+    raw_cost = data.get("budget_estimate_usd", "0-0")
+    return {
+        "summary": data.get("project_summary", "Sales Intake"),
+        "cost": _format_cost(raw_cost, payload["currency"]),
+        "raw_cost": raw_cost,
+        "complexity": data.get("feasibility_score", "Yellow"),
+        "time": data.get("estimated_timeline", "Unknown"),
+        "full_data": json.dumps(data)
+    }
+
+def _pm_ticket_row(data, response_text, payload):
+    raw_cost = data.get("budget_estimate_usd", "0-0")
+    return {
+        "summary": data.get("summary"),
+        "cost": _format_cost(raw_cost, payload["currency"]),
+        "raw_cost": raw_cost,
+        "complexity": data.get("complexity_score"),
+        "time": data.get("development_time"),
+        "full_data": json.dumps(data)
+    }
+
+def _design_spec_row(data, response_text, payload):
+    return {
+        "summary": data.get("project_vision", "Design Architecture")[:200],
+        "cost": "N/A (Design Phase)",
+        "raw_cost": "0-0",
+        "complexity": "UI/UX Scoping",
+        "time": "TBD",
+        "full_data": response_text
+    }
+
+def _eng_architecture_row(data, response_text, payload):
+    return {
+        "summary": data.get("system_architecture", "Technical Architecture")[:200],
+        "cost": "N/A (Engineering Phase)",
+        "raw_cost": "0-0",
+        "complexity": "Engineering Architecture",
+        "time": "TBD",
+        "full_data": response_text
+    }
+
+TICKET_BUILDERS = {
+    "sales_quote": _sales_quote_row,
+    "pm_ticket": _pm_ticket_row,
+    "design_spec": _design_spec_row,
+    "eng_architecture": _eng_architecture_row,
+}
+
+def _save(supabase, kind, data, response_text, payload, user_id, idempotency_key, source_file_hash=None, parent_ticket_id=None):
+    new_ticket = TICKET_BUILDERS[kind](data, response_text, payload)
+    new_ticket.update({"user_id": user_id, "status": "Draft", "target_department": "None", "ticket_type": kind})
+    if parent_ticket_id:
+        # The database files the new stage under the parent's project_id
+        new_ticket["parent_ticket_id"] = parent_ticket_id
+    if source_file_hash:
+        new_ticket["source_file_hash"] = source_file_hash
+    saved_row = insert_ticket(supabase, new_ticket, idempotency_key=idempotency_key)
+    return {"ticket_id": saved_row["id"], "data": data}
+
+def run_generation(job, context):
+    response_text, data = _generate(job, context)
+    if job["payload"].get("draft"):
+        # Handoff drafts are only saved once the receiving team accepts them
+        return {"response_text": response_text, "data": data}
+    upload = job["payload"].get("upload")
+    source_file_hash = upload["sha256"] if upload else None
+    return _save(context["supabase"], job["kind"], data, response_text, job["payload"], job["user_id"], f"job:{job['id']}", source_file_hash, job["ticket_id"])
+
+# ==========================================
+# SPECULATIVE HANDOFF DRAFTS
+# ==========================================
+# When a ticket is routed to the next department, the generation that team is
+# about to run is queued at background priority, using the inputs the inbox
+# "Accept" button would load and the default hub settings. Accepting the ticket
+# picks up the finished draft instead of starting from scratch.
+DRAFT_MODEL_ID = "gemini-2.5-flash"
+DRAFT_RATE_STANDARD = "US Agency ($150/hr)"
+DRAFT_BUILD_STRATEGY = "Balanced"
+DRAFT_CLOUD_TARGET = "AWS (Enterprise)"
+
+def _ticket_data(item):
+    try:
+        return json.loads(item['full_data'])
+    except:
+        return {}
+
+def pm_handoff_context(item):
+    """Context the PM inbox loads for a quote approved by Sales."""
+    sales_data = _ticket_data(item)
+    return f"SALES HANDOFF CONTEXT:\nProject Summary: {sales_data.get('project_summary', item['summary'])}\nBudget: {item['cost']}\nTimeline: {item['time']}\nDeal Breakers: {sales_data.get('deal_breakers', [])}\nClient Asks: {sales_data.get('client_questions', [])}"
+
+def design_handoff_context(item):
+    """Context the Design inbox loads for a ticket routed by PM."""
+    pm_data = _ticket_data(item)
+    injection_text = f"PM HANDOFF CONTEXT:\nProject Summary: {pm_data.get('summary', item['summary'])}\n"
+    if "mvp_user_stories" in pm_data:
+        injection_text += "User Stories to Design For:\n"
+        for story in pm_data.get("mvp_user_stories", []):
+            injection_text += f"- {story.get('story')}\n"
+    else:
+        injection_text += f"Features to Design For: {pm_data.get('mvp_features', [])}\n"
+    return injection_text
+
+def eng_handoff_context(item):
+    """Context the Engineering inbox loads for a ticket routed by PM or Design."""
+    prev_data = _ticket_data(item)
+    injection_text = f"HANDOFF CONTEXT:\nProject Summary: {prev_data.get('summary', prev_data.get('project_vision', item['summary']))}\n"
+
+    if "mvp_user_stories" in prev_data:
+        injection_text += "User Stories to Build:\n"
+        for story in prev_data.get("mvp_user_stories", []):
+            injection_text += f"- {story.get('story')}\n"
+
+    if "key_screens" in prev_data:
+        injection_text += "Design Screens to Support:\n"
+        for screen in prev_data.get("key_screens", []):
+            injection_text += f"- {screen.get('screen_name')}\n"
+
+    if "generated_frontend_code" in prev_data:
+        injection_text += "\n[NOTE: Frontend React code has already been generated by the Design team. Focus strictly on Backend logic, Database Architecture, and API schemas.]\n"
+    return injection_text
+
+def _draft_payload(status, item):
+    if status == "Awaiting PM Scoping":
+        return "pm_ticket", pm_ticket_payload(DRAFT_MODEL_ID, DRAFT_RATE_STANDARD, DRAFT_BUILD_STRATEGY, pm_handoff_context(item))
+    if status == "Awaiting UI/UX Scoping":
+        return "design_spec", design_spec_payload(DRAFT_MODEL_ID, design_handoff_context(item))
+    return "eng_architecture", eng_architecture_payload(DRAFT_MODEL_ID, DRAFT_CLOUD_TARGET, "", eng_handoff_context(item))
+
+def draft_key(kind, ticket_id, payload):
+    """Matches a draft on everything that shapes the generation, not on display settings."""
+    generation_inputs = {k: payload.get(k) for k in ("model_id", "system_instruction", "temperature", "text_instruction", "brief", "upload")}
+    return request_key("handoff", kind, ticket_id, generation_inputs)
+
+def speculate_handoff(ticket):
+    """Status hook: pre-generates the receiving department's draft for a freshly routed ticket."""
+    kind, payload = _draft_payload(ticket["status"], ticket)
+    payload["draft"] = True
+    enqueue(kind, ticket.get("user_id"), payload, ticket_id=ticket["id"], dedupe_key=draft_key(kind, ticket["id"], payload), priority=BACKGROUND)
+
+def find_handoff_draft(kind, ticket_id, payload):
+    """Returns the speculative job whose inputs match what the receiver is about to generate.
+
+    Someone is now waiting on it, so a draft still in the queue jumps to
+    interactive priority instead of sitting behind other background work.
+    """
+    job = find_job(draft_key(kind, ticket_id, payload))
+    if job and job["status"] == "queued":
+        raise_priority(job["id"], INTERACTIVE)
+        job = dict(job, priority=min(job["priority"], INTERACTIVE))
+    return job
+
+def adopt_draft(supabase, job, user_id, currency="USD ($)"):
+    """Saves a finished draft as the accepting user's ticket, once per user."""
+    result = job["result"]
+    payload = dict(job["payload"], currency=currency)
+    return _save(supabase, job["kind"], result["data"], result["response_text"], payload, user_id, f"draft:{job['id']}:{user_id}", parent_ticket_id=job["ticket_id"])
+
+def register_generation_handlers():
+    for kind in TICKET_BUILDERS:
+        register_handler(kind, run_generation)
+    for status in ("Awaiting PM Scoping", "Awaiting UI/UX Scoping", "Awaiting Tech Architecture"):
+        on_status_change(status, speculate_handoff)
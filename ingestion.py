@@ -0,0 +1,678 @@
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from pypdf import PdfReader
+from ai_engine import INTERACTIVE, schedule, generate_content
+from data_layer import get_transcript, save_transcript
+from prompts import get_chunk_extraction_prompt, get_transcription_prompt
+from utils import safe_parse_json
+
+# ==========================================
+# CHUNKED MAP-REDUCE INGESTION
+# ==========================================
+# Multi-hour calls and long documents are split into overlapping segments that
+# are mined for requirements concurrently (map), then merged locally into one
+# compact brief (reduce). That brief replaces the raw input in the final
+# Sales/PM/Design/Engineering prompt, which keeps it well inside context limits.
+# The threshold comes from the model's input window: Gemini 2.5 takes ~1M tokens
+# (~4 chars each), and an eighth of that leaves ample room for the instructions
+# and the response, so map-reduce only runs for inputs that genuinely would not
+# fit in one call.
+MODEL_INPUT_TOKENS = 1048576
+CHARS_PER_TOKEN = 4
+CHUNK_CHARS = int(os.environ.get("BRIDGEBUILD_CHUNK_CHARS", str(MODEL_INPUT_TOKENS * CHARS_PER_TOKEN // 8)))
+CHUNK_OVERLAP_CHARS = 800
+AUDIO_CHUNK_SECONDS = int(os.environ.get("BRIDGEBUILD_AUDIO_CHUNK_SECONDS", "600"))
+AUDIO_OVERLAP_SECONDS = 15
+
+EXTRACTION_SECTIONS = [
+    ("requirements", "Requirements"),
+    ("constraints", "Constraints"),
+    ("budget_signals", "Budget Signals"),
+    ("timeline_signals", "Timeline Signals"),
+    ("stakeholders", "Stakeholders"),
+    ("risks_and_open_questions", "Risks & Open Questions"),
+]
+
+def chunk_text(text, chunk_chars=CHUNK_CHARS, overlap_chars=CHUNK_OVERLAP_CHARS):
+    """Splits text into overlapping windows, cutting at paragraph or sentence breaks where possible."""
+    if len(text) <= chunk_chars:
+        return [text]
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            window = text[start:end]
+            cut = max(window.rfind("\n\n"), window.rfind(". "), window.rfind("\n"))
+            if cut > chunk_chars // 2:
+                end = start + cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap_chars, start + 1)
+    return chunks
+
+def chunk_wav(source, chunk_seconds=AUDIO_CHUNK_SECONDS, overlap_seconds=AUDIO_OVERLAP_SECONDS):
+    """Splits a WAV recording (bytes or a file path) into overlapping WAV clips.
+
+    Short recordings come back whole, as the `source` that was passed in.
+    """
+    with wave.open(io.BytesIO(source) if isinstance(source, bytes) else source, "rb") as src:
+        params = src.getparams()
+        rate = src.getframerate()
+        total_frames = src.getnframes()
+        chunk_frames = chunk_seconds * rate
+        if total_frames <= chunk_frames:
+            return [source]
+
+        step = max(chunk_frames - overlap_seconds * rate, rate)
+        clips = []
+        for start in range(0, total_frames, step):
+            src.setpos(start)
+            frames = src.readframes(chunk_frames)
+            clip = io.BytesIO()
+            with wave.open(clip, "wb") as dst:
+                dst.setparams(params)
+                dst.writeframes(frames)
+            clips.append(clip.getvalue())
+            if start + chunk_frames >= total_frames:
+                break
+        return clips
+
+def _segment_call(api_key, model_id, index, total, segment):
+    instruction = f"SEGMENT {index} OF {total}:\n{segment}"
+    return generate_content(api_key, model_id, get_chunk_extraction_prompt(), 0.0, instruction)
+
+def merge_extractions(extractions):
+    """Reduce step: folds per-segment extractions into one de-duplicated brief."""
+    merged = {key: [] for key, _ in EXTRACTION_SECTIONS}
+    seen = {key: set() for key, _ in EXTRACTION_SECTIONS}
+    for extraction in extractions:
+        for key, _ in EXTRACTION_SECTIONS:
+            for item in extraction.get(key, []) or []:
+                item = str(item).strip()
+                fingerprint = " ".join(item.lower().split())
+                if item and fingerprint not in seen[key]:
+                    seen[key].add(fingerprint)
+                    merged[key].append(item)
+
+    brief = f"CONSOLIDATED DISCOVERY BRIEF (merged from {len(extractions)} overlapping segments):\n"
+    for key, title in EXTRACTION_SECTIONS:
+        if merged[key]:
+            brief += f"\n{title}:\n" + "".join(f"- {item}\n" for item in merged[key])
+    return brief
+
+def map_reduce_requirements(api_key, model_id, user_id, segments, priority=INTERACTIVE):
+    """Extracts requirements from every segment concurrently and returns the merged brief."""
+    total = len(segments)
+    futures = [
+        schedule(user_id, lambda i=i, seg=seg: _segment_call(api_key, model_id, i, total, seg), priority)
+        for i, seg in enumerate(segments, start=1)
+    ]
+    extractions = []
+    for future in futures:
+        data, error_msg = safe_parse_json(future.result())
+        if error_msg:
+            raise ValueError(error_msg)
+        extractions.append(data)
+    return merge_extractions(extractions)
+
+# ==========================================
+# STREAMING UPLOAD SPOOL
+# ==========================================
+# `st.file_uploader` already holds the whole file in memory. Instead of copying
+# it again (getvalue(), temp files, job rows), the buffer is streamed to a
+# content-addressed file on disk in fixed-size memoryview slices, hashing as it
+# goes. Everything downstream (pre-processing, transcription, PDF extraction,
+# the resumable Gemini upload) works from that file.
+# The per-file cap is enforced by Streamlit itself (`server.maxUploadSize` in
+# .streamlit/config.toml) before the browser sends a byte; MAX_UPLOAD_MB is
+# only a backstop for when the two are out of step. By the time this code runs
+# the file is already in RAM, so nothing here can limit what Streamlit buffers.
+UPLOAD_DIR = os.environ.get("BRIDGEBUILD_UPLOAD_DIR", os.path.join(".bridgebuild", "uploads"))
+MAX_UPLOAD_MB = int(os.environ.get("BRIDGEBUILD_MAX_UPLOAD_MB", "200"))
+SPOOL_CHUNK_BYTES = 8 * 1024 * 1024
+UPLOAD_RETENTION_SECONDS = 48 * 3600
+
+_MB = 1024 * 1024
+
+class UploadRejected(Exception):
+    """Raised when an upload is over MAX_UPLOAD_MB."""
+
+def _prune_spool():
+    cutoff = time.time() - UPLOAD_RETENTION_SECONDS
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(SPOOL_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _store_spooled(tmp_path, file_name, digest=None):
+    """Moves a finished spool file to its content-addressed name and returns its record."""
+    digest = digest or _hash_file(tmp_path)
+    ext = file_name.split('.')[-1].lower() if "." in file_name else "bin"
+    path = os.path.join(UPLOAD_DIR, f"{digest}.{ext}")
+    os.replace(tmp_path, path)
+    return {"path": path, "file_name": file_name, "sha256": digest, "size": os.path.getsize(path)}
+
+def _spool_tmp_path(suffix=".part"):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=suffix)
+    os.close(fd)
+    return tmp_path
+
+def spool_upload(uploaded_file, on_progress=None):
+    """Streams an uploaded file to disk and returns its record (`path`, `file_name`, `sha256`, `size`).
+
+    Raises UploadRejected when the file is over MAX_UPLOAD_MB.
+    """
+    size = uploaded_file.size
+    if size > MAX_UPLOAD_MB * _MB:
+        raise UploadRejected(f"'{uploaded_file.name}' is {size / _MB:.0f} MB; the limit is {MAX_UPLOAD_MB} MB per file.")
+    tmp_path = _spool_tmp_path()
+    _prune_spool()
+    buffer = uploaded_file.getbuffer()
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as out:
+            for offset in range(0, len(buffer), SPOOL_CHUNK_BYTES):
+                chunk = buffer[offset:offset + SPOOL_CHUNK_BYTES]
+                digest.update(chunk)
+                out.write(chunk)
+                if on_progress:
+                    on_progress(offset + len(chunk), len(buffer))
+    finally:
+        buffer.release()
+    return _store_spooled(tmp_path, uploaded_file.name, digest.hexdigest())
+
+def stage_upload(uploaded_file):
+    """Spools an `st.file_uploader` file with a progress bar.
+
+    Returns the upload record, or None after telling the user why the file was
+    refused. Audio is shrunk later, on the job worker (see `transcribe_once`),
+    so the button handler returns as soon as the file is on disk.
+    """
+    if uploaded_file is None:
+        return None
+    bar = st.progress(0.0, text=f"Saving {uploaded_file.name}...")
+    try:
+        upload = spool_upload(uploaded_file, lambda done, total: bar.progress(done / total, text=f"Saving {uploaded_file.name}... {done / _MB:.0f} of {total / _MB:.0f} MB"))
+    except UploadRejected as e:
+        bar.empty()
+        st.error(str(e))
+        return None
+    bar.empty()
+    return upload
+
+# ==========================================
+# TRANSCRIPT-ONCE PIPELINE
+# ==========================================
+# Audio is transcribed once per unique recording. The transcript is stored by
+# content hash, so when the same call reaches PM, Design or Engineering their
+# prompts get the compact text instead of megabytes of audio. A long recording
+# of any format is cut into overlapping AUDIO_CHUNK_SECONDS clips that are
+# transcribed concurrently, and the lines repeated in each overlap are dropped
+# when the parts are joined.
+AUDIO_EXTENSIONS = ("mp3", "wav", "m4a", "ogg")
+TRANSCRIPTION_MODEL_ID = "gemini-2.5-flash"
+TRANSCRIPT_OVERLAP_LINES = 20
+
+# The `transcripts` table is the durable cache; this LRU only saves the
+# round trip for recordings in active use.
+TRANSCRIPT_CACHE_SIZE = 32
+
+_TRANSCRIPTS = OrderedDict()
+_TRANSCRIPT_LOCKS = {}
+_TRANSCRIPT_LOCKS_LOCK = threading.Lock()
+
+def _acquire_transcript_lock(digest):
+    # Locks are reference-counted so they can go as soon as nobody is waiting on the recording
+    with _TRANSCRIPT_LOCKS_LOCK:
+        entry = _TRANSCRIPT_LOCKS.setdefault(digest, [threading.Lock(), 0])
+        entry[1] += 1
+    entry[0].acquire()
+
+def _release_transcript_lock(digest):
+    with _TRANSCRIPT_LOCKS_LOCK:
+        entry = _TRANSCRIPT_LOCKS[digest]
+        entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _TRANSCRIPT_LOCKS[digest]
+
+def _cached_transcript(digest):
+    with _TRANSCRIPT_LOCKS_LOCK:
+        transcript = _TRANSCRIPTS.get(digest)
+        if transcript is not None:
+            _TRANSCRIPTS.move_to_end(digest)
+        return transcript
+
+def _cache_transcript(digest, transcript):
+    with _TRANSCRIPT_LOCKS_LOCK:
+        _TRANSCRIPTS[digest] = transcript
+        _TRANSCRIPTS.move_to_end(digest)
+        while len(_TRANSCRIPTS) > TRANSCRIPT_CACHE_SIZE:
+            _TRANSCRIPTS.popitem(last=False)
+
+def is_audio(file_name):
+    return bool(file_name) and file_name.split('.')[-1].lower() in AUDIO_EXTENSIONS
+
+def _audio_duration(path):
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            capture_output=True, check=True, timeout=60, text=True
+        ).stdout
+        return float(out.strip())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+def _spool_bytes(data, file_name):
+    tmp_path = _spool_tmp_path()
+    with open(tmp_path, "wb") as out:
+        out.write(data)
+    return _store_spooled(tmp_path, file_name)
+
+def split_audio(upload, chunk_seconds=AUDIO_CHUNK_SECONDS, overlap_seconds=AUDIO_OVERLAP_SECONDS):
+    """Cuts a spooled recording of any format into overlapping clips, each a spooled upload record.
+
+    ffmpeg cuts every format without re-encoding; without it only WAV can be
+    split. A short recording, or one that cannot be cut, comes back as `[upload]`.
+    """
+    stem, _, ext = upload["file_name"].rpartition(".")
+    ext = ext.lower()
+    duration = _audio_duration(upload["path"]) if shutil.which("ffmpeg") and shutil.which("ffprobe") else None
+    if duration is None:
+        if ext != "wav":
+            return [upload]
+        try:
+            clips = chunk_wav(upload["path"], chunk_seconds, overlap_seconds)
+        except (wave.Error, EOFError):
+            return [upload]
+        if len(clips) == 1:
+            return [upload]
+        return [_spool_bytes(clip, f"{stem}_part{i}.wav") for i, clip in enumerate(clips, start=1)]
+
+    if duration <= chunk_seconds:
+        return [upload]
+    step = max(chunk_seconds - overlap_seconds, 1)
+    clips = []
+    start = 0
+    try:
+        while True:
+            dst_path = _spool_tmp_path(f".{ext}")
+            subprocess.run([
+                "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                "-ss", str(start), "-t", str(chunk_seconds), "-i", upload["path"], "-c", "copy", dst_path
+            ], capture_output=True, check=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+            clips.append(_store_spooled(dst_path, f"{stem}_part{len(clips) + 1}.{ext}"))
+            if start + chunk_seconds >= duration:
+                break
+            start += step
+    except (OSError, subprocess.SubprocessError):
+        # One long request is slower and riskier, but still correct
+        return [upload]
+    return clips
+
+def merge_transcripts(parts):
+    """Joins the transcripts of overlapping clips, dropping the lines a clip repeats from the end of the one before."""
+    lines = []
+    for part in parts:
+        part_lines = [line for line in part.splitlines() if line.strip()]
+        # A clip can start mid-utterance, so a line that ends one already kept is a repeat too
+        tail = [" ".join(line.lower().split()) for line in lines[-TRANSCRIPT_OVERLAP_LINES:]]
+        skip = 0
+        while skip < len(part_lines) and any(seen.endswith(" ".join(part_lines[skip].lower().split())) for seen in tail):
+            skip += 1
+        lines.extend(part_lines[skip:])
+    return "\n".join(lines)
+
+def _transcribe(api_key, user_id, upload, priority, on_progress=None):
+    segments = split_audio(upload)
+    total = len(segments)
+    futures = []
+    for i, segment in enumerate(segments, start=1):
+        if total == 1:
+            call = lambda: generate_content(
+                api_key, TRANSCRIPTION_MODEL_ID, get_transcription_prompt(), 0.0,
+                "Transcribe this recording.", upload=upload, on_progress=on_progress
+            )
+        else:
+            # Clips are transcribed concurrently; each one is a short request with a short answer
+            call = lambda seg=segment, i=i: generate_content(
+                api_key, TRANSCRIPTION_MODEL_ID, get_transcription_prompt(), 0.0,
+                f"Transcribe segment {i} of {total} of this recording.", upload=seg
+            )
+        futures.append(schedule(user_id, call, priority))
+
+    parts = []
+    for future in futures:
+        data, error_msg = safe_parse_json(future.result())
+        if error_msg:
+            raise ValueError(error_msg)
+        parts.append(str(data.get("transcript", "")).strip())
+    return merge_transcripts(parts)
+
+def transcribe_once(supabase, api_key, user_id, upload, priority=INTERACTIVE, on_progress=None, on_status=None):
+    """Returns the recording's transcript, transcribing and storing it only the first time.
+
+    The transcript is keyed by the hash of the recording as uploaded. Only a
+    miss pays for pre-processing, reported through `on_status(text)`.
+    """
+    digest = upload["sha256"]
+    transcript = _cached_transcript(digest)
+    if transcript is not None:
+        return transcript
+    # Per-hash lock: concurrent jobs with the same recording wait for one transcription
+    _acquire_transcript_lock(digest)
+    try:
+        transcript = _cached_transcript(digest)
+        if transcript is not None:
+            return transcript
+        transcript = get_transcript(supabase, digest) if supabase else None
+        if transcript is None:
+            if on_status:
+                on_status(f"Optimizing {upload['file_name']} for transcription...")
+            # Downmix, resample and trim silence before the recording leaves the server
+            processed, savings = preprocess_audio(upload)
+            if savings and on_status:
+                on_status(describe_savings(savings))
+            transcript = _transcribe(api_key, user_id, processed, priority, on_progress)
+            if supabase:
+                save_transcript(supabase, digest, upload["file_name"], transcript)
+        _cache_transcript(digest, transcript)
+        return transcript
+    finally:
+        _release_transcript_lock(digest)
+
+# ==========================================
+# LOCAL DOCUMENT EXTRACTION
+# ==========================================
+# PDFs and transcripts are mostly text, so they are read locally and sent
+# inline instead of being uploaded as binaries. Extracted pages are cached by
+# content hash, in one LRU that also holds each file's page count under
+# (sha256, "pages"); a PDF that yields no text (e.g. a scan) still goes up as a file.
+PDF_PAGE_CACHE_SIZE = 5000
+
+_PDF_PAGES = OrderedDict()
+_PDF_CACHE_LOCK = threading.Lock()
+
+def _cache_page(key, text):
+    with _PDF_CACHE_LOCK:
+        _PDF_PAGES[key] = text
+        _PDF_PAGES.move_to_end(key)
+        while len(_PDF_PAGES) > PDF_PAGE_CACHE_SIZE:
+            _PDF_PAGES.popitem(last=False)
+
+def extract_pdf_pages(upload):
+    """Returns the text of every page, reusing pages already extracted for the same file."""
+    digest = upload["sha256"]
+    with _PDF_CACHE_LOCK:
+        count = _PDF_PAGES.get((digest, "pages"))
+        cached = [_PDF_PAGES.get((digest, i)) for i in range(count)] if count is not None else None
+    if cached is not None and all(page is not None for page in cached):
+        return cached
+
+    reader = PdfReader(upload["path"])
+    _cache_page((digest, "pages"), len(reader.pages))
+    pages = []
+    for i, page in enumerate(reader.pages):
+        with _PDF_CACHE_LOCK:
+            text = _PDF_PAGES.get((digest, i))
+        if text is None:
+            text = (page.extract_text() or "").strip()
+            _cache_page((digest, i), text)
+        pages.append(text)
+    return pages
+
+def extract_document_text(upload):
+    """Text of a .txt or .pdf upload, or None when it has to be sent as a file."""
+    ext = upload["file_name"].split('.')[-1].lower()
+    if ext == "txt":
+        with open(upload["path"], "rb") as f:
+            return f.read().decode("utf-8", errors="replace")
+    if ext != "pdf":
+        return None
+    try:
+        pages = extract_pdf_pages(upload)
+    except Exception:
+        # Unreadable or encrypted PDFs are left for Gemini to read as a file
+        return None
+    if not any(pages):
+        return None
+    return "\n\n".join(f"--- Page {i} ---\n{text}" for i, text in enumerate(pages, start=1) if text)
+
+# ==========================================
+# GENERATION INPUT PREPARATION
+# ==========================================
+def _inline_text(api_key, model_id, user_id, text_instruction, label, file_name, text, priority):
+    segments = chunk_text(text)
+    if len(segments) == 1:
+        return f"{text_instruction}\n\n{label} ({file_name}):\n{text}", None
+    return f"{text_instruction}\n\n{map_reduce_requirements(api_key, model_id, user_id, segments, priority)}", None
+
+def _condense_brief(api_key, model_id, user_id, brief, priority):
+    segments = chunk_text(brief)
+    if len(segments) == 1:
+        return brief
+    # A heading such as "SALES HANDOFF CONTEXT:" frames the brief; keep it in front of the condensed text
+    heading, _, body = brief.partition("\n")
+    if not (heading.rstrip().endswith(":") and len(heading) <= 80):
+        return map_reduce_requirements(api_key, model_id, user_id, segments, priority)
+    return f"{heading}\n{map_reduce_requirements(api_key, model_id, user_id, chunk_text(body), priority)}"
+
+def prepare_generation_input(supabase, api_key, model_id, user_id, text_instruction, upload=None, priority=INTERACTIVE, on_progress=None, brief=None, on_status=None):
+    """Turns raw inputs into what the final call should see.
+
+    `text_instruction` holds the fixed instructions (guidelines, output
+    schema, deployment target) and is always sent as is; `brief` is the
+    user-supplied text. Audio is swapped for its (cached) transcript and
+    documents for their text, both sent inline; a long brief or attachment is
+    condensed through map-reduce. Returns the `(text_instruction, upload)` to
+    use for the final call. `on_status(text)` hears about slow local steps.
+    """
+    if upload is not None:
+        text_instruction = "\n\n".join(part for part in (text_instruction, brief) if part)
+        if is_audio(upload["file_name"]):
+            transcript = transcribe_once(supabase, api_key, user_id, upload, priority, on_progress, on_status)
+            return _inline_text(api_key, model_id, user_id, text_instruction, "MEETING TRANSCRIPT", upload["file_name"], transcript, priority)
+        document = extract_document_text(upload)
+        if document is None:
+            return text_instruction, upload
+        return _inline_text(api_key, model_id, user_id, text_instruction, "ATTACHED DOCUMENT", upload["file_name"], document, priority)
+
+    if not brief:
+        return text_instruction, None
+    condensed = _condense_brief(api_key, model_id, user_id, brief, priority)
+    return "\n\n".join(part for part in (text_instruction, condensed) if part), None
+
+# ==========================================
+# LOCAL AUDIO PRE-PROCESSING
+# ==========================================
+# Raw meeting recordings (stereo, 44.1/48 kHz, long pauses) are mostly wasted
+# bytes for speech understanding. Before upload they are downmixed to mono,
+# resampled to 16 kHz and stripped of long silences, streaming from one spool
+# file to another. With ffmpeg on the box the result is re-encoded as Opus;
+# without it, WAV input is handled in NumPy block by block and other formats
+# are passed through untouched. This runs on the job worker, and only for a
+# recording that has no stored transcript yet.
+TARGET_SAMPLE_RATE = 16000
+SILENCE_THRESHOLD = 0.01  # frame RMS, roughly -40 dBFS
+MAX_SILENCE_SECONDS = 1.0
+KEEP_SILENCE_SECONDS = 0.3
+FRAME_SECONDS = 0.02
+BLOCK_SECONDS = 10
+FFMPEG_TIMEOUT_SECONDS = 600
+UPLOAD_MBPS = float(os.environ.get("BRIDGEBUILD_UPLOAD_MBPS", "10"))
+
+def _decode_pcm(raw, width, channels):
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608
+    else:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+
+    usable = len(samples) - len(samples) % channels
+    return samples[:usable].reshape(-1, channels).mean(axis=1)
+
+class _Resampler:
+    """Block-by-block resampler; integer ratios (48k/32k -> 16k) are block-averaged as a cheap low-pass."""
+
+    def __init__(self, rate, target_rate):
+        self.rate = rate
+        self.target_rate = target_rate
+        self._consumed = 0
+        self._next_out = 0
+
+    def process(self, samples):
+        if self.rate == self.target_rate:
+            return samples
+        if self.rate % self.target_rate == 0:
+            factor = self.rate // self.target_rate
+            usable = len(samples) - len(samples) % factor
+            return samples[:usable].reshape(-1, factor).mean(axis=1)
+        ratio = self.rate / self.target_rate
+        start = self._consumed
+        self._consumed += len(samples)
+        end_out = int((self._consumed - 1) / ratio) + 1
+        positions = np.arange(self._next_out, end_out) * ratio - start
+        self._next_out = end_out
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+class _SilenceTrimmer:
+    """Shortens every pause longer than MAX_SILENCE_SECONDS down to KEEP_SILENCE_SECONDS."""
+
+    def __init__(self, rate):
+        self.frame = int(rate * FRAME_SECONDS)
+        self.max_quiet = int(MAX_SILENCE_SECONDS / FRAME_SECONDS)
+        self.keep_quiet = int(KEEP_SILENCE_SECONDS / FRAME_SECONDS)
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._quiet_frames = []
+        self._quiet_run = 0
+
+    def process(self, samples):
+        samples = np.concatenate([self._carry, samples])
+        n_frames = len(samples) // self.frame
+        self._carry = samples[n_frames * self.frame:]
+        frames = samples[:n_frames * self.frame].reshape(n_frames, self.frame)
+        quiet = np.sqrt((frames ** 2).mean(axis=1)) < SILENCE_THRESHOLD
+
+        out = []
+        for frame, is_quiet in zip(frames, quiet):
+            if is_quiet:
+                self._quiet_run += 1
+                if self._quiet_run <= self.max_quiet:
+                    self._quiet_frames.append(frame)
+                elif self._quiet_frames:
+                    # Pause is too long: keep only its first KEEP_SILENCE_SECONDS
+                    out.extend(self._quiet_frames[:self.keep_quiet])
+                    self._quiet_frames = []
+            else:
+                out.extend(self._quiet_frames)
+                self._quiet_frames = []
+                self._quiet_run = 0
+                out.append(frame)
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+    def flush(self):
+        out = self._quiet_frames[:self.keep_quiet] if self._quiet_run > self.max_quiet else self._quiet_frames
+        self._quiet_frames = []
+        return np.concatenate(out + [self._carry])
+
+def _to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+def _numpy_preprocess_wav(src_path, dst_path):
+    with wave.open(src_path, "rb") as src, wave.open(dst_path, "wb") as dst:
+        channels, width, rate = src.getnchannels(), src.getsampwidth(), src.getframerate()
+        dst.setnchannels(1)
+        dst.setsampwidth(2)
+        dst.setframerate(TARGET_SAMPLE_RATE)
+
+        resampler = _Resampler(rate, TARGET_SAMPLE_RATE)
+        trimmer = _SilenceTrimmer(TARGET_SAMPLE_RATE)
+        block_frames = rate * BLOCK_SECONDS
+        while True:
+            raw = src.readframes(block_frames)
+            if not raw:
+                break
+            mono = _decode_pcm(raw, width, channels)
+            dst.writeframes(_to_pcm16(trimmer.process(resampler.process(mono))))
+        dst.writeframes(_to_pcm16(trimmer.flush()))
+
+def _ffmpeg_preprocess(src_path, dst_path):
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", src_path,
+        "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE),
+        "-af", f"silenceremove=stop_periods=-1:stop_duration={MAX_SILENCE_SECONDS}:stop_silence={KEEP_SILENCE_SECONDS}:stop_threshold=-40dB",
+        "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", dst_path
+    ]
+    try:
+        subprocess.run(cmd, capture_output=True, check=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return os.path.getsize(dst_path) > 0
+
+def preprocess_audio(upload):
+    """Shrinks a spooled recording for upload.
+
+    Returns `(upload, savings)`; `savings` is None when the recording was left as is.
+    """
+    stem, _, ext = upload["file_name"].rpartition(".")
+    dst_path = _spool_tmp_path()
+    processed_name = None
+
+    if shutil.which("ffmpeg") and _ffmpeg_preprocess(upload["path"], dst_path):
+        processed_name = f"{stem}.ogg"
+    elif ext.lower() == "wav":
+        try:
+            _numpy_preprocess_wav(upload["path"], dst_path)
+            processed_name = f"{stem}.wav"
+        except (wave.Error, EOFError, ValueError):
+            processed_name = None
+
+    if processed_name is None or os.path.getsize(dst_path) >= upload["size"]:
+        os.remove(dst_path)
+        return upload, None
+
+    processed = _store_spooled(dst_path, processed_name)
+    saved_bytes = upload["size"] - processed["size"]
+    savings = {
+        "original_bytes": upload["size"],
+        "processed_bytes": processed["size"],
+        "upload_seconds_saved": saved_bytes * 8 / (UPLOAD_MBPS * 1_000_000),
+    }
+    return processed, savings
+
+def describe_savings(savings):
+    mb = 1024 * 1024
+    pct = 100 * (1 - savings["processed_bytes"] / savings["original_bytes"])
+    return (f"Audio optimized for upload: {savings['original_bytes'] / mb:.1f} MB -> {savings['processed_bytes'] / mb:.1f} MB "
+            f"({pct:.0f}% smaller, ~{savings['upload_seconds_saved']:.0f}s faster at {UPLOAD_MBPS:g} Mbps).")
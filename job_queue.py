@@ -0,0 +1,253 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import streamlit as st
+from ai_engine import INTERACTIVE, RESULT_GRACE_SECONDS
+
+# ==========================================
+# BACKGROUND JOB QUEUE (LOCAL SQLITE STORE)
+# ==========================================
+# Long generations run on worker threads instead of inside the button handler,
+# so tab switches, widget changes and websocket hiccups never lose the work.
+# Dashboards enqueue a job, keep its id in session state and poll until the
+# handler has attached the result to a ticket.
+JOBS_DB_PATH = os.environ.get("BRIDGEBUILD_JOBS_DB", os.path.join(".bridgebuild", "jobs.sqlite3"))
+WORKER_COUNT = int(os.environ.get("BRIDGEBUILD_JOB_WORKERS", "4"))
+POLL_SECONDS = 1.0
+# Finished jobs keep their full prompt and result, so they are deleted after
+# this long. It has to outlast RESULT_GRACE_SECONDS, and a handoff draft that
+# nobody accepts within it is simply regenerated on accept.
+JOB_RETENTION_SECONDS = max(int(os.environ.get("BRIDGEBUILD_JOB_RETENTION_SECONDS", str(7 * 24 * 3600))), 2 * RESULT_GRACE_SECONDS)
+
+_HANDLERS = {}
+_CONTEXT = {}
+_WORKERS = []
+_WORKERS_LOCK = threading.Lock()
+_WAKEUP = threading.Event()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id TEXT,
+    ticket_id TEXT,
+    dedupe_key TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    payload TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_priority_idx ON jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS jobs_dedupe_key_idx ON jobs (dedupe_key);
+CREATE INDEX IF NOT EXISTS jobs_kind_ticket_idx ON jobs (kind, ticket_id);
+"""
+
+def _connect():
+    folder = os.path.dirname(JOBS_DB_PATH)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    if "progress" not in [col["name"] for col in conn.execute("PRAGMA table_info(jobs)")]:
+        # Stores created before progress reporting
+        conn.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+    return conn
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def register_handler(kind, fn):
+    """Registers `fn(job, context)` as the worker for `kind`. Its return value must be JSON-serializable.
+
+    `context` carries the process-wide `supabase` client and Gemini `api_key`.
+    """
+    _HANDLERS[kind] = fn
+
+def enqueue(kind, user_id, payload, ticket_id=None, dedupe_key=None, priority=INTERACTIVE):
+    """Queues a job and returns its id.
+
+    A job with the same dedupe key that is still queued, running, or finished
+    within the grace window is returned instead of queueing a duplicate.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if dedupe_key:
+            existing = conn.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND (status IN ('queued', 'running') OR (status = 'done' AND updated_at > ?)) ORDER BY created_at DESC LIMIT 1",
+                (dedupe_key, now - RESULT_GRACE_SECONDS)
+            ).fetchone()
+            if existing:
+                conn.execute("COMMIT")
+                return existing["id"]
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO jobs (id, kind, user_id, ticket_id, dedupe_key, priority, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, user_id, ticket_id, dedupe_key, priority, json.dumps(payload), now, now)
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    _WAKEUP.set()
+    return job_id
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        return _row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+def set_progress(job_id, text):
+    """Lets a running handler report what it is doing (e.g. upload percentage) to the polling widget."""
+    conn = _connect()
+    try:
+        conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (text, job_id))
+    finally:
+        conn.close()
+
+def raise_priority(job_id, priority):
+    """Moves a still-queued job up to `priority`; running and finished jobs are left alone."""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET priority = ?, updated_at = ? WHERE id = ? AND status = 'queued' AND priority > ?",
+            (priority, time.time(), job_id, priority)
+        )
+    finally:
+        conn.close()
+
+def find_job(dedupe_key):
+    """Latest job for `dedupe_key` that has not failed, however long ago it finished."""
+    conn = _connect()
+    try:
+        return _row_to_job(conn.execute(
+            "SELECT * FROM jobs WHERE dedupe_key = ? AND status != 'failed' ORDER BY created_at DESC LIMIT 1", (dedupe_key,)
+        ).fetchone())
+    finally:
+        conn.close()
+
+def queue_position(job):
+    """1-based place among queued jobs, or 0 once a worker has picked the job up."""
+    if job["status"] != "queued":
+        return 0
+    conn = _connect()
+    try:
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority < ? OR (priority = ? AND created_at < ?))",
+            (job["priority"], job["priority"], job["created_at"])
+        ).fetchone()[0]
+        return ahead + 1
+    finally:
+        conn.close()
+
+def _claim_next(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority, created_at LIMIT 1").fetchone()
+    if row is None:
+        conn.execute("COMMIT")
+        return None
+    conn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row["id"]))
+    conn.execute("COMMIT")
+    return row
+
+def _finish(conn, job_id, result=None, error=None):
+    status = "failed" if error else "done"
+    conn.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, progress = NULL, updated_at = ? WHERE id = ?",
+        (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+    )
+
+def _prune_finished(conn, now):
+    conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (now - JOB_RETENTION_SECONDS,))
+
+def _worker_loop():
+    conn = _connect()
+    while True:
+        row = _claim_next(conn)
+        if row is None:
+            _WAKEUP.wait(POLL_SECONDS)
+            _WAKEUP.clear()
+            continue
+        job = _row_to_job(row)
+        handler = _HANDLERS.get(job["kind"])
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind '{job['kind']}'.")
+            _finish(conn, job["id"], result=handler(job, _CONTEXT))
+        except Exception as e:
+            _finish(conn, job["id"], error=str(e))
+
+def start_workers(supabase, api_key, count=WORKER_COUNT):
+    """Starts the worker threads once per process.
+
+    Jobs orphaned by a restart are re-queued, and finished jobs older than
+    JOB_RETENTION_SECONDS are deleted.
+    """
+    with _WORKERS_LOCK:
+        _CONTEXT["supabase"] = supabase
+        _CONTEXT["api_key"] = api_key
+        if _WORKERS:
+            return
+        conn = _connect()
+        try:
+            conn.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),))
+            _prune_finished(conn, time.time())
+        finally:
+            conn.close()
+        for i in range(count):
+            worker = threading.Thread(target=_worker_loop, name=f"bridgebuild-job-worker-{i}", daemon=True)
+            worker.start()
+            _WORKERS.append(worker)
+
+# ==========================================
+# STREAMLIT POLLING WIDGET
+# ==========================================
+@st.fragment(run_every=2)
+def watch_job(session_key, label, on_complete):
+    """Polls the job stored under `st.session_state[session_key]` without blocking the page.
+
+    When the job finishes, `on_complete(job)` runs and the whole app reruns.
+    """
+    job_id = st.session_state.get(session_key)
+    if not job_id:
+        return
+    job = get_job(job_id)
+    if job is None:
+        st.session_state[session_key] = None
+        return
+
+    if job["status"] == "done":
+        on_complete(job)
+        st.session_state[session_key] = None
+        st.rerun()
+    elif job["status"] == "failed":
+        with st.status(label, state="error", expanded=True):
+            st.error(job["error"])
+            if st.button("Dismiss", key=f"dismiss_{job_id}"):
+                st.session_state[session_key] = None
+                st.rerun()
+    else:
+        with st.status(label, state="running", expanded=True):
+            position = queue_position(job)
+            if position:
+                st.write(f"⏳ Waiting for a free AI worker. You are #{position} in the queue...")
+            else:
+                st.write("Generating in the background. You can keep working; the result will appear here.")
+                if job["progress"]:
+                    st.caption(job["progress"])
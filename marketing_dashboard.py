@@ -1,9 +1,9 @@
 import streamlit as st
 import json
-from google import genai
-from google.genai import types
+from ai_engine import schedule, wait_for_result, queue_notice, generate_content, request_key
 from prompts import get_marketing_prompt, get_localization_prompt
 from utils import clean_json_output, safe_parse_json
+from data_layer import list_tickets, get_ticket_full_data
 
 def render_marketing_dashboard(supabase):
     st.title("BridgeBuild AI - Marketing Studio")
@@ -27,8 +27,7 @@ def render_marketing_dashboard(supabase):
     # --- 1. PROJECT SELECTOR ---
     st.markdown("#### Select Project for GTM Launch")
     try:
-        db_response = supabase.table("tickets").select("*").neq("status", "Draft").order("created_at", desc=True).execute()
-        active_projects = db_response.data
+        active_projects = list_tickets(supabase, exclude_statuses=("Draft",))
         
         if not active_projects:
             st.info("No approved projects available for marketing yet. Process a ticket in the Sales or PM hub first!")
@@ -57,25 +56,17 @@ def render_marketing_dashboard(supabase):
             st.error("System Error: AI Engine is currently offline.")
         else:
             try:
-                client = genai.Client(api_key=api_key)
                 MARKETING_PROMPT = get_marketing_prompt()
 
                 with st.status("Analyzing technical specs & generating copy...", expanded=True) as status:
                     model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
-                    project_context = f"PROJECT DATA:\n{selected_project.get('full_data', selected_project.get('summary'))}"
+                    project_context = f"PROJECT DATA:\n{get_ticket_full_data(supabase, selected_project['id']) or selected_project.get('summary')}"
                     
                     st.write("Drafting Landing Page & SEO...")
-                    response = client.models.generate_content(
-                        model=model_id, 
-                        config=types.GenerateContentConfig(
-                            system_instruction=MARKETING_PROMPT, 
-                            temperature=0.7, 
-                            response_mime_type="application/json"
-                        ),
-                        contents=[project_context]
-                    )
+                    job = schedule(st.session_state.user.id, lambda: generate_content(api_key, model_id, MARKETING_PROMPT, 0.7, project_context), key=request_key(st.session_state.user.id, "marketing_gtm", model_id, project_context))
+                    response_text = wait_for_result(job, queue_notice(st.empty()))
                     
-                    data, error_msg = safe_parse_json(response.text)
+                    data, error_msg = safe_parse_json(response_text)
                     
                     if error_msg:
                         status.update(label="Generation Failed", state="error", expanded=True)
@@ -102,7 +93,6 @@ def render_marketing_dashboard(supabase):
             
             if st.button("Translate & Localize Campaign"):
                 try:
-                    client = genai.Client(api_key=api_key)
                     LOCALIZATION_PROMPT = get_localization_prompt()
 
                     with st.status(f"Localizing for {target_region}...", expanded=True) as status:
@@ -113,17 +103,10 @@ def render_marketing_dashboard(supabase):
                         localization_context = f"BASE GTM STRATEGY:\n{base_gtm_str}\n\nTARGET REGION: {target_region}"
                         
                         st.write("Adapting cultural tone and SEO metrics...")
-                        response = client.models.generate_content(
-                            model=model_id, 
-                            config=types.GenerateContentConfig(
-                                system_instruction=LOCALIZATION_PROMPT, 
-                                temperature=0.7, 
-                                response_mime_type="application/json"
-                            ),
-                            contents=[localization_context]
-                        )
+                        job = schedule(st.session_state.user.id, lambda: generate_content(api_key, model_id, LOCALIZATION_PROMPT, 0.7, localization_context), key=request_key(st.session_state.user.id, "marketing_localization", model_id, localization_context))
+                        response_text = wait_for_result(job, queue_notice(st.empty()))
                         
-                        loc_data, error_msg = safe_parse_json(response.text)
+                        loc_data, error_msg = safe_parse_json(response_text)
                         
                         if error_msg:
                             status.update(label="Localization Failed", state="error", expanded=True)
@@ -1,16 +1,17 @@
 import streamlit as st
 import json
 import urllib.parse
-import tempfile
 import os
 import io
 import csv
 import re
 from datetime import datetime, timezone, timedelta
-from google import genai
-from google.genai import types
-from prompts import get_system_prompt, get_change_request_prompt, get_scope_slider_prompt, get_qa_script_prompt
-from utils import clean_json_output, generate_jira_format, convert_currency, safe_parse_json
+from prompts import get_change_request_prompt, get_scope_slider_prompt, get_qa_script_prompt
+from utils import clean_json_output, generate_jira_format, convert_currency, format_cost_range, safe_parse_json
+from ai_engine import schedule, wait_for_result, queue_notice, generate_content, request_key
+from job_queue import watch_job
+from data_layer import route_ticket, get_inbox, watch_inbox, claim_ticket, claim_badge, paged_tickets, page_controls, lazy_ticket_expander, delete_ticket, save_ticket_data, get_ticket_version, list_ticket_revisions, undo_target
+from generation_jobs import pm_ticket_payload, pm_handoff_context, find_handoff_draft, adopt_draft, submit_generation
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
@@ -186,6 +187,15 @@ def generate_jira_csv(ticket_data):
 # ==========================================
 # PM DASHBOARD RENDERER
 # ==========================================
+def _load_generated_ticket(result):
+    """Opens the ticket a finished background generation saved."""
+    st.session_state.active_ticket = result["data"]
+    st.session_state.active_ticket_id = result["ticket_id"]
+    st.session_state.cr_analysis = None
+    st.session_state.qa_script = None
+    # The handoff is saved; later generations in this session start their own project
+    st.session_state.pm_parent_ticket_id = None
+
 def render_pm_dashboard(supabase):
     
     with st.sidebar:
@@ -211,18 +221,26 @@ def render_pm_dashboard(supabase):
     if "cr_analysis" not in st.session_state: st.session_state.cr_analysis = None
     if "pending_handoff_dept" not in st.session_state: st.session_state.pending_handoff_dept = None
     if "qa_script" not in st.session_state: st.session_state.qa_script = None 
+    if "pm_generation_job" not in st.session_state: st.session_state.pm_generation_job = None
+    if "pm_draft_job" not in st.session_state: st.session_state.pm_draft_job = None
+    if "pm_parent_ticket_id" not in st.session_state: st.session_state.pm_parent_ticket_id = None
 
     # ==========================================
     # INCOMING SALES QUEUE (INBOX)
     # ==========================================
     try:
-        inbox_res = supabase.table("tickets").select("*").eq("status", "Awaiting PM Scoping").eq("target_department", "PM").order("created_at", desc=True).execute()
-        inbox_tickets = inbox_res.data
+        inbox_tickets = get_inbox(supabase, "PM", "Awaiting PM Scoping")
         
         if inbox_tickets:
-            st.info(f"📥 **INCOMING:** You have {len(inbox_tickets)} approved project(s) from Sales waiting in your queue!")
+            waiting = [item for item in inbox_tickets if not item.get('claimed_by')]
+            st.info(f"📥 **INCOMING:** You have {len(waiting)} approved project(s) from Sales waiting in your queue!")
             for item in inbox_tickets:
-                with st.expander(f"🟢 Approved Sales Deal: {item['summary'][:60]}..."):
+                if item.get('claimed_by'):
+                    st.caption(f"{claim_badge(item, st.session_state.user.id)} · 🟢 Approved Sales Deal: {item['summary'][:60]}...")
+                    continue
+                with lazy_ticket_expander(supabase, f"🟢 Approved Sales Deal: {item['summary'][:60]}...", item, f"pm_inbox_{item['id']}") as item:
+                    if item is None:
+                        continue
                     try:
                         sales_data = json.loads(item['full_data'])
                     except:
@@ -233,10 +251,12 @@ def render_pm_dashboard(supabase):
                     for db in sales_data.get("deal_breakers", []):
                         st.error(f"- {db}")
                         
-                    if st.button("Accept & Load into Generator", key=f"accept_{item['id']}", type="primary"):
-                        supabase.table("tickets").update({"status": "Accepted by PM"}).eq("id", item['id']).execute()
-                        
-                        injection_text = f"SALES HANDOFF CONTEXT:\nProject Summary: {sales_data.get('project_summary', item['summary'])}\nBudget: {item['cost']}\nTimeline: {item['time']}\nDeal Breakers: {sales_data.get('deal_breakers', [])}\nClient Asks: {sales_data.get('client_questions', [])}"
+                    accepted = st.button("Accept & Load into Generator", key=f"accept_{item['id']}", type="primary")
+                    if accepted and not claim_ticket(supabase, item['id'], "Awaiting PM Scoping", "Accepted by PM", st.session_state.user.id):
+                        st.toast("A teammate already accepted this ticket.")
+                        st.rerun()
+                    elif accepted:
+                        injection_text = pm_handoff_context(item)
                         
                         st.session_state.sales_input = injection_text
                         
@@ -246,12 +266,22 @@ def render_pm_dashboard(supabase):
                         st.session_state.pending_handoff_dept = None 
                         st.session_state.cr_analysis = None 
                         st.session_state.qa_script = None
+
+                        # Pick up the draft pre-generated when Sales routed the quote, if it matches our settings
+                        model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
+                        draft = find_handoff_draft("pm_ticket", item['id'], pm_ticket_payload(model_id, rate_type, build_strategy, injection_text))
+                        st.session_state.pm_draft_job = draft["id"] if draft else None
+                        # The PM ticket generated from this handoff joins the quote's project
+                        st.session_state.pm_parent_ticket_id = item['id']
                         
                         st.rerun()
             st.divider()
     except Exception as e:
         st.warning(f"Could not load Inbox: {str(e)}")
 
+    # New handoffs show up without a manual refresh
+    watch_inbox("PM", "Awaiting PM Scoping")
+
     # ==========================================
     # GENERATOR UI
     # ==========================================
@@ -273,70 +303,16 @@ def render_pm_dashboard(supabase):
         if not api_key: st.error("System Error: AI Engine is currently offline.")
         elif not sales_input and not uploaded_file: st.warning("Please enter text or upload a file.")
         else:
-            try:
-                client = genai.Client(api_key=api_key)
-                SYSTEM_PROMPT = get_system_prompt(rate_type, build_strategy)
-                
-                with st.status("Consulting Engineering & Finance Teams...", expanded=True) as status:
-                    st.write("Parsing input and extracting requirements...")
-                    model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
-                    prompt_contents = []
-                    
-                    if uploaded_file:
-                        st.write("Processing multi-modal file...")
-                        file_ext = f".{uploaded_file.name.split('.')[-1]}"
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-                            tmp.write(uploaded_file.getvalue())
-                            tmp_path = tmp.name
-                        gemini_file = client.files.upload(file=tmp_path)
-                        prompt_contents.append(gemini_file)
-                        os.remove(tmp_path)
-                    
-                    st.write(f"Generating Architecture (Strategy: {build_strategy})...")
-                    text_instruction = sales_input if sales_input else "Analyze this meeting recording/transcript."
-                    prompt_contents.append(text_instruction)
-                    
-                    response = client.models.generate_content(
-                        model=model_id, 
-                        config=types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT, temperature=0.0, response_mime_type="application/json"),
-                        contents=prompt_contents
-                    )
-                    
-                    if uploaded_file:
-                        client.files.delete(name=gemini_file.name)
-                    
-                    st.write("Structuring Epics, Stories, and Budgets...")
-                    data, error_msg = safe_parse_json(response.text)
-                    
-                    if error_msg:
-                        status.update(label="Analysis Failed", state="error", expanded=True)
-                        st.error(error_msg)
-                        st.stop()
-                    else:
-                        status.update(label="Agile Ticket Generated!", state="complete", expanded=False)
-                        
-                st.session_state.active_ticket = data
-                st.session_state.cr_analysis = None
-                st.session_state.qa_script = None
-                st.success("Analysis Complete!")
-
-                raw_cost = data.get("budget_estimate_usd", "0-0")
-                low_end = raw_cost.split("-")[0] if "-" in raw_cost else raw_cost
-                high_end = raw_cost.split("-")[1] if "-" in raw_cost else raw_cost
-                fmt_low = convert_currency(low_end, currency)
-                fmt_high = convert_currency(high_end, currency)
-
-                new_ticket = {
-                    "user_id": st.session_state.user.id, "summary": data.get("summary"), "cost": f"{fmt_low} - {fmt_high}",
-                    "raw_cost": raw_cost, "complexity": data.get("complexity_score"), "time": data.get("development_time"), 
-                    "full_data": json.dumps(data), "status": "Draft", "target_department": "None"
-                }
-                db_res = supabase.table("tickets").insert(new_ticket).execute()
-                st.session_state.active_ticket_id = db_res.data[0]['id']
-                st.rerun()
-
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+            model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
+            text_instruction = sales_input if sales_input else "Analyze this meeting recording/transcript."
+            payload = pm_ticket_payload(model_id, rate_type, build_strategy, text_instruction, currency=currency)
+            submit_generation("pm_ticket", payload, "pm_generation_job", st.session_state.pm_parent_ticket_id, uploaded_file)
+
+    if st.session_state.pm_generation_job:
+        watch_job("pm_generation_job", f"Consulting Engineering & Finance Teams (Strategy: {build_strategy})...", lambda job: _load_generated_ticket(job["result"]))
+
+    if st.session_state.pm_draft_job:
+        watch_job("pm_draft_job", "Loading the pre-generated draft for this handoff...", lambda job: _load_generated_ticket(adopt_draft(supabase, job, st.session_state.user.id, currency)))
 
     # ==========================================
     # ACTIVE TICKET UI & GOD-MODE
@@ -356,6 +332,26 @@ def render_pm_dashboard(supabase):
             st.subheader("Active Architecture")
         with col_toggle:
             god_mode = st.toggle("Enable God-Mode", value=False, help="Manually override AI outputs instantly.")
+            if st.session_state.active_ticket_id and st.button("↩️ Undo Last Edit", use_container_width=True):
+                try:
+                    target = undo_target(list_ticket_revisions(supabase, st.session_state.active_ticket_id, limit=1))
+                    if target is None:
+                        st.toast("Nothing to undo on this ticket.")
+                    else:
+                        # Undo only steps back; there is no redo. The restore is logged as a revision like any edit
+                        previous_data = get_ticket_version(supabase, st.session_state.active_ticket_id, target)
+                        previous_raw = previous_data.get("budget_estimate_usd", "0-0")
+                        save_ticket_data(supabase, st.session_state.active_ticket_id, data, previous_data, {
+                            "summary": previous_data.get("summary"),
+                            "complexity": previous_data.get("complexity_score"),
+                            "time": previous_data.get("development_time"),
+                            "cost": format_cost_range(previous_raw, currency),
+                            "raw_cost": previous_raw
+                        }, restored_from=target)
+                        st.session_state.active_ticket = previous_data
+                        st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to undo: {str(e)}")
 
         if god_mode:
             st.warning("**God-Mode Active:** You are bypassing the AI. Changes made here will permanently overwrite the architecture in the database.")
@@ -390,14 +386,13 @@ def render_pm_dashboard(supabase):
                             fmt_l = convert_currency(low_e, currency)
                             fmt_h = convert_currency(high_e, currency)
                             
-                            supabase.table("tickets").update({
+                            save_ticket_data(supabase, st.session_state.active_ticket_id, data, updated_data, {
                                 "summary": new_summary, 
                                 "complexity": new_complexity, 
                                 "time": new_time, 
                                 "cost": f"{fmt_l} - {fmt_h}",
-                                "raw_cost": new_raw_cost,
-                                "full_data": json.dumps(updated_data)
-                            }).eq("id", st.session_state.active_ticket_id).execute()
+                                "raw_cost": new_raw_cost
+                            })
                             
                         st.rerun()
                     except Exception as e:
@@ -480,7 +475,6 @@ def render_pm_dashboard(supabase):
             else:
                 with st.status(f"Stripping scope to fit ${target_budget:,}...", expanded=True) as status:
                     try:
-                        client = genai.Client(api_key=api_key)
                         SCOPE_PROMPT = get_scope_slider_prompt()
                         model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
                         
@@ -489,17 +483,10 @@ def render_pm_dashboard(supabase):
                         
                         context = f"ORIGINAL PROJECT SCOPE:\n{json.dumps(data)}\n\nTARGET BUDGET: ${target_budget}"
                         
-                        response = client.models.generate_content(
-                            model=model_id,
-                            config=types.GenerateContentConfig(
-                                system_instruction=SCOPE_PROMPT,
-                                temperature=0.2,
-                                response_mime_type="application/json"
-                            ),
-                            contents=[context]
-                        )
+                        job = schedule(st.session_state.user.id, lambda: generate_content(api_key, model_id, SCOPE_PROMPT, 0.2, context), key=request_key(st.session_state.user.id, "pm_scope_slider", model_id, context))
+                        response_text = wait_for_result(job, queue_notice(st.empty()))
                         
-                        new_data, error_msg = safe_parse_json(response.text)
+                        new_data, error_msg = safe_parse_json(response_text)
                         
                         if error_msg:
                             status.update(label="Recalculation Failed", state="error", expanded=True)
@@ -517,14 +504,13 @@ def render_pm_dashboard(supabase):
                                 fmt_l = convert_currency(low_e, currency)
                                 fmt_h = convert_currency(high_e, currency)
                                 
-                                supabase.table("tickets").update({
+                                save_ticket_data(supabase, st.session_state.active_ticket_id, data, new_data, {
                                     "summary": new_data.get("summary"), 
                                     "complexity": new_data.get("complexity_score"), 
                                     "time": new_data.get("development_time"), 
                                     "cost": f"{fmt_l} - {fmt_h}",
-                                    "raw_cost": new_raw,
-                                    "full_data": json.dumps(new_data)
-                                }).eq("id", st.session_state.active_ticket_id).execute()
+                                    "raw_cost": new_raw
+                                })
                                 
                             st.rerun()
                     except Exception as e:
@@ -548,24 +534,16 @@ def render_pm_dashboard(supabase):
             else:
                 with st.status("Analyzing Scope Creep Impact...", expanded=True) as status:
                     try:
-                        client = genai.Client(api_key=api_key)
                         CR_PROMPT = get_change_request_prompt()
                         model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
 
                         st.write("Cross-referencing request against Base Project Data...")
                         context = f"BASE PROJECT DATA:\n{json.dumps(data)}\n\nNEW CLIENT REQUEST:\n{cr_input}"
 
-                        response = client.models.generate_content(
-                            model=model_id,
-                            config=types.GenerateContentConfig(
-                                system_instruction=CR_PROMPT,
-                                temperature=0.2,
-                                response_mime_type="application/json"
-                            ),
-                            contents=[context]
-                        )
+                        job = schedule(st.session_state.user.id, lambda: generate_content(api_key, model_id, CR_PROMPT, 0.2, context), key=request_key(st.session_state.user.id, "pm_change_request", model_id, context))
+                        response_text = wait_for_result(job, queue_notice(st.empty()))
 
-                        cr_data, error_msg = safe_parse_json(response.text)
+                        cr_data, error_msg = safe_parse_json(response_text)
 
                         if error_msg:
                             status.update(label="Calculation Failed", state="error", expanded=True)
@@ -623,7 +601,6 @@ def render_pm_dashboard(supabase):
             else:
                 with st.status("Writing E2E Test Scripts...", expanded=True) as status:
                     try:
-                        client = genai.Client(api_key=api_key)
                         QA_PROMPT = get_qa_script_prompt()
                         model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
 
@@ -635,17 +612,10 @@ def render_pm_dashboard(supabase):
                         }
                         context = f"PROJECT SCOPE:\n{json.dumps(qa_context)}"
 
-                        response = client.models.generate_content(
-                            model=model_id,
-                            config=types.GenerateContentConfig(
-                                system_instruction=QA_PROMPT,
-                                temperature=0.1, 
-                                response_mime_type="application/json"
-                            ),
-                            contents=[context]
-                        )
+                        job = schedule(st.session_state.user.id, lambda: generate_content(api_key, model_id, QA_PROMPT, 0.1, context), key=request_key(st.session_state.user.id, "pm_qa_script", model_id, context))
+                        response_text = wait_for_result(job, queue_notice(st.empty()))
 
-                        qa_data, error_msg = safe_parse_json(response.text)
+                        qa_data, error_msg = safe_parse_json(response_text)
 
                         if error_msg:
                             status.update(label="QA Generation Failed", state="error", expanded=True)
@@ -803,7 +773,7 @@ def render_pm_dashboard(supabase):
                     if len(warnings) == 0:
                         status.update(label="Pre-Flight Check Passed! Routing ticket...", state="complete", expanded=False)
                         new_status = "Awaiting UI/UX Scoping" if dept == "Design" else "Awaiting Tech Architecture"
-                        supabase.table("tickets").update({"status": new_status, "target_department": dept}).eq("id", st.session_state.active_ticket_id).execute()
+                        route_ticket(supabase, st.session_state.active_ticket_id, new_status, dept)
                         st.success(f"Boom! Successfully routed to the {dept} Inbox.")
                         st.session_state.pending_handoff_dept = None 
                     else:
@@ -821,7 +791,7 @@ def render_pm_dashboard(supabase):
                         with col_over2:
                             if st.button(f"Override & Send to {dept}", type="primary", use_container_width=True):
                                 new_status = "Awaiting UI/UX Scoping" if dept == "Design" else "Awaiting Tech Architecture"
-                                supabase.table("tickets").update({"status": new_status, "target_department": dept}).eq("id", st.session_state.active_ticket_id).execute()
+                                route_ticket(supabase, st.session_state.active_ticket_id, new_status, dept)
                                 st.success(f"Boom! Successfully routed to the {dept} Inbox (Override Applied).")
                                 st.session_state.pending_handoff_dept = None
                                 st.rerun()
@@ -832,21 +802,17 @@ def render_pm_dashboard(supabase):
             else:
                 with st.spinner("AI is updating the ticket..."):
                     try:
-                        client = genai.Client(api_key=api_key)
                         model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
                         update_prompt = f"You are a Technical Product Manager. Update the JSON ticket based on request.\nCURRENT TICKET:\n{json.dumps(data)}\nUSER REQUEST:\n{refine_query}"
                         
-                        update_response = client.models.generate_content(
-                            model=model_id, 
-                            config=types.GenerateContentConfig(temperature=0.1, response_mime_type="application/json"),
-                            contents=update_prompt
-                        )
+                        job = schedule(st.session_state.user.id, lambda: generate_content(api_key, model_id, None, 0.1, update_prompt), key=request_key(st.session_state.user.id, "pm_refine", model_id, update_prompt))
+                        update_response_text = wait_for_result(job, queue_notice(st.empty()))
                         
-                        updated_data = json.loads(clean_json_output(update_response.text))
+                        updated_data = json.loads(clean_json_output(update_response_text))
                         st.session_state.active_ticket = updated_data
                         
                         if st.session_state.active_ticket_id:
-                            supabase.table("tickets").update({"summary": updated_data.get("summary"), "complexity": updated_data.get("complexity_score"), "time": updated_data.get("development_time"), "full_data": json.dumps(updated_data)}).eq("id", st.session_state.active_ticket_id).execute()
+                            save_ticket_data(supabase, st.session_state.active_ticket_id, data, updated_data, {"summary": updated_data.get("summary"), "complexity": updated_data.get("complexity_score"), "time": updated_data.get("development_time")})
                             
                         st.rerun() 
                     except Exception as e:
@@ -855,10 +821,7 @@ def render_pm_dashboard(supabase):
     st.divider()
     st.subheader("Saved Tickets History")
     try:
-        db_response = supabase.table("tickets").select("*").eq("user_id", st.session_state.user.id).neq("complexity", "Engineering Architecture").neq("complexity", "UI/UX Scoping").order("created_at", desc=True).execute()
-        saved_tickets = db_response.data
-        
-        pm_tickets = [t for t in saved_tickets if t.get('complexity') not in ['Green', 'Yellow', 'Red']]
+        pm_tickets, has_older = paged_tickets(supabase, "pm_history", user_id=st.session_state.user.id, ticket_type="pm_ticket")
         
         if pm_tickets:
             for i, item in enumerate(pm_tickets):
@@ -873,7 +836,9 @@ def render_pm_dashboard(supabase):
                 else:
                     status_icon = "✅"
                 
-                with st.expander(f"{status_icon} Ticket: {item['summary'][:60]}..."):
+                with lazy_ticket_expander(supabase, f"{status_icon} Ticket: {item['summary'][:60]}...", item, f"pm_hist_{item['id']}") as item:
+                    if item is None:
+                        continue
                     try:
                         past_data = json.loads(clean_json_output(item['full_data']))
                     except:
@@ -937,7 +902,7 @@ def render_pm_dashboard(supabase):
                     with hist_btn_col3:
                         if st.button("Delete", key=f"del_{item['id']}", use_container_width=True):
                             try:
-                                supabase.table("tickets").delete().eq("id", item['id']).execute()
+                                delete_ticket(supabase, item['id'])
                                 st.rerun() 
                             except Exception as e:
                                 st.error(f"Failed to delete ticket: {str(e)}")
@@ -962,16 +927,17 @@ def render_pm_dashboard(supabase):
                         hist_hand_col1, hist_hand_col2 = st.columns(2)
                         with hist_hand_col1:
                             if st.button("Send to Design", key=f"hist_design_{item['id']}", use_container_width=True):
-                                supabase.table("tickets").update({"status": "Awaiting UI/UX Scoping", "target_department": "Design"}).eq("id", item['id']).execute()
+                                route_ticket(supabase, item['id'], "Awaiting UI/UX Scoping", "Design")
                                 st.rerun()
                         with hist_hand_col2:
                             if st.button("Send to Engineering", key=f"hist_eng_{item['id']}", use_container_width=True):
-                                supabase.table("tickets").update({"status": "Awaiting Tech Architecture", "target_department": "Engineering"}).eq("id", item['id']).execute()
+                                route_ticket(supabase, item['id'], "Awaiting Tech Architecture", "Engineering")
                                 st.rerun()
 
                     with st.expander("🎫 View Jira / Confluence Markup", expanded=False):
                         st.code(generate_jira_format(past_data, currency), language="jira")
         else:
             st.info("No saved PM tickets yet. Generate your first one above!")
+        page_controls("pm_history", pm_tickets, has_older)
     except Exception as e:
         st.error(f"Could not load history: {str(e)}")
@@ -306,3 +306,30 @@ You MUST return your response EXACTLY as a valid JSON object matching this schem
   ]
 }
 """
+
+def get_chunk_extraction_prompt():
+    return """You are a meticulous Discovery Analyst at a software agency. 
+You are reading ONE segment of a much longer client transcript, document, or meeting recording. Segments overlap slightly, so it is fine to repeat a point that sits on the boundary.
+
+Extract every concrete signal from THIS segment only. Quote numbers, names, platforms, and deadlines exactly as stated. Do not invent anything that is not in the segment, and do not summarize the project as a whole.
+
+You MUST return your response EXACTLY as a valid JSON object matching this schema. Do not use markdown wrappers like ```json.
+{
+  "requirements": ["Each feature, screen, integration, or user need mentioned."],
+  "constraints": ["Technical, compliance, platform, or stack constraints."],
+  "budget_signals": ["Any budget figure, pricing expectation, or cost concern."],
+  "timeline_signals": ["Any deadline, launch date, or phasing mentioned."],
+  "stakeholders": ["People, roles, or user personas mentioned."],
+  "risks_and_open_questions": ["Deal breakers, unknowns, or things the client was unsure about."]
+}
+"""
+
+def get_transcription_prompt():
+    return """You are a professional meeting transcriber. 
+Transcribe the attached client meeting recording verbatim in its original language. Label speakers as "Speaker 1", "Speaker 2", etc. unless they introduce themselves by name. Drop filler words (um, uh) and long silences, but never drop numbers, names, dates, prices, or technical terms.
+
+You MUST return your response EXACTLY as a valid JSON object matching this schema. Do not use markdown wrappers like ```json.
+{
+  "transcript": "Speaker 1: ...\\nSpeaker 2: ..."
+}
+"""
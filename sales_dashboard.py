@@ -1,14 +1,13 @@
 import streamlit as st
 import json
 import os
-import tempfile
 import io
 from urllib.parse import quote
 from datetime import datetime, timezone, timedelta
-from google import genai
-from google.genai import types
-from prompts import get_sales_prompt
-from utils import clean_json_output, convert_currency, safe_parse_json
+from utils import clean_json_output, convert_currency
+from job_queue import watch_job
+from data_layer import route_ticket, paged_tickets, page_controls, lazy_ticket_expander, delete_ticket
+from generation_jobs import sales_quote_payload, submit_generation
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
@@ -214,6 +213,11 @@ def generate_sales_pptx(ticket_data):
 # ==========================================
 # SALES DASHBOARD RENDERER
 # ==========================================
+def _load_generated_quote(result):
+    """Opens the quote a finished background generation saved."""
+    st.session_state.active_sales_ticket = result["data"]
+    st.session_state.active_sales_ticket_id = result["ticket_id"]
+
 def render_sales_dashboard(supabase):
     st.title("BridgeBuild AI - Sales Intake")
     st.markdown("### Quickly validate requirements and get estimated timelines.")
@@ -236,6 +240,7 @@ def render_sales_dashboard(supabase):
 
     if "active_sales_ticket" not in st.session_state: st.session_state.active_sales_ticket = None
     if "active_sales_ticket_id" not in st.session_state: st.session_state.active_sales_ticket_id = None
+    if "sales_generation_job" not in st.session_state: st.session_state.sales_generation_job = None
 
     if st.button("Analyze Request", type="primary"):
         if not api_key:
@@ -243,71 +248,13 @@ def render_sales_dashboard(supabase):
         elif not sales_input and not uploaded_file:
             st.warning("Please enter text or upload a file to proceed.")
         else:
-            try:
-                client = genai.Client(api_key=api_key)
-                SALES_PROMPT = get_sales_prompt(rate_type)
-
-                with st.status("Initializing AI Engine...", expanded=True) as status:
-                    st.write("Parsing input and extracting requirements...")
-                    model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
-                    prompt_contents = []
-                    
-                    if uploaded_file:
-                        file_ext = f".{uploaded_file.name.split('.')[-1]}"
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-                            tmp.write(uploaded_file.getvalue())
-                            tmp_path = tmp.name
-                        gemini_file = client.files.upload(file=tmp_path)
-                        prompt_contents.append(gemini_file)
-                        os.remove(tmp_path)
-                    
-                    st.write("Consulting Sales & Engineering models...")
-                    text_instruction = sales_input if sales_input else "Analyze this client request."
-                    prompt_contents.append(text_instruction)
-                    
-                    response = client.models.generate_content(
-                        model=model_id, 
-                        config=types.GenerateContentConfig(system_instruction=SALES_PROMPT, temperature=0.0, response_mime_type="application/json"),
-                        contents=prompt_contents
-                    )
-                    
-                    if uploaded_file:
-                        client.files.delete(name=gemini_file.name)
-                    
-                    st.write("Formatting budget and feasibility metrics...")
-                    data, error_msg = safe_parse_json(response.text)
-                    
-                    if error_msg:
-                        status.update(label="Analysis Failed", state="error", expanded=True)
-                        st.error(error_msg)
-                        st.stop()
-                    else:
-                        status.update(label="Analysis Complete!", state="complete", expanded=False)
-                        st.session_state.active_sales_ticket = data
+            model_id = "gemini-2.5-flash" if "Flash" in model_choice else "gemini-2.5-pro"
+            text_instruction = sales_input if sales_input else "Analyze this client request."
+            payload = sales_quote_payload(model_id, rate_type, text_instruction, currency=currency)
+            submit_generation("sales_quote", payload, "sales_generation_job", uploaded_file=uploaded_file)
 
-                raw_cost = data.get("budget_estimate_usd", "0-0")
-                low_end = raw_cost.split("-")[0] if "-" in raw_cost else raw_cost
-                high_end = raw_cost.split("-")[1] if "-" in raw_cost else raw_cost
-                fmt_low = convert_currency(low_end, currency)
-                fmt_high = convert_currency(high_end, currency)
-                score = data.get("feasibility_score", "Yellow")
-
-                new_ticket = {
-                    "user_id": st.session_state.user.id,
-                    "summary": data.get("project_summary", "Sales Intake"),
-                    "cost": f"{fmt_low} - {fmt_high}",
-                    "raw_cost": raw_cost,
-                    "complexity": score, 
-                    "time": data.get("estimated_timeline", "Unknown"),
-                    "full_data": json.dumps(data),
-                    "status": "Draft",               
-                    "target_department": "None"      
-                }
-                db_res = supabase.table("tickets").insert(new_ticket).execute()
-                st.session_state.active_sales_ticket_id = db_res.data[0]['id']
-
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+    if st.session_state.sales_generation_job:
+        watch_job("sales_generation_job", "Consulting Sales & Engineering models...", lambda job: _load_generated_quote(job["result"]))
 
     # ==========================================
     # RENDER THE ACTIVE SALES UI (EXECUTIVE POLISH)
@@ -408,7 +355,7 @@ def render_sales_dashboard(supabase):
         if st.session_state.active_sales_ticket_id:
             if st.button("Approve Quote & Send to PM Hub", type="primary", use_container_width=True):
                 try:
-                    supabase.table("tickets").update({"status": "Awaiting PM Scoping", "target_department": "PM"}).eq("id", st.session_state.active_sales_ticket_id).execute()
+                    route_ticket(supabase, st.session_state.active_sales_ticket_id, "Awaiting PM Scoping", "PM")
                     st.success("Successfully routed to the PM Inbox.")
                 except Exception as e:
                     st.error(f"Failed to handoff ticket: {str(e)}")
@@ -418,8 +365,7 @@ def render_sales_dashboard(supabase):
     st.subheader("Saved Sales Quotes")
     
     try:
-        db_response = supabase.table("tickets").select("*").eq("user_id", st.session_state.user.id).order("created_at", desc=True).execute()
-        saved_tickets = db_response.data
+        saved_tickets, has_older = paged_tickets(supabase, "sales_history", user_id=st.session_state.user.id, ticket_type="sales_quote")
         
         if saved_tickets:
             for item in saved_tickets:
@@ -427,7 +373,9 @@ def render_sales_dashboard(supabase):
                 status_icon = "🟢" if item.get('status') == 'Awaiting PM Scoping' else "📝"
                 expander_title = f"{status_icon} Quote: {item['summary'][:55]}..."
                 
-                with st.expander(expander_title):
+                with lazy_ticket_expander(supabase, expander_title, item, f"sales_hist_{item['id']}") as item:
+                    if item is None:
+                        continue
                     try:
                         past_data = json.loads(clean_json_output(item['full_data']))
                     except:
@@ -465,7 +413,7 @@ def render_sales_dashboard(supabase):
                             st.warning("Are you sure?")
                             if st.button("Confirm Delete", key=f"confirm_del_sales_{item['id']}", type="primary"):
                                 try:
-                                    supabase.table("tickets").delete().eq("id", item['id']).execute()
+                                    delete_ticket(supabase, item['id'])
                                     st.rerun()
                                 except Exception as e:
                                     st.error(f"Failed to delete: {str(e)}")
@@ -482,7 +430,7 @@ def render_sales_dashboard(supabase):
 
                     if current_status == 'Draft':
                         if st.button("Send to PM Hub", key=f"handoff_{item['id']}", use_container_width=True):
-                            supabase.table("tickets").update({"status": "Awaiting PM Scoping", "target_department": "PM"}).eq("id", item['id']).execute()
+                            route_ticket(supabase, item['id'], "Awaiting PM Scoping", "PM")
                             st.rerun()
                             
                     st.divider()
@@ -509,6 +457,6 @@ def render_sales_dashboard(supabase):
                             st.error(f"**{prefix}** {rest.strip()}" if prefix else rest)
         else:
             st.info("No saved quotes yet. Run an analysis above!")
-            
+        page_controls("sales_history", saved_tickets, has_older)
     except Exception as e:
         st.error(f"Could not load history: {str(e)}")
@@ -0,0 +1,6 @@
+-- Generation buttons stamp every ticket insert with an idempotency key so that
+-- Streamlit reruns and double-clicks can never create duplicate rows.
+alter table public.tickets add column if not exists idempotency_key text;
+
+create unique index if not exists tickets_idempotency_key_key
+    on public.tickets (idempotency_key);
@@ -0,0 +1,14 @@
+-- Each unique meeting recording is transcribed once. Transcripts are keyed by
+-- the SHA-256 of the audio bytes and tickets remember which recording they
+-- were generated from, so every department reuses the same text.
+create table if not exists public.transcripts (
+    file_hash text primary key,
+    file_name text,
+    transcript text not null,
+    created_at timestamptz not null default now()
+);
+
+alter table public.tickets add column if not exists source_file_hash text;
+
+create index if not exists tickets_source_file_hash_idx
+    on public.tickets (source_file_hash);
@@ -0,0 +1,27 @@
+-- The admin Global Analytics tab reads pipeline metrics from this view instead
+-- of downloading every ticket. It returns one row per (status, department)
+-- pair, so the page costs the same however many tickets exist.
+
+-- Mirrors admin_dashboard.extract_average_cost: '15000-20000' -> 17500,
+-- '$8,000' -> 8000, anything without digits -> 0.
+create or replace function public.raw_cost_average(raw_cost text)
+returns numeric
+language sql
+immutable
+as $$
+    select coalesce(avg(m[1]::numeric), 0)
+    from regexp_matches(replace(coalesce(raw_cost, ''), ',', ''), '(\d+)', 'g') with ordinality as t(m, n)
+    where n <= 2
+$$;
+
+create or replace view public.ticket_pipeline_stats as
+select
+    status,
+    target_department,
+    count(*) as ticket_count,
+    coalesce(sum(public.raw_cost_average(raw_cost)), 0) as pipeline_value
+from public.tickets
+group by status, target_department;
+
+create index if not exists tickets_status_department_idx
+    on public.tickets (status, target_department);
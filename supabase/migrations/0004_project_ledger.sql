@@ -0,0 +1,104 @@
+-- Profitability ledger. Closing out a project writes one ledger row and bumps
+-- the running company totals in the same transaction, so margin analytics are
+-- a single small read instead of re-parsing every completed ticket.
+create table if not exists public.project_ledger (
+    ticket_id uuid primary key references public.tickets (id) on delete cascade,
+    summary text,
+    estimate numeric not null default 0,
+    actual numeric not null default 0,
+    variance numeric generated always as (estimate - actual) stored,
+    actual_time text,
+    closed_at timestamptz not null default now()
+);
+
+create index if not exists project_ledger_closed_at_idx
+    on public.project_ledger (closed_at desc, ticket_id desc);
+
+create table if not exists public.ledger_totals (
+    id smallint primary key default 1 check (id = 1),
+    project_count integer not null default 0,
+    total_estimate numeric not null default 0,
+    total_actual numeric not null default 0,
+    total_variance numeric generated always as (total_estimate - total_actual) stored
+);
+
+-- Closes out a "Ready for Dev" ticket: marks it billed, records the actuals in
+-- its full_data, adds its ledger row and updates the totals. Calling it again
+-- for an already billed ticket changes nothing.
+create or replace function public.finalize_project(p_ticket_id uuid, p_actual numeric, p_actual_time text)
+returns void
+language plpgsql
+as $$
+declare
+    v_ticket public.tickets%rowtype;
+    v_estimate numeric;
+begin
+    select * into v_ticket from public.tickets where id = p_ticket_id for update;
+    if not found then
+        raise exception 'Ticket % does not exist', p_ticket_id;
+    end if;
+    if v_ticket.status = 'Completed & Billed' then
+        return;
+    end if;
+
+    v_estimate := public.raw_cost_average(v_ticket.raw_cost);
+
+    update public.tickets
+    set status = 'Completed & Billed',
+        target_department = 'None',
+        full_data = (coalesce(nullif(v_ticket.full_data::text, ''), '{}')::jsonb
+                     || jsonb_build_object('actual_cost', p_actual, 'actual_time', p_actual_time))::text
+    where id = p_ticket_id;
+
+    insert into public.project_ledger (ticket_id, summary, estimate, actual, actual_time)
+    values (p_ticket_id, v_ticket.summary, v_estimate, p_actual, p_actual_time);
+
+    insert into public.ledger_totals as t (id, project_count, total_estimate, total_actual)
+    values (1, 1, v_estimate, p_actual)
+    on conflict (id) do update
+    set project_count = t.project_count + 1,
+        total_estimate = t.total_estimate + excluded.total_estimate,
+        total_actual = t.total_actual + excluded.total_actual;
+end;
+$$;
+
+-- Deleting a billed ticket removes its ledger row; keep the totals in step.
+create or replace function public.project_ledger_after_delete()
+returns trigger
+language plpgsql
+as $$
+begin
+    update public.ledger_totals
+    set project_count = project_count - 1,
+        total_estimate = total_estimate - old.estimate,
+        total_actual = total_actual - old.actual
+    where id = 1;
+    return old;
+end;
+$$;
+
+drop trigger if exists project_ledger_after_delete on public.project_ledger;
+create trigger project_ledger_after_delete
+    after delete on public.project_ledger
+    for each row execute function public.project_ledger_after_delete();
+
+-- Backfill projects closed out before the ledger existed
+insert into public.project_ledger (ticket_id, summary, estimate, actual, actual_time, closed_at)
+select
+    id,
+    summary,
+    public.raw_cost_average(raw_cost),
+    coalesce((full_data::jsonb ->> 'actual_cost')::numeric, public.raw_cost_average(raw_cost)),
+    full_data::jsonb ->> 'actual_time',
+    created_at
+from public.tickets
+where status = 'Completed & Billed'
+on conflict (ticket_id) do nothing;
+
+insert into public.ledger_totals (id, project_count, total_estimate, total_actual)
+select 1, count(*), coalesce(sum(estimate), 0), coalesce(sum(actual), 0)
+from public.project_ledger
+on conflict (id) do update
+set project_count = excluded.project_count,
+    total_estimate = excluded.total_estimate,
+    total_actual = excluded.total_actual;
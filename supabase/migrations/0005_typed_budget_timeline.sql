@@ -0,0 +1,51 @@
+-- Numeric budget and timeline columns written next to the display strings.
+-- budget_low/high are in `currency` (the AI always estimates in USD);
+-- days_low/high are working days (weeks x5, months x20). The app fills them on
+-- every insert/update that touches raw_cost or time; existing rows are
+-- backfilled here with the same rules as utils.parse_budget_range and
+-- utils.parse_timeline_days.
+alter table public.tickets
+    add column if not exists budget_low numeric,
+    add column if not exists budget_high numeric,
+    add column if not exists days_low integer,
+    add column if not exists days_high integer,
+    add column if not exists currency text;
+
+update public.tickets t
+set budget_low = coalesce(b.nums[1], 0),
+    budget_high = coalesce(b.nums[2], b.nums[1], 0),
+    currency = 'USD'
+from (
+    select id, array(
+        select m[1]::numeric
+        from regexp_matches(replace(coalesce(raw_cost, ''), ',', ''), '(\d+)', 'g') as m
+    ) as nums
+    from public.tickets
+) b
+where b.id = t.id and t.budget_low is null;
+
+update public.tickets t
+set days_low = d.nums[1] * d.per_unit,
+    days_high = coalesce(d.nums[2], d.nums[1]) * d.per_unit
+from (
+    select id,
+        array(select m[1]::integer from regexp_matches(coalesce(time, ''), '(\d+)', 'g') as m) as nums,
+        case
+            when time ilike '%week%' then 5
+            when time ilike '%month%' then 20
+            when time ilike '%day%' then 1
+            else 5
+        end as per_unit
+    from public.tickets
+) d
+where d.id = t.id and t.days_low is null and d.nums[1] is not null;
+
+-- Aggregate from the typed columns instead of parsing raw_cost per row
+create or replace view public.ticket_pipeline_stats as
+select
+    status,
+    target_department,
+    count(*) as ticket_count,
+    coalesce(sum((coalesce(budget_low, 0) + coalesce(budget_high, 0)) / 2.0), 0) as pipeline_value
+from public.tickets
+group by status, target_department;
@@ -0,0 +1,21 @@
+-- Tickets record which hub generated them instead of the kind being inferred
+-- from `complexity`. Values match the generation job kinds:
+-- sales_quote, pm_ticket, design_spec, eng_architecture.
+alter table public.tickets add column if not exists ticket_type text;
+
+update public.tickets
+set ticket_type = case
+    when complexity = 'UI/UX Scoping' then 'design_spec'
+    when complexity = 'Engineering Architecture' then 'eng_architecture'
+    when complexity in ('Green', 'Yellow', 'Red') then 'sales_quote'
+    else 'pm_ticket'
+end
+where ticket_type is null;
+
+-- Department inboxes: target_department + status, newest first
+create index if not exists tickets_department_status_created_idx
+    on public.tickets (target_department, status, created_at desc, id desc);
+
+-- Per-user histories: user_id + ticket_type, newest first
+create index if not exists tickets_user_type_created_idx
+    on public.tickets (user_id, ticket_type, created_at desc, id desc);
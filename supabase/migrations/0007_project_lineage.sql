@@ -0,0 +1,45 @@
+-- Project lineage. Every stage a handoff produces (Sales quote -> PM ticket ->
+-- Design spec -> Engineering architecture) keeps a reference to the ticket it
+-- was generated from and shares that ticket's project_id, so a whole project
+-- is one indexed query instead of re-parsing copied JSON between hubs.
+alter table public.tickets add column if not exists project_id uuid;
+alter table public.tickets add column if not exists parent_ticket_id uuid
+    references public.tickets (id) on delete set null;
+
+-- New rows join their parent's project; a row without a parent starts its own.
+create or replace function public.tickets_assign_project()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.project_id := coalesce(
+        new.project_id,
+        (select project_id from public.tickets where id = new.parent_ticket_id),
+        new.id
+    );
+    return new;
+end;
+$$;
+
+drop trigger if exists tickets_assign_project on public.tickets;
+create trigger tickets_assign_project
+    before insert on public.tickets
+    for each row execute function public.tickets_assign_project();
+
+-- Existing tickets were never linked: each is its own project.
+update public.tickets set project_id = id where project_id is null;
+
+create index if not exists tickets_project_created_idx
+    on public.tickets (project_id, created_at);
+
+-- Every stage of the project `p_ticket_id` belongs to, oldest first.
+create or replace function public.project_bundle(p_ticket_id uuid)
+returns setof public.tickets
+language sql
+stable
+as $$
+    select t.*
+    from public.tickets t
+    where t.project_id = (select project_id from public.tickets where id = p_ticket_id)
+    order by t.created_at, t.id;
+$$;
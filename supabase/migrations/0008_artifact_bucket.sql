@@ -0,0 +1,6 @@
+-- Content-addressed artifact store (artifact_store.py). Objects are named
+-- "<sha256[:2]>/<sha256>" and never change once written, so the bucket is
+-- private and only ever inserted into or read from.
+insert into storage.buckets (id, name, public)
+values ('artifacts', 'artifacts', false)
+on conflict (id) do nothing;
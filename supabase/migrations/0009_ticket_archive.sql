@@ -0,0 +1,17 @@
+-- Cold storage for billed projects (data_layer.archive_billed_tickets). The
+-- generated JSON of a Completed & Billed ticket is gzipped into ticket_archive
+-- and the hot row's full_data is cleared; archived_at marks rows to rehydrate.
+create table if not exists public.ticket_archive (
+    ticket_id uuid primary key references public.tickets (id) on delete cascade,
+    codec text not null default 'gzip',
+    payload text not null, -- base64 of the compressed full_data
+    original_bytes integer,
+    archived_at timestamptz not null default now()
+);
+
+alter table public.tickets add column if not exists archived_at timestamptz;
+
+-- The archival scan: billed tickets that still carry their full_data
+create index if not exists tickets_billed_unarchived_idx
+    on public.tickets (created_at)
+    where status = 'Completed & Billed' and archived_at is null;
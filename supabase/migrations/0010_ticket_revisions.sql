@@ -0,0 +1,106 @@
+-- Versioned ticket history. Edits to a ticket's full_data (God-Mode, the scope
+-- slider, refine chat, the design code factory) are sent as compact JSON
+-- patches (utils.json_diff) instead of the whole document. The patch is
+-- applied here and logged as one revision. Revision 0 and every tenth revision
+-- also keep a full snapshot, so any version is rebuilt from at most nine
+-- patches.
+alter table public.tickets add column if not exists revision integer not null default 0;
+
+create table if not exists public.ticket_revisions (
+    ticket_id uuid not null references public.tickets (id) on delete cascade,
+    revision integer not null,
+    ops jsonb not null default '[]'::jsonb,
+    snapshot jsonb,
+    restored_from integer,
+    created_at timestamptz not null default now(),
+    primary key (ticket_id, revision)
+);
+
+create or replace function public.apply_ticket_revision(
+    p_ticket_id uuid,
+    p_ops jsonb,
+    p_fields jsonb default '{}'::jsonb,
+    p_restored_from integer default null,
+    p_snapshot_every integer default 10
+)
+returns integer
+language plpgsql
+as $$
+declare
+    v_ticket public.tickets%rowtype;
+    v_fields public.tickets%rowtype;
+    v_doc jsonb;
+    v_op jsonb;
+    v_path text[];
+    v_revision integer;
+begin
+    select * into v_ticket from public.tickets where id = p_ticket_id for update;
+    if not found then
+        raise exception 'Ticket % does not exist', p_ticket_id;
+    end if;
+
+    v_doc := coalesce(nullif(v_ticket.full_data, ''), '{}')::jsonb;
+    if v_ticket.revision = 0 then
+        -- First edit: keep the generated original as the base snapshot
+        insert into public.ticket_revisions (ticket_id, revision, snapshot)
+        values (p_ticket_id, 0, v_doc)
+        on conflict do nothing;
+    end if;
+
+    for v_op in select * from jsonb_array_elements(p_ops) loop
+        v_path := array(select jsonb_array_elements_text(v_op -> 1));
+        if cardinality(v_path) = 0 then
+            v_doc := case when v_op ->> 0 = 'set' then v_op -> 2 else 'null'::jsonb end;
+        elsif v_op ->> 0 = 'set' then
+            v_doc := jsonb_set(v_doc, v_path, v_op -> 2, true);
+        else
+            v_doc := v_doc #- v_path;
+        end if;
+    end loop;
+
+    v_revision := v_ticket.revision + 1;
+    insert into public.ticket_revisions (ticket_id, revision, ops, snapshot, restored_from)
+    values (
+        p_ticket_id, v_revision, p_ops,
+        case when v_revision % p_snapshot_every = 0 then v_doc end,
+        p_restored_from
+    );
+
+    -- Headline columns that came with the edit (summary, cost, typed estimate, ...)
+    v_fields := jsonb_populate_record(v_ticket, p_fields);
+    update public.tickets
+    set full_data = v_doc::text,
+        revision = v_revision,
+        summary = v_fields.summary,
+        complexity = v_fields.complexity,
+        time = v_fields.time,
+        cost = v_fields.cost,
+        raw_cost = v_fields.raw_cost,
+        budget_low = v_fields.budget_low,
+        budget_high = v_fields.budget_high,
+        currency = v_fields.currency,
+        days_low = v_fields.days_low,
+        days_high = v_fields.days_high
+    where id = p_ticket_id;
+
+    return v_revision;
+end;
+$$;
+
+-- The rows needed to rebuild `p_revision`: the latest snapshot at or before it
+-- and the patches after that snapshot, in order.
+create or replace function public.ticket_revision_chain(p_ticket_id uuid, p_revision integer)
+returns setof public.ticket_revisions
+language sql
+stable
+as $$
+    select r.*
+    from public.ticket_revisions r
+    where r.ticket_id = p_ticket_id
+      and r.revision <= p_revision
+      and r.revision >= (
+          select max(s.revision) from public.ticket_revisions s
+          where s.ticket_id = p_ticket_id and s.revision <= p_revision and s.snapshot is not null
+      )
+    order by r.revision;
+$$;
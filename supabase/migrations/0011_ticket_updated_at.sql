@@ -0,0 +1,46 @@
+-- Delta sync for the shared department inbox cache (data_layer._poll_inboxes,
+-- read through data_layer.get_inbox). Every change to a ticket stamps
+-- updated_at, and deletions leave a tombstone, so a poll only reads the rows
+-- changed since its watermark.
+alter table public.tickets add column if not exists updated_at timestamptz not null default now();
+update public.tickets set updated_at = created_at where updated_at > created_at;
+
+create or replace function public.tickets_touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists tickets_touch_updated_at on public.tickets;
+create trigger tickets_touch_updated_at
+    before update on public.tickets
+    for each row execute function public.tickets_touch_updated_at();
+
+create index if not exists tickets_updated_at_idx on public.tickets (updated_at);
+
+create table if not exists public.deleted_tickets (
+    id uuid primary key,
+    deleted_at timestamptz not null default now()
+);
+
+create index if not exists deleted_tickets_deleted_at_idx on public.deleted_tickets (deleted_at);
+
+create or replace function public.tickets_record_deletion()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into public.deleted_tickets (id) values (old.id)
+    on conflict (id) do update set deleted_at = excluded.deleted_at;
+    return old;
+end;
+$$;
+
+drop trigger if exists tickets_record_deletion on public.tickets;
+create trigger tickets_record_deletion
+    after delete on public.tickets
+    for each row execute function public.tickets_record_deletion();
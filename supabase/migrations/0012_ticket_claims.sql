@@ -0,0 +1,6 @@
+-- Inbox claims (data_layer.claim_ticket). Accepting a handoff is a conditional
+-- update on status and claimed_by, so only one team member wins a ticket and
+-- starts generating on it. Routing a ticket to the next department clears the
+-- claim for the receiving team.
+alter table public.tickets add column if not exists claimed_by uuid;
+alter table public.tickets add column if not exists claimed_at timestamptz;
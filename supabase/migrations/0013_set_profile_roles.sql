@@ -0,0 +1,16 @@
+-- Bulk role changes from admin Team Management (data_layer.set_profile_roles).
+-- One call updates every changed profile and touches only the role column,
+-- so settings a user saved in the meantime are not overwritten.
+create or replace function public.set_profile_roles(p_changes jsonb)
+returns integer
+language sql
+as $$
+    with updated as (
+        update public.profiles p
+        set role = c.role
+        from jsonb_to_recordset(p_changes) as c(id uuid, role text)
+        where p.id = c.id and p.role is distinct from c.role
+        returning p.id
+    )
+    select count(*)::integer from updated;
+$$;
@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+import ai_engine
+from ai_engine import request_key, get_remote_file, forget_remote_file, TokenBucket, FairScheduler, INTERACTIVE, BACKGROUND
+
+class TestRequestKey(unittest.TestCase):
+
+    def test_request_key_is_stable(self):
+        # Same session and inputs must always land on the same job
+        self.assertEqual(request_key("u1", "pm_ticket", "prompt", b"audio"), request_key("u1", "pm_ticket", "prompt", b"audio"))
+        self.assertNotEqual(request_key("u1", "pm_ticket", "prompt"), request_key("u2", "pm_ticket", "prompt"))
+
+    def test_keyed_schedule_shares_the_call_in_flight(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_call():
+            calls.append(1)
+            release.wait(5)
+            return "ok"
+
+        key = request_key("u1", "freelancer_feasibility", "idea")
+        first = ai_engine.schedule("u1", slow_call, key=key)
+        second = ai_engine.schedule("u1", slow_call, key=key)
+        release.set()
+        self.assertIs(first, second)
+        self.assertEqual(first.result(5), "ok")
+        # A finished call is still handed out within the grace window
+        self.assertIs(ai_engine.schedule("u1", slow_call, key=key), first)
+        self.assertEqual(len(calls), 1)
+
+    def test_keyed_schedule_retries_after_failure(self):
+        def broken_call():
+            raise RuntimeError("quota")
+
+        key = request_key("u1", "pm_refine", "prompt")
+        failed = ai_engine.schedule("u1", broken_call, key=key)
+        with self.assertRaises(RuntimeError):
+            failed.result(5)
+        retry = ai_engine.schedule("u1", lambda: "ok", key=key)
+        self.assertIsNot(retry, failed)
+        self.assertEqual(retry.result(5), "ok")
+
+class TestScheduler(unittest.TestCase):
+
+    def test_token_bucket_refills_at_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=1.0, capacity=2, clock=lambda: now[0])
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertAlmostEqual(bucket.try_acquire(), 1.0)
+        now[0] = 1.0
+        self.assertEqual(bucket.try_acquire(), 0.0)
+
+    def test_round_robin_and_priority_order(self):
+        # An empty bucket keeps every job queued so we can inspect the line
+        scheduler = FairScheduler(TokenBucket(rate=1e-9, capacity=0), max_concurrency=1)
+        a1 = scheduler.submit("alice", lambda: None)
+        a2 = scheduler.submit("alice", lambda: None)
+        b1 = scheduler.submit("bob", lambda: None)
+        background = scheduler.submit("carol", lambda: None, priority=BACKGROUND)
+        late_interactive = scheduler.submit("dave", lambda: None, priority=INTERACTIVE)
+
+        # Bob and Dave are not stuck behind Alice's second job; background waits for everyone
+        self.assertEqual(scheduler.position(a1), 1)
+        self.assertEqual(scheduler.position(b1), 2)
+        self.assertEqual(scheduler.position(late_interactive), 3)
+        self.assertEqual(scheduler.position(a2), 4)
+        self.assertEqual(scheduler.position(background), 5)
+
+
+class _FakeFiles:
+    def __init__(self):
+        self.uploads = []
+
+    def upload(self, file, config):
+        self.uploads.append((file.read(), config))
+        return "files/%d" % len(self.uploads)
+
+class _FakeClient:
+    def __init__(self):
+        self.files = _FakeFiles()
+
+class TestFileRegistry(unittest.TestCase):
+
+    def test_same_bytes_are_uploaded_once(self):
+        client = _FakeClient()
+        recording = b"client-call-recording-bytes"
+        first = get_remote_file(client, recording, "call.mp3")
+        second = get_remote_file(client, recording, "renamed_by_pm.mp3")
+        self.assertEqual(first, second)
+        self.assertEqual(len(client.files.uploads), 1)
+        self.assertEqual(client.files.uploads[0][1]["mime_type"], "audio/mpeg")
+
+        # A forgotten handle is uploaded again on the next call
+        forget_remote_file(recording)
+        get_remote_file(client, recording, "call.mp3")
+        self.assertEqual(len(client.files.uploads), 2)
+
+    def test_expired_handles_and_their_locks_are_evicted_on_a_miss(self):
+        ai_engine._FILE_REGISTRY["stale"] = ("files/old", time.time() - 1)
+        ai_engine._FILE_LOCKS["stale"] = threading.Lock()
+        get_remote_file(_FakeClient(), b"a-different-recording", "call.mp3")
+        self.assertNotIn("stale", ai_engine._FILE_REGISTRY)
+        self.assertNotIn("stale", ai_engine._FILE_LOCKS)
+
+if __name__ == '__main__':
+    unittest.main()
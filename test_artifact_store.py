@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import artifact_store
+from artifact_store import externalize, get_artifact, resolve
+
+class _FakeBucket:
+    def __init__(self, objects, log):
+        self.objects = objects
+        self.log = log
+
+    def upload(self, name, content, options):
+        self.log.append(("upload", name))
+        if name in self.objects:
+            raise Exception("The resource already exists (Duplicate)")
+        self.objects[name] = content
+
+    def download(self, name):
+        self.log.append(("download", name))
+        return self.objects[name]
+
+class _FakeSupabase:
+    def __init__(self):
+        self.objects = {}
+        self.log = []
+        self.storage = self
+
+    def from_(self, bucket):
+        return _FakeBucket(self.objects, self.log)
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_dir = artifact_store.ARTIFACT_DIR
+        artifact_store.ARTIFACT_DIR = self.tmp_dir.name
+
+    def tearDown(self):
+        artifact_store.ARTIFACT_DIR = self.original_dir
+        self.tmp_dir.cleanup()
+
+    def test_large_code_is_stored_once_and_referenced_by_hash(self):
+        supabase = _FakeSupabase()
+        code = {"live_sandbox_html": "<div>" * 5000, "generated_components": [{"component_name": "Nav", "code": "export default 1"}]}
+        first = externalize(supabase, code)
+        second = externalize(supabase, dict(code))
+        self.assertEqual(set(first), {"artifact_ref"})
+        self.assertEqual(first, second)
+        self.assertEqual([entry[0] for entry in supabase.log], ["upload"])
+        self.assertEqual(resolve(supabase, first), code)
+
+    def test_failed_upload_is_retried_on_the_next_store(self):
+        supabase = _FakeSupabase()
+        code = {"live_sandbox_html": "x" * 10000}
+        with mock.patch.object(_FakeBucket, "upload", side_effect=Exception("Storage unavailable")):
+            with self.assertRaises(Exception):
+                externalize(supabase, code)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+        ref = externalize(supabase, code)
+        self.assertIn(f"{ref['artifact_ref'][:2]}/{ref['artifact_ref']}", supabase.objects)
+
+    def test_small_and_legacy_values_stay_inline(self):
+        supabase = _FakeSupabase()
+        small = {"generated_components": []}
+        self.assertIs(externalize(supabase, small), small)
+        self.assertIs(resolve(supabase, small), small)
+        self.assertEqual(supabase.log, [])
+
+    def test_missing_local_copy_is_pulled_from_the_bucket(self):
+        supabase = _FakeSupabase()
+        ref = externalize(supabase, {"live_sandbox_html": "x" * 10000})
+        digest = ref["artifact_ref"]
+        os.remove(os.path.join(self.tmp_dir.name, digest[:2], digest))
+        self.assertEqual(resolve(supabase, ref), {"live_sandbox_html": "x" * 10000})
+        # Cached locally again after the first download
+        get_artifact(supabase, digest)
+        self.assertEqual([entry[0] for entry in supabase.log], ["upload", "download"])
+
+if __name__ == "__main__":
+    unittest.main()
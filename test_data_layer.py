@@ -0,0 +1,338 @@
+import json
+import os
+import re
+import sqlite3
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+import data_layer
+import pandas as pd
+from admin_dashboard import changed_roles, extract_average_cost
+from data_layer import insert_ticket, list_tickets, get_ticket_full_data, ticket_cursor, update_ticket, summarize_pipeline, finalize_project, get_ledger_totals, get_project_bundle, get_inherited_frontend, archive_billed_tickets, save_ticket_data, get_ticket_version, undo_target, get_inbox, claim_ticket, claim_badge, set_profile_roles, TICKET_LIST_COLUMNS
+
+class _FakeQuery:
+    """Records the PostgREST builder calls a helper makes and returns canned rows."""
+
+    def __init__(self, log, rows):
+        self.log = log
+        self.rows = rows
+
+    @property
+    def not_(self):
+        self.log.append(("not_", ()))
+        return self
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.log.append((name, args))
+            return self
+        return call
+
+    def execute(self):
+        self.log.append(("execute", ()))
+        return type("Response", (), {"data": self.rows})()
+
+class _FakeSupabase:
+    """`rows` is returned by every query, or looked up per table or function name when it is a dict."""
+
+    def __init__(self, rows):
+        self.log = []
+        self.rows = rows
+
+    def table(self, name):
+        self.log.append(("table", (name,)))
+        return _FakeQuery(self.log, self.rows.get(name, []) if isinstance(self.rows, dict) else self.rows)
+
+    def rpc(self, name, params):
+        self.log.append(("rpc", (name, params)))
+        return _FakeQuery(self.log, self.rows.get(name, []) if isinstance(self.rows, dict) else [])
+
+class TestDataLayer(unittest.TestCase):
+
+    def setUp(self):
+        data_layer.invalidate("tickets")
+        data_layer.invalidate("project_ledger")
+
+    def test_lists_never_select_full_data(self):
+        supabase = _FakeSupabase([{"id": "t1", "summary": "Food delivery app"}])
+        rows = list_tickets(supabase, user_id="u1", ticket_type="pm_ticket")
+
+        self.assertEqual(rows, [{"id": "t1", "summary": "Food delivery app"}])
+        self.assertIn(("select", (TICKET_LIST_COLUMNS,)), supabase.log)
+        self.assertNotIn("full_data", TICKET_LIST_COLUMNS)
+        self.assertIn(("eq", ("user_id", "u1")), supabase.log)
+        self.assertIn(("eq", ("ticket_type", "pm_ticket")), supabase.log)
+
+    def test_full_data_is_fetched_per_ticket(self):
+        supabase = _FakeSupabase([{"full_data": '{"summary": "Food delivery app"}'}])
+        self.assertEqual(get_ticket_full_data(supabase, "t1"), '{"summary": "Food delivery app"}')
+        self.assertIn(("select", ("full_data, archived_at",)), supabase.log)
+        self.assertIn(("eq", ("id", "t1")), supabase.log)
+
+    def test_list_expanders_fetch_full_data_only_when_open(self):
+        row = {"id": "t1", "summary": "Food delivery app"}
+        for is_open in (False, True):
+            supabase = _FakeSupabase([{"full_data": '{"summary": "Food delivery app"}', "archived_at": None}])
+            expander = mock.MagicMock(open=is_open)
+            expander.__enter__.return_value = expander
+            with mock.patch.object(data_layer.st, "expander", return_value=expander):
+                with data_layer.lazy_ticket_expander(supabase, "Ticket", row, f"hist_{row['id']}_{is_open}") as item:
+                    loaded = item
+            if is_open:
+                self.assertEqual(loaded, dict(row, full_data='{"summary": "Food delivery app"}'))
+            else:
+                self.assertIsNone(loaded)
+                self.assertEqual(supabase.log, [])
+
+    def test_next_page_starts_after_the_cursor(self):
+        last_row = {"id": "t9", "created_at": "2025-01-02T10:00:00+00:00"}
+        supabase = _FakeSupabase([])
+        list_tickets(supabase, user_id="u1", limit=21, before=ticket_cursor(last_row))
+
+        self.assertIn(("or_", ('created_at.lt."2025-01-02T10:00:00+00:00",and(created_at.eq."2025-01-02T10:00:00+00:00",id.lt."t9")',)), supabase.log)
+        # Same-timestamp rows are ordered by id so the cursor never skips or repeats one
+        self.assertIn(("order", ("created_at",)), supabase.log)
+        self.assertIn(("order", ("id",)), supabase.log)
+        self.assertIn(("limit", (21,)), supabase.log)
+
+    def test_reruns_are_served_from_cache_until_a_write(self):
+        supabase = _FakeSupabase([{"id": "t1", "summary": "Food delivery app", "status": "Draft"}])
+        list_tickets(supabase, user_id="u1")
+        list_tickets(supabase, user_id="u1")
+        self.assertEqual(supabase.log.count(("execute", ())), 1)
+
+        # A different user is a different query shape
+        list_tickets(supabase, user_id="u2")
+        self.assertEqual(supabase.log.count(("execute", ())), 2)
+
+        update_ticket(supabase, "t1", {"status": "Awaiting PM Scoping"})
+        list_tickets(supabase, user_id="u1")
+        self.assertEqual(supabase.log.count(("execute", ())), 4)
+
+    def test_insert_is_visible_to_reads_that_raced_it(self):
+        supabase = _FakeSupabase([{"id": "t1", "summary": "Food delivery app", "status": "Draft"}])
+        original_table = supabase.table
+
+        def table(name):
+            query = original_table(name)
+            original_execute = query.execute
+
+            def execute():
+                if any(entry[0] == "insert" for entry in supabase.log):
+                    # Another session lists tickets while the insert is in flight
+                    supabase.table = original_table
+                    list_tickets(supabase, user_id="u1")
+                return original_execute()
+            query.execute = execute
+            return query
+        supabase.table = table
+
+        insert_ticket(supabase, {"summary": "Food delivery app"})
+        executes = supabase.log.count(("execute", ()))
+        list_tickets(supabase, user_id="u1")
+        self.assertEqual(supabase.log.count(("execute", ())), executes + 1)
+
+    def test_pipeline_view_matches_the_old_python_aggregation(self):
+        # SQLite stand-in for Postgres: the latest view SQL from the migrations,
+        # over rows whose typed budget columns were filled by the write path
+        migration = open(os.path.join(os.path.dirname(__file__), "supabase", "migrations", "0005_typed_budget_timeline.sql")).read()
+        view_sql = re.search(r"create or replace view .*?;", migration, re.S).group(0)
+        conn = sqlite3.connect(":memory:")
+        conn.row_factory = sqlite3.Row
+        conn.execute("CREATE TABLE tickets (id TEXT, status TEXT, target_department TEXT, raw_cost TEXT, budget_low REAL, budget_high REAL)")
+        tickets = [
+            ("1", "Awaiting PM Scoping", "PM", "15000-20000"),
+            ("2", "Awaiting PM Scoping", "PM", "$8,000"),
+            ("3", "Awaiting UI/UX Scoping", "Design", "0-0"),
+            ("4", "Ready for Dev", "None", "30000-40000"),
+            ("5", "Completed & Billed", "None", "50000-60000"),
+            ("6", "Draft", "None", "N/A (Design Phase)"),
+        ]
+        for ticket_id, status, department, raw_cost in tickets:
+            row = data_layer._with_typed_estimate({"raw_cost": raw_cost})
+            conn.execute("INSERT INTO tickets VALUES (?, ?, ?, ?, ?, ?)", (ticket_id, status, department, raw_cost, row["budget_low"], row["budget_high"]))
+        conn.execute(view_sql.replace("create or replace view", "create view").replace("public.", ""))
+
+        summary = summarize_pipeline([dict(row) for row in conn.execute("SELECT * FROM ticket_pipeline_stats")])
+        self.assertEqual(summary["total_projects"], 6)
+        self.assertEqual(summary["pipeline_value"], sum(extract_average_cost(t[3]) for t in tickets if t[1] != "Completed & Billed"))
+        self.assertEqual(summary["queues"], {"PM": 2, "Design": 1, "Engineering": 0})
+        self.assertEqual(summary["ready_for_dev"], 1)
+
+    def test_writes_fill_typed_budget_and_timeline_columns(self):
+        supabase = _FakeSupabase([{"id": "t1"}])
+        update_ticket(supabase, "t1", {"raw_cost": "15,000-20,000", "time": "4-6 Weeks"})
+        fields = next(args[0] for name, args in supabase.log if name == "update")
+        self.assertEqual((fields["budget_low"], fields["budget_high"], fields["currency"]), (15000, 20000, "USD"))
+        self.assertEqual((fields["days_low"], fields["days_high"]), (20, 30))
+
+    def test_close_out_goes_through_the_ledger_rpc(self):
+        supabase = _FakeSupabase([{"id": 1, "project_count": 3, "total_estimate": 90000, "total_actual": 85000}])
+        self.assertEqual(get_ledger_totals(supabase)["project_count"], 3)
+
+        finalize_project(supabase, "t1", 21000, "6 Weeks")
+        self.assertIn(("rpc", ("finalize_project", {"p_ticket_id": "t1", "p_actual": 21000, "p_actual_time": "6 Weeks"})), supabase.log)
+        # The totals are re-read after a close-out instead of served stale
+        get_ledger_totals(supabase)
+        self.assertEqual(supabase.log.count(("table", ("ledger_totals",))), 2)
+
+    def test_archived_full_data_is_compressed_and_rehydrated(self):
+        full_data = '{"summary": "CRM rebuild", "mvp_features": ["Login"]}' * 50
+        supabase = _FakeSupabase({"tickets": [{"id": "t1", "full_data": full_data}]})
+        self.assertEqual(archive_billed_tickets(supabase), 1)
+        archived = next(args[0][0] for name, args in supabase.log if name == "upsert")
+        self.assertLess(len(archived["payload"]), len(full_data))
+        self.assertIn(("in_", ("id", ["t1"])), supabase.log)
+        cleared = next(args[0] for name, args in supabase.log if name == "update")
+        self.assertIsNone(cleared["full_data"])
+        # Rows with no full_data are never selected, so they cannot stall the batches
+        is_filters = [entry for entry in supabase.log if entry[0] in ("not_", "is_")]
+        self.assertEqual(is_filters, [("is_", ("archived_at", "null")), ("not_", ()), ("is_", ("full_data", "null"))])
+
+        # A short batch ends the run
+        supabase = _FakeSupabase({"tickets": [{"id": "t1", "full_data": full_data}]})
+        self.assertEqual(archive_billed_tickets(supabase, batch_size=2), 1)
+        self.assertEqual(supabase.log.count(("table", ("ticket_archive",))), 1)
+
+        supabase = _FakeSupabase({"tickets": [{"full_data": None, "archived_at": "2026-01-01T00:00:00+00:00"}], "ticket_archive": [archived]})
+        self.assertEqual(get_ticket_full_data(supabase, "t1"), full_data)
+
+    def test_edits_ship_only_the_changed_fields(self):
+        supabase = _FakeSupabase({"apply_ticket_revision": 4})
+        old = {"summary": "CRM", "mvp_features": ["Login", "Reports"], "risks": {"api": "rate limits"}}
+        new = dict(old, risks={"api": "rate limits", "gdpr": "EU data"})
+        self.assertEqual(save_ticket_data(supabase, "t1", old, new, {"time": "2 Weeks"}), 4)
+        params = next(args[1] for name, args in supabase.log if name == "rpc")
+        self.assertEqual(params["p_ops"], [["set", ["risks", "gdpr"], "EU data"]])
+        self.assertEqual((params["p_fields"]["days_low"], params["p_fields"]["days_high"]), (10, 10))
+
+    def test_versions_rebuild_from_the_nearest_snapshot(self):
+        chain = [
+            {"revision": 10, "snapshot": {"summary": "v10", "features": ["A"]}, "ops": []},
+            {"revision": 11, "snapshot": None, "ops": [["set", ["features"], ["A", "B"]]]},
+            {"revision": 12, "snapshot": None, "ops": [["set", ["summary"], "v12"], ["del", ["features"]]]},
+        ]
+        supabase = _FakeSupabase({"ticket_revision_chain": chain})
+        self.assertEqual(get_ticket_version(supabase, "t1", 12), {"summary": "v12"})
+
+    def test_undo_steps_back_past_earlier_undos(self):
+        self.assertIsNone(undo_target([]))
+        self.assertIsNone(undo_target([{"revision": 0, "restored_from": None}]))
+        self.assertEqual(undo_target([{"revision": 5, "restored_from": None}]), 4)
+        # Revision 6 restored version 4, so the next undo goes to 3
+        self.assertEqual(undo_target([{"revision": 6, "restored_from": 4}]), 3)
+
+    def test_shared_inbox_is_kept_current_by_one_poll(self):
+        data_layer._INBOXES.clear()
+        data_layer._INBOX_SYNC.update(watermark="2026-10-01T09:00:00+00:00", loaded_at=time.monotonic())
+        waiting = {"id": "a", "summary": "CRM", "status": "Awaiting PM Scoping", "target_department": "PM", "created_at": "2026-10-01T09:00:00+00:00", "updated_at": "2026-10-01T09:00:00+00:00"}
+        first_session = _FakeSupabase({"tickets": [waiting]})
+        self.assertEqual(get_inbox(first_session, "PM", "Awaiting PM Scoping"), [waiting])
+        # A second session reads the shared cache without querying
+        second_session = _FakeSupabase({"tickets": [waiting]})
+        self.assertEqual(get_inbox(second_session, "PM", "Awaiting PM Scoping"), [waiting])
+        self.assertEqual(second_session.log, [])
+
+        accepted = dict(waiting, status="Accepted by PM", updated_at="2026-10-02T10:00:00+00:00")
+        routed = dict(waiting, id="b", created_at="2026-10-02T09:59:00+00:00", updated_at="2026-10-02T10:00:01.12345+00:00")
+        subscriber = _FakeSupabase({"tickets": [accepted, routed], "deleted_tickets": []})
+        data_layer._INBOX_SYNC["supabase"] = subscriber
+        data_layer._poll_inboxes()
+        # The poll asked for changes since the watermark (minus the overlap), not for the whole inbox
+        self.assertIn(("gte", ("updated_at", "2026-10-01T08:59:55+00:00")), subscriber.log)
+        self.assertNotIn(("eq", ("status", "Awaiting PM Scoping")), subscriber.log)
+        self.assertEqual(get_inbox(second_session, "PM", "Awaiting PM Scoping"), [routed])
+        # The watermark moves on even when Postgres trims the fraction to five digits
+        self.assertEqual(data_layer._INBOX_SYNC["watermark"], "2026-10-02T10:00:01.12345+00:00")
+
+        # Local writes are published straight away
+        data_layer.delete_ticket(_FakeSupabase([]), "b")
+        self.assertEqual(get_inbox(second_session, "PM", "Awaiting PM Scoping"), [])
+
+    def test_failing_status_hook_is_logged_not_raised(self):
+        def broken_hook(row):
+            raise RuntimeError("speculation queue is down")
+
+        data_layer.on_status_change("Awaiting QA", broken_hook)
+        try:
+            routed = {"id": "t1", "status": "Awaiting QA", "target_department": "QA"}
+            with self.assertLogs(level="ERROR") as logs:
+                self.assertEqual(data_layer.route_ticket(_FakeSupabase([routed]), "t1", "Awaiting QA", "QA"), routed)
+            self.assertIn("speculation queue is down", logs.output[0])
+        finally:
+            data_layer._STATUS_HOOKS.pop("Awaiting QA")
+
+    def test_failing_inbox_poll_is_logged_once_per_interval(self):
+        data_layer._INBOX_SYNC["error_logged_at"] = float("-inf")
+        with mock.patch.object(data_layer, "_poll_inboxes", side_effect=RuntimeError('relation "deleted_tickets" does not exist')):
+            with self.assertLogs(level="ERROR") as logs:
+                data_layer._poll_safely()
+                data_layer._poll_safely()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("deleted_tickets", logs.output[0])
+
+    def test_claim_is_one_conditional_update(self):
+        claimed = {"id": "t1", "status": "Accepted by PM", "target_department": "PM", "claimed_by": "pm-1"}
+        supabase = _FakeSupabase({"tickets": [claimed]})
+        self.assertEqual(claim_ticket(supabase, "t1", "Awaiting PM Scoping", "Accepted by PM", "pm-1"), claimed)
+        self.assertIn(("eq", ("status", "Awaiting PM Scoping")), supabase.log)
+        self.assertIn(("is_", ("claimed_by", "null")), supabase.log)
+        self.assertEqual([entry[0] for entry in supabase.log].count("execute"), 1)
+
+        # The losing claim matches no row and starts nothing
+        self.assertIsNone(claim_ticket(_FakeSupabase({"tickets": []}), "t1", "Awaiting PM Scoping", "Accepted by PM", "pm-2"))
+
+    def test_claimed_ticket_stays_in_the_inbox_with_a_badge(self):
+        data_layer._INBOXES.clear()
+        waiting = {"id": "a", "summary": "Food app", "status": "Awaiting PM Scoping", "target_department": "PM", "created_at": "2026-10-01T09:00:00+00:00", "claimed_by": None, "claimed_at": None}
+        get_inbox(_FakeSupabase({"tickets": [waiting]}), "PM", "Awaiting PM Scoping")
+
+        # PostgREST trims trailing zeros from the fraction, which Python 3.10 cannot parse natively
+        just_now = datetime.now(timezone.utc).replace(microsecond=123450).isoformat().replace("123450", "12345")
+        claimed = dict(waiting, status="Accepted by PM", claimed_by="pm-1", claimed_at=just_now)
+        claim_ticket(_FakeSupabase({"tickets": [claimed]}), "a", "Awaiting PM Scoping", "Accepted by PM", "pm-1")
+        self.assertEqual(get_inbox(_FakeSupabase([]), "PM", "Awaiting PM Scoping"), [claimed])
+        self.assertEqual(claim_badge(claimed, "pm-1"), "🔒 Claimed by you just now")
+        self.assertEqual(claim_badge(claimed, "pm-2"), "🔒 Claimed by a teammate just now")
+
+        # Once the claim is old enough it drops out of the inbox
+        long_ago = (datetime.now(timezone.utc) - timedelta(seconds=data_layer.INBOX_CLAIMED_SECONDS + 1)).isoformat()
+        data_layer._INBOXES[("PM", "Awaiting PM Scoping")]["rows"]["a"]["claimed_at"] = long_ago
+        self.assertEqual(get_inbox(_FakeSupabase([]), "PM", "Awaiting PM Scoping"), [])
+
+    def test_role_changes_are_saved_in_one_call(self):
+        original = pd.DataFrame([{"id": f"u{i}", "role": "pm" if i % 2 else None} for i in range(300)])
+        edited = original.copy()
+        edited.loc[[3, 150], "role"] = ["design", "admin"]
+        changes = changed_roles(original, edited)
+        self.assertEqual(changes, [{"id": "u3", "role": "design"}, {"id": "u150", "role": "admin"}])
+
+        supabase = _FakeSupabase({"set_profile_roles": 2})
+        self.assertEqual(set_profile_roles(supabase, changes), 2)
+        self.assertEqual([entry for entry in supabase.log if entry[0] in ("rpc", "table")], [("rpc", ("set_profile_roles", {"p_changes": changes}))])
+        self.assertEqual(set_profile_roles(supabase, []), 0)
+
+    def test_project_bundle_is_a_single_query(self):
+        supabase = _FakeSupabase([])
+        get_project_bundle(supabase, "eng-1")
+        get_project_bundle(supabase, "eng-1")
+        self.assertEqual([entry for entry in supabase.log if entry[0] in ("rpc", "table")], [("rpc", ("project_bundle", {"p_ticket_id": "eng-1"}))])
+
+    def test_inherited_frontend_is_resolved_once_per_version(self):
+        code = {"generated_components": [{"component_name": "Map"}]}
+        design = {"ticket_type": "design_spec", "full_data": json.dumps({"generated_frontend_code": {"artifact_ref": "abc"}})}
+        supabase = _FakeSupabase({"project_bundle": [{"ticket_type": "pm_ticket", "full_data": "{}"}, design]})
+        with mock.patch.object(data_layer, "resolve", return_value=code) as resolve:
+            # Every rerun of the open architecture asks again; only the first downloads the artifact
+            self.assertEqual(get_inherited_frontend(supabase, "eng-1"), code)
+            self.assertEqual(get_inherited_frontend(supabase, "eng-1"), code)
+            self.assertEqual(resolve.call_count, 1)
+            # A ticket write (e.g. Design regenerating the code) makes it load again
+            data_layer.invalidate("tickets")
+            get_inherited_frontend(supabase, "eng-1")
+            self.assertEqual(resolve.call_count, 2)
+        self.assertIsNone(get_inherited_frontend(supabase, None))
+
+if __name__ == "__main__":
+    unittest.main()
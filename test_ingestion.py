@@ -0,0 +1,209 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+import wave
+from unittest import mock
+import ingestion
+from reportlab.pdfgen import canvas
+from ingestion import chunk_text, chunk_wav, merge_extractions, prepare_generation_input, preprocess_audio, spool_upload, UploadRejected
+
+class _Uploaded(io.BytesIO):
+    """Stand-in for Streamlit's UploadedFile, which is a BytesIO with a name and size."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+class TestIngestion(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_dir = ingestion.UPLOAD_DIR
+        ingestion.UPLOAD_DIR = self.tmp_dir.name
+
+    def tearDown(self):
+        ingestion.UPLOAD_DIR = self.original_dir
+        self.tmp_dir.cleanup()
+
+    def test_chunk_text_overlaps_and_covers_everything(self):
+        text = " ".join(f"Sentence number {i} about the client app." for i in range(400))
+        chunks = chunk_text(text, chunk_chars=1000, overlap_chars=100)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(c) <= 1000 for c in chunks))
+        self.assertIn("Sentence number 0 ", chunks[0])
+        self.assertIn("Sentence number 399 ", chunks[-1])
+        # Neighbouring chunks share their boundary text
+        self.assertIn(chunks[0][-50:], chunks[1])
+
+    def test_short_input_is_not_split(self):
+        self.assertEqual(prepare_generation_input(None, "key", "gemini-2.5-flash", "u1", "Build a food delivery app."), ("Build a food delivery app.", None))
+
+    def test_long_brief_is_condensed_but_fixed_instructions_are_kept(self):
+        guidelines = "CRITICAL OVERRIDE - COMPANY GUIDELINES:\nUse PostgreSQL only.\n\nTarget Deployment: AWS (Enterprise)"
+        brief = "PROJECT REQUIREMENTS:\n" + "The client needs a driver app with GPS tracking. " * (ingestion.CHUNK_CHARS // 40)
+        with mock.patch.object(ingestion, "map_reduce_requirements", return_value="CONSOLIDATED DISCOVERY BRIEF") as map_reduce:
+            text, upload = prepare_generation_input(None, "key", "gemini-2.5-flash", "u1", guidelines, brief=brief)
+        self.assertEqual(text, f"{guidelines}\n\nPROJECT REQUIREMENTS:\nCONSOLIDATED DISCOVERY BRIEF")
+        self.assertIsNone(upload)
+        # Only the brief was split and condensed
+        self.assertNotIn("COMPANY GUIDELINES", "".join(map_reduce.call_args[0][3]))
+
+    def test_brief_that_fits_the_model_is_sent_whole(self):
+        # A long call transcript still fits in one request; no map-reduce round trip
+        brief = "PROJECT REQUIREMENTS:\n" + "The client needs a driver app with GPS tracking. " * 2000
+        with mock.patch.object(ingestion, "map_reduce_requirements") as map_reduce:
+            text, upload = prepare_generation_input(None, "key", "gemini-2.5-flash", "u1", "Guidelines", brief=brief)
+        map_reduce.assert_not_called()
+        self.assertEqual(text, f"Guidelines\n\n{brief}")
+
+    def test_chunk_wav_splits_long_recordings(self):
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(100)
+            wav.writeframes(b"\x00\x00" * 100 * 25)
+        clips = chunk_wav(buf.getvalue(), chunk_seconds=10, overlap_seconds=2)
+        self.assertEqual(len(clips), 3)
+        with wave.open(io.BytesIO(clips[0]), "rb") as first:
+            self.assertEqual(first.getnframes(), 1000)
+
+    def test_any_audio_format_is_cut_into_overlapping_clips(self):
+        recording = spool_upload(_Uploaded(b"fake-opus-bytes", "call.ogg"))
+
+        def fake_ffmpeg(cmd, **kwargs):
+            with open(cmd[-1], "wb") as f:
+                f.write(f"clip from {cmd[cmd.index('-ss') + 1]}s".encode("utf-8"))
+
+        with mock.patch.object(ingestion.shutil, "which", return_value="/usr/bin/ffmpeg"):
+            with mock.patch.object(ingestion, "_audio_duration", return_value=1500.0):
+                with mock.patch.object(ingestion.subprocess, "run", side_effect=fake_ffmpeg) as run:
+                    clips = ingestion.split_audio(recording, chunk_seconds=600, overlap_seconds=15)
+
+        self.assertEqual([call.args[0][call.args[0].index("-ss") + 1] for call in run.call_args_list], ["0", "585", "1170"])
+        self.assertEqual([clip["file_name"] for clip in clips], ["call_part1.ogg", "call_part2.ogg", "call_part3.ogg"])
+        self.assertIn("-c", run.call_args[0][0])
+
+    def test_overlapping_transcripts_are_joined_without_repeats(self):
+        transcript = ingestion.merge_transcripts([
+            "Speaker 1: We need GPS tracking.\nSpeaker 2: And Stripe payments.",
+            "and Stripe payments.\nSpeaker 1: Launch in March.",
+        ])
+        self.assertEqual(transcript, "Speaker 1: We need GPS tracking.\nSpeaker 2: And Stripe payments.\nSpeaker 1: Launch in March.")
+
+    def test_merge_deduplicates_overlapping_segments(self):
+        brief = merge_extractions([
+            {"requirements": ["GPS tracking for drivers", "Stripe payments"], "budget_signals": ["$15k cap"]},
+            {"requirements": ["gps tracking  for drivers", "Push notifications"]},
+        ])
+        self.assertEqual(brief.count("GPS tracking"), 1)
+        self.assertIn("- Push notifications", brief)
+        self.assertIn("Budget Signals:\n- $15k cap", brief)
+
+    def test_recording_is_transcribed_once_and_sent_as_text(self):
+        recording = spool_upload(_Uploaded(b"fake-mp3-bytes-for-transcript-test", "call.mp3"))
+        with mock.patch.object(ingestion, "_transcribe", return_value="Speaker 1: We need GPS tracking.") as transcribe:
+            first = prepare_generation_input(None, "key", "gemini-2.5-pro", "u1", "Analyze this call.", recording)
+            second = prepare_generation_input(None, "key", "gemini-2.5-flash", "u2", "Design for this call.", recording)
+
+        self.assertEqual(transcribe.call_count, 1)
+        self.assertEqual(first, ("Analyze this call.\n\nMEETING TRANSCRIPT (call.mp3):\nSpeaker 1: We need GPS tracking.", None))
+        self.assertIn("Design for this call.", second[0])
+
+    def test_audio_is_optimized_on_the_worker_only_before_first_transcription(self):
+        recording = spool_upload(_Uploaded(b"fake-wav-bytes-for-preprocess-test", "standup.wav"))
+        processed = dict(recording, file_name="standup.ogg", sha256="processed")
+        savings = {"original_bytes": 10 * 1024 * 1024, "processed_bytes": 1024 * 1024, "upload_seconds_saved": 7.5}
+        status = []
+        with mock.patch.object(ingestion, "preprocess_audio", return_value=(processed, savings)) as preprocess:
+            with mock.patch.object(ingestion, "_transcribe", return_value="Speaker 1: Ship it.") as transcribe:
+                ingestion.transcribe_once(None, "key", "u1", recording, on_status=status.append)
+                ingestion.transcribe_once(None, "key", "u2", recording, on_status=status.append)
+
+        self.assertEqual(preprocess.call_count, 1)
+        self.assertIs(transcribe.call_args[0][2], processed)
+        self.assertEqual(status[0], "Optimizing standup.wav for transcription...")
+        self.assertIn("90% smaller", status[1])
+
+    def test_transcript_cache_and_locks_are_bounded(self):
+        with mock.patch.object(ingestion, "TRANSCRIPT_CACHE_SIZE", 2):
+            with mock.patch.object(ingestion, "_transcribe", return_value="Speaker 1: Hello."):
+                for i in range(3):
+                    recording = spool_upload(_Uploaded(f"fake-recording-{i}".encode("utf-8"), f"call{i}.wav"))
+                    ingestion.transcribe_once(None, "key", "u1", recording)
+        self.assertEqual(len(ingestion._TRANSCRIPTS), 2)
+        self.assertNotIn(recording["sha256"], ingestion._TRANSCRIPT_LOCKS)
+
+    def test_preprocess_downmixes_resamples_and_trims_silence(self):
+        rate = 48000
+        tone = [int(8000 * ((i // 24) % 2 * 2 - 1)) for i in range(rate)]  # 1s of square wave
+        silence = [0] * (rate * 5)
+        frames = bytearray()
+        for sample in tone + silence + tone:
+            frames += sample.to_bytes(2, "little", signed=True) * 2  # identical L/R channels
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(bytes(frames))
+
+        with mock.patch.object(ingestion.shutil, "which", return_value=None):
+            processed, savings = preprocess_audio(spool_upload(_Uploaded(buf.getvalue(), "call.wav")))
+
+        self.assertEqual(processed["file_name"], "call.wav")
+        with wave.open(processed["path"], "rb") as out:
+            self.assertEqual(out.getnchannels(), 1)
+            self.assertEqual(out.getframerate(), 16000)
+            # 2s of speech plus a 0.3s pause instead of the original 5s
+            self.assertAlmostEqual(out.getnframes() / 16000, 2.3, delta=0.05)
+        self.assertLess(savings["processed_bytes"] * 10, savings["original_bytes"])
+
+    def test_ffmpeg_shortens_pauses_instead_of_removing_them(self):
+        dst_path = os.path.join(self.tmp_dir.name, "call.ogg")
+        with open(dst_path, "wb") as f:
+            f.write(b"OggS")
+        with mock.patch.object(ingestion.subprocess, "run") as run:
+            self.assertTrue(ingestion._ffmpeg_preprocess("call.mp3", dst_path))
+        cmd = run.call_args[0][0]
+        self.assertIn(f"stop_silence={ingestion.KEEP_SILENCE_SECONDS}", cmd[cmd.index("-af") + 1])
+
+    def test_pdf_text_is_extracted_locally_and_cached(self):
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf)
+        c.drawString(72, 720, "Page one: drivers need GPS tracking.")
+        c.showPage()
+        c.drawString(72, 720, "Page two: Stripe checkout.")
+        c.save()
+        pdf = spool_upload(_Uploaded(buf.getvalue(), "rfp.pdf"))
+
+        text, upload = prepare_generation_input(None, "key", "gemini-2.5-flash", "u1", "Scope this RFP.", pdf)
+        self.assertIsNone(upload)
+        self.assertIn("--- Page 1 ---\nPage one: drivers need GPS tracking.", text)
+        self.assertIn("--- Page 2 ---\nPage two: Stripe checkout.", text)
+
+        # The second read is served from the page cache without parsing the PDF
+        with mock.patch.object(ingestion, "PdfReader", side_effect=AssertionError("re-parsed")):
+            self.assertEqual(len(ingestion.extract_pdf_pages(pdf)), 2)
+        # The page count lives in the same bounded LRU as the pages
+        self.assertEqual(ingestion._PDF_PAGES[(pdf["sha256"], "pages")], 2)
+
+    def test_upload_is_spooled_in_chunks_and_capped(self):
+        data = os.urandom(2500)
+        progress = []
+        with mock.patch.object(ingestion, "SPOOL_CHUNK_BYTES", 1000):
+            upload = spool_upload(_Uploaded(data, "notes.txt"), lambda done, total: progress.append(done))
+        self.assertEqual(progress, [1000, 2000, 2500])
+        with open(upload["path"], "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(upload["sha256"], hashlib.sha256(data).hexdigest())
+
+        with mock.patch.object(ingestion, "MAX_UPLOAD_MB", 0):
+            with self.assertRaises(UploadRejected):
+                spool_upload(_Uploaded(data, "notes.txt"))
+
+if __name__ == "__main__":
+    unittest.main()
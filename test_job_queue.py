@@ -0,0 +1,105 @@
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import ingestion
+import job_queue
+import streamlit as st
+from ai_engine import BACKGROUND, INTERACTIVE
+from generation_jobs import draft_key, speculate_handoff, find_handoff_draft, design_spec_payload, design_handoff_context, pm_ticket_payload, submit_generation
+from test_ingestion import _Uploaded
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_path = job_queue.JOBS_DB_PATH
+        job_queue.JOBS_DB_PATH = os.path.join(self.tmp_dir.name, "jobs.sqlite3")
+
+    def tearDown(self):
+        job_queue.JOBS_DB_PATH = self.original_path
+        self.tmp_dir.cleanup()
+
+    def test_enqueue_deduplicates_pending_jobs(self):
+        first = job_queue.enqueue("pm_ticket", "u1", {"text": "app"}, dedupe_key="k1")
+        second = job_queue.enqueue("pm_ticket", "u1", {"text": "app"}, dedupe_key="k1")
+        other = job_queue.enqueue("pm_ticket", "u1", {"text": "site"}, dedupe_key="k2")
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(job_queue.queue_position(job_queue.get_job(other)), 2)
+
+    def test_worker_runs_handler_and_stores_result(self):
+        def echo(job, context):
+            job_queue.set_progress(job["id"], "Uploading call.wav: 50%")
+            self.assertEqual(job_queue.get_job(job["id"])["progress"], "Uploading call.wav: 50%")
+            return {"echo": job["payload"]["text"]}
+        job_queue.register_handler("echo", echo)
+        job_id = job_queue.enqueue("echo", "u1", {"text": "hello"})
+        conn = job_queue._connect()
+        try:
+            job = job_queue._row_to_job(job_queue._claim_next(conn))
+            job_queue._finish(conn, job["id"], result=job_queue._HANDLERS["echo"](job, {}))
+        finally:
+            conn.close()
+
+        job = job_queue.get_job(job_id)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"], {"echo": "hello"})
+        # Progress is only shown while the job runs
+        self.assertIsNone(job["progress"])
+
+    def test_old_finished_jobs_are_pruned(self):
+        stale = job_queue.enqueue("echo", "u1", {"text": "old"})
+        recent = job_queue.enqueue("echo", "u1", {"text": "new"})
+        pending = job_queue.enqueue("echo", "u1", {"text": "queued"})
+        conn = job_queue._connect()
+        try:
+            job_queue._finish(conn, stale, result={"echo": "old"})
+            job_queue._finish(conn, recent, result={"echo": "new"})
+            conn.execute("UPDATE jobs SET updated_at = updated_at - ? WHERE id = ?", (job_queue.JOB_RETENTION_SECONDS + 1, stale))
+            conn.execute("UPDATE jobs SET updated_at = updated_at - ? WHERE id = ?", (job_queue.JOB_RETENTION_SECONDS + 1, pending))
+            job_queue._prune_finished(conn, time.time())
+        finally:
+            conn.close()
+        self.assertIsNone(job_queue.get_job(stale))
+        self.assertIsNotNone(job_queue.get_job(recent))
+        # Only finished jobs go; an old queued job still runs
+        self.assertIsNotNone(job_queue.get_job(pending))
+
+    def test_hub_submissions_share_one_job_per_input(self):
+        st.session_state.user = SimpleNamespace(id="pm1")
+        payload = pm_ticket_payload("gemini-2.5-flash", "US Agency ($150/hr)", "Balanced", "Food delivery app")
+        first = submit_generation("pm_ticket", payload, "pm_generation_job", parent_id="sales-1")
+        second = submit_generation("pm_ticket", dict(payload), "pm_generation_job", parent_id="sales-1")
+        self.assertEqual(first, second)
+        self.assertEqual(st.session_state.pm_generation_job, first)
+        self.assertEqual(job_queue.get_job(first)["ticket_id"], "sales-1")
+
+        # A refused upload queues nothing and leaves the session's job alone
+        with mock.patch.object(ingestion, "MAX_UPLOAD_MB", 0):
+            self.assertIsNone(submit_generation("pm_ticket", payload, "pm_generation_job", uploaded_file=_Uploaded(b"call", "call.mp3")))
+        self.assertEqual(st.session_state.pm_generation_job, first)
+
+    def test_routed_ticket_gets_a_background_draft(self):
+        ticket = {"id": 7, "user_id": "pm1", "status": "Awaiting UI/UX Scoping", "summary": "Food delivery app", "full_data": '{"summary": "Food delivery app", "mvp_features": ["GPS"]}'}
+        speculate_handoff(ticket)
+
+        # The designer accepting with default settings lands on the pre-generated draft
+        injection_text = design_handoff_context(ticket)
+        queued = job_queue.find_job(draft_key("design_spec", 7, design_spec_payload("gemini-2.5-flash", injection_text)))
+        self.assertEqual(queued["priority"], BACKGROUND)
+        draft = find_handoff_draft("design_spec", 7, design_spec_payload("gemini-2.5-flash", injection_text))
+        self.assertEqual(draft["id"], queued["id"])
+        self.assertTrue(draft["payload"]["draft"])
+
+        # Someone is now waiting on it, so the queued draft moves to interactive priority
+        self.assertEqual(draft["priority"], INTERACTIVE)
+        self.assertEqual(job_queue.get_job(draft["id"])["priority"], INTERACTIVE)
+
+        # Different settings mean different output, so the draft is not reused
+        self.assertIsNone(find_handoff_draft("design_spec", 7, design_spec_payload("gemini-2.5-pro", injection_text)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from utils import convert_currency
+from datetime import datetime, timezone
+from utils import convert_currency, json_diff, apply_json_diff, parse_timestamp
 
 class TestUtils(unittest.TestCase):
     
@@ -15,5 +16,20 @@ class TestUtils(unittest.TestCase):
         # Test graceful failure
         self.assertEqual(convert_currency("invalid", "USD ($)"), "invalid")
 
+    def test_json_diff_round_trip(self):
+        old = {"summary": "CRM", "stories": [{"story": "Login"}], "risks": {"api": "limits", "legal": "GDPR"}}
+        new = {"summary": "CRM v2", "stories": [{"story": "Login"}, {"story": "SSO"}], "risks": {"api": "limits"}, "phase_2": "Mobile"}
+        ops = json_diff(old, new)
+        self.assertEqual(apply_json_diff(old, ops), new)
+        self.assertNotIn(["set", ["risks"], {"api": "limits"}], ops)
+        self.assertEqual(json_diff(new, new), [])
+
+    def test_postgres_timestamps_parse_on_every_python(self):
+        expected = datetime(2026, 10, 19, 6, 14, 7, 123450, tzinfo=timezone.utc)
+        self.assertEqual(parse_timestamp("2026-10-19T06:14:07.12345+00:00"), expected)
+        self.assertEqual(parse_timestamp("2026-10-19T06:14:07.12345Z"), expected)
+        self.assertEqual(parse_timestamp("2026-10-19 06:14:07.12345+00"), expected)
+        self.assertEqual(parse_timestamp("2026-10-19T06:14:07+00:00"), expected.replace(microsecond=0))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import re
 import json
+from datetime import datetime
 
 # ==========================================
 # TEXT, CURRENCY & JSON HELPER FUNCTIONS
@@ -30,6 +31,49 @@ def parse_cost_avg(cost_string):
     except:
         return 0
 
+def parse_budget_range(raw_cost):
+    """'15000-20000' -> (15000, 20000), '$8,000' -> (8000, 8000), no digits -> (0, 0)."""
+    numbers = [int(n) for n in re.findall(r'\d+', str(raw_cost or "").replace(',', ''))]
+    if not numbers:
+        return 0, 0
+    return numbers[0], numbers[1] if len(numbers) > 1 else numbers[0]
+
+def parse_timeline_days(time_str):
+    """'4-6 Weeks' -> (20, 30) working days; (None, None) when there is no number (e.g. 'TBD')."""
+    numbers = [int(n) for n in re.findall(r'\d+', str(time_str or ""))]
+    if not numbers:
+        return None, None
+    lower_str = str(time_str).lower()
+    if "week" in lower_str:
+        per_unit = 5
+    elif "month" in lower_str:
+        per_unit = 20
+    elif "day" in lower_str:
+        per_unit = 1
+    else:
+        per_unit = 5  # Bare numbers are read as weeks
+    low = numbers[0]
+    high = numbers[1] if len(numbers) > 1 else low
+    return low * per_unit, high * per_unit
+
+def parse_timestamp(value):
+    """Parses a PostgREST timestamptz string on Python 3.10 as well as newer versions.
+
+    Postgres drops trailing zeros from the fraction ('06:14:07.12345+00:00'),
+    and 3.10's `datetime.fromisoformat` only takes 3 or 6 fractional digits or
+    a full '+HH:MM' offset, so both are normalised first.
+    """
+    head, fraction, offset = re.match(r'^(.*?\d{2}:\d{2}:\d{2})(?:\.(\d+))?(.*)$', value.strip()).groups()
+    if offset in ("Z", "z"):
+        offset = "+00:00"
+    elif re.fullmatch(r'[+-]\d{2}', offset):
+        offset += ":00"
+    elif re.fullmatch(r'[+-]\d{4}', offset):
+        offset = f"{offset[:3]}:{offset[3:]}"
+    if fraction:
+        head += "." + (fraction + "000000")[:6]
+    return datetime.fromisoformat(head + offset)
+
 def clean_json_output(raw_text):
     text = re.sub(r"^```json\s*", "", raw_text, flags=re.MULTILINE)
     text = re.sub(r"^```\s*", "", text, flags=re.MULTILINE)
@@ -46,6 +90,38 @@ def safe_parse_json(raw_text):
     except Exception as e:
         return None, f"⚠️ An unexpected error occurred: {str(e)}"
 
+def json_diff(old, new, path=()):
+    """Compact patch turning `old` into `new`: a list of ["set", path, value] and ["del", path] ops.
+
+    Objects are diffed key by key; lists and scalars that differ are replaced whole.
+    """
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        return [] if old == new else [["set", list(path), new]]
+    ops = [["del", list(path) + [key]] for key in old if key not in new]
+    for key, value in new.items():
+        if key not in old:
+            ops.append(["set", list(path) + [key], value])
+        else:
+            ops.extend(json_diff(old[key], value, path + (key,)))
+    return ops
+
+def apply_json_diff(doc, ops):
+    """Applies a `json_diff` patch, returning a new document."""
+    doc = json.loads(json.dumps(doc))
+    for op in ops:
+        path = op[1]
+        if not path:
+            doc = op[2] if op[0] == "set" else None
+            continue
+        parent = doc
+        for key in path[:-1]:
+            parent = parent[key]
+        if op[0] == "set":
+            parent[path[-1]] = op[2]
+        else:
+            parent.pop(path[-1], None)
+    return doc
+
 def format_cost_range(raw_cost, currency):
     raw_cost = str(raw_cost)
     if "-" in raw_cost: